@@ -0,0 +1,237 @@
+"""
+Admission control for expensive endpoints.
+
+Each gated endpoint runs at most ``max_concurrent`` requests at once. Extra
+requests wait in a bounded queue that is served round-robin across clients,
+so one client uploading a batch cannot starve everybody else. Requests that
+cannot be queued (queue full, or the client already has too many waiting) or
+that wait longer than ADMISSION_MAX_WAIT_SECONDS are rejected with 503/429 and
+a Retry-After hint. The middleware decides before the request body is read,
+so rejected uploads never get buffered.
+
+Clients are told apart by account (the user id of a bearer token verified
+with Supabase) or, for anonymous callers and invalid tokens, by address taken
+from the trusted X-Forwarded-For hop. Rotating junk tokens therefore doesn't
+buy a fresh per-client quota.
+"""
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import logging
+import math
+import time
+
+from starlette.responses import JSONResponse
+
+from app.auth import token_expiry
+from config import (
+    ADMISSION_LIMITS,
+    ADMISSION_MAX_QUEUED_PER_USER,
+    ADMISSION_MAX_WAIT_SECONDS,
+    ADMISSION_AUTH_CACHE_SECONDS,
+    ADMISSION_AUTH_CACHE_SIZE,
+    TRUSTED_PROXY_HOPS,
+)
+from utils.supabase_client import get_user_from_token
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"Request rejected ({reason}), retry after {self.retry_after}s")
+
+
+class EndpointGate:
+    def __init__(self, path: str, max_concurrent: int, max_queue: int):
+        self.path = path
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "user_limit": 0, "timeout": 0}
+        # Moving average of request duration, used for Retry-After hints
+        self.avg_seconds = 5.0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _retry_after(self) -> float:
+        return self.avg_seconds * (self.queued + 1) / self.max_concurrent
+
+    def _reject(self, status_code: int, reason: str) -> AdmissionRejected:
+        self.rejected[reason] += 1
+        return AdmissionRejected(status_code, reason, self._retry_after())
+
+    def _dispatch(self) -> None:
+        """Admit queued requests in round-robin client order."""
+        while self._queues and self.in_flight < self.max_concurrent:
+            client, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            del self._queues[client]
+            if queue:
+                # Move the client to the back so other clients get the next slot
+                self._queues[client] = queue
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    def _remove(self, client: str, waiter: asyncio.Future) -> None:
+        queue = self._queues.get(client)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[client]
+
+    async def acquire(self, client: str) -> None:
+        if self.in_flight < self.max_concurrent and not self._queues:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if self.queued >= self.max_queue:
+            raise self._reject(503, "queue_full")
+        if len(self._queues.get(client, ())) >= ADMISSION_MAX_QUEUED_PER_USER:
+            raise self._reject(429, "user_limit")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client, deque()).append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=ADMISSION_MAX_WAIT_SECONDS)
+        except asyncio.CancelledError:
+            # Client went away while queued; hand the slot on if it was already granted
+            if waiter.done():
+                self.release(None)
+            else:
+                waiter.cancel()
+                self._remove(client, waiter)
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            self._remove(client, waiter)
+            raise self._reject(503, "timeout")
+        self.admitted += 1
+
+    def release(self, elapsed: Optional[float]) -> None:
+        self.in_flight -= 1
+        if elapsed is not None:
+            self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * elapsed
+        self._dispatch()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_seconds": round(self.avg_seconds, 3),
+        }
+
+
+gates: Dict[str, EndpointGate] = {
+    path: EndpointGate(path, **limits)
+    for path, limits in ADMISSION_LIMITS.items()
+}
+
+
+def admission_snapshot() -> Dict[str, Dict[str, Any]]:
+    return {path: gate.snapshot() for path, gate in gates.items()}
+
+
+# sha256(token) -> (user id, trusted until); never keep the raw token around
+_verified_tokens: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+
+async def _token_user_id(token: str) -> Optional[str]:
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    cached = _verified_tokens.get(digest)
+    now = time.time()
+    if cached and cached[1] > now:
+        _verified_tokens.move_to_end(digest)
+        return cached[0]
+    try:
+        user = await get_user_from_token(token)
+    except Exception:
+        return None
+    if not user:
+        return None
+    expires_at = min(token_expiry(token) or now, now + ADMISSION_AUTH_CACHE_SECONDS)
+    _verified_tokens[digest] = (user.id, expires_at)
+    _verified_tokens.move_to_end(digest)
+    while len(_verified_tokens) > ADMISSION_AUTH_CACHE_SIZE:
+        _verified_tokens.popitem(last=False)
+    return user.id
+
+
+def _client_address(scope: Dict[str, Any]) -> str:
+    if TRUSTED_PROXY_HOPS:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                hops = [hop.strip() for hop in value.decode("latin-1").split(",") if hop.strip()]
+                # Entries left of the ones our own proxies appended are client-controlled
+                if len(hops) >= TRUSTED_PROXY_HOPS:
+                    return hops[-TRUSTED_PROXY_HOPS]
+                break
+    client = scope.get("client")
+    return client[0] if client else "anonymous"
+
+
+async def _client_key(scope: Dict[str, Any]) -> str:
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                user_id = await _token_user_id(token.strip())
+                if user_id:
+                    return f"user:{user_id}"
+            break
+    return f"ip:{_client_address(scope)}"
+
+
+class AdmissionControlMiddleware:
+    """Pure ASGI middleware so the gate runs before anything reads the request body."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        gate = gates.get(scope.get("path")) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        client = await _client_key(scope)
+        try:
+            await gate.acquire(client)
+        except AdmissionRejected as rejected:
+            logger.warning(f"Admission rejected for {gate.path}: reason={rejected.reason}, client={client}")
+            detail = (
+                "Too many requests in progress for this client, please retry shortly"
+                if rejected.status_code == 429
+                else "Server is at capacity, please retry shortly"
+            )
+            response = JSONResponse(
+                status_code=rejected.status_code,
+                content={"error": detail, "status_code": rejected.status_code},
+                headers={"Retry-After": str(rejected.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release(time.monotonic() - started)
@@ -1,14 +1,26 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, status
+from fastapi import FastAPI, Depends, File, UploadFile, HTTPException, Header, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from core.models import APIResponse, ErrorResponse, ModelTestRequest
 from core.summarizer import generate_summary, create_gemini_llm, create_groq_llm
 from core.models import SummaryResponse
-from config import GEMINI_MODEL_NAME, WHISPER_MODEL_SIZE, GROQ_MODEL_NAME
+from core.rate_limiter import RateLimitExceeded
+from config import GEMINI_MODEL_NAME, WHISPER_MODEL_SIZE, GROQ_MODEL_NAME, AUDIO_REQUEST_DEADLINE_SECONDS
 from utils.validation import validate_audio_file
-from app import auth, storage, chat_history, chat_query
-from utils.audio import transcribe_audio_simple
+from app import auth, storage, chat_history, chat_query, chat_session
+from app.auth import AuthContext, get_optional_user
+from app.admission import AdmissionControlMiddleware, admission_snapshot
+from core.rate_limiter import governors
+from core.warmup import run_warmup, is_ready, readiness_snapshot
+from utils.audio import transcribe_audio_simple, file_sha256
+from utils.idempotency import run_idempotent, IdempotencyConflict, IdempotencyInProgress
+from utils.cancellation import CancelToken, OperationCancelled, cancel_on_disconnect
+from contextlib import asynccontextmanager
+from typing import Optional
+import asyncio
 import os
+import threading
 import tempfile
 import shutil
 import logging
@@ -30,6 +42,7 @@ app.include_router(auth.router)
 app.include_router(storage.router)
 app.include_router(chat_history.router)
 app.include_router(chat_query.router)
+app.include_router(chat_session.router)
 
 
 # Handle OPTIONS requests for CORS preflight
@@ -48,6 +61,9 @@ async def options_handler(full_path: str):
     )
 
 
+# Bound concurrent transcriptions/uploads; added before CORS so rejections still get CORS headers
+app.add_middleware(AdmissionControlMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -81,6 +97,25 @@ def save_upload_file_tmp(upload_file: UploadFile) -> Path:
         upload_file.file.close()
 
 
+@asynccontextmanager
+async def request_cancel_token(request: Request, watch_disconnect: bool = True):
+    """Token that fires at the request deadline or, optionally, when the client disconnects."""
+    token = CancelToken(AUDIO_REQUEST_DEADLINE_SECONDS)
+    watcher = asyncio.create_task(cancel_on_disconnect(request, token)) if watch_disconnect else None
+    try:
+        yield token
+    finally:
+        if watcher:
+            watcher.cancel()
+
+
+def cancelled_http_exception(oc: OperationCancelled) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail=f"Processing stopped: {oc.reason}"
+    )
+
+
 @app.get("/", tags=["Root"])
 async def root():
     logger.debug("Root endpoint accessed")
@@ -100,6 +135,24 @@ async def health_check():
         "version": "1.0.0"
     }
 
+@app.get("/ready", tags=["Health"])
+async def readiness_check():
+    """Readiness probe: 503 until startup warm-up has loaded the models."""
+    body = readiness_snapshot()
+    body["status"] = "ready" if body["ready"] else "warming_up"
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if is_ready() else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=body
+    )
+
+@app.get("/metrics", tags=["Health"])
+async def metrics():
+    """Queue depth, in-flight counts and rejections for gated endpoints and LLM providers."""
+    return {
+        "admission": admission_snapshot(),
+        "llm_providers": {provider: governor.snapshot() for provider, governor in governors.items()}
+    }
+
 @app.post("/models", response_model=APIResponse, tags=["Model"])
 async def model_check(request: ModelTestRequest):
     """Test LLM model connectivity and functionality."""
@@ -151,7 +204,11 @@ async def model_check(request: ModelTestRequest):
 
 @app.post("/summarize", response_model=SummaryResponse, tags=["Summarization"])
 async def summarize_audio(
-    audio_file: UploadFile = File(..., description="Audio file (.wav, .mp3, .m4a, .flac,.ogg)")):
+    request: Request,
+    response: Response,
+    audio_file: UploadFile = File(..., description="Audio file (.wav, .mp3, .m4a, .flac,.ogg)"),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
+    auth: Optional[AuthContext] = Depends(get_optional_user)):
     
     logger.info(f"Summarization request received: file={audio_file.filename}")
     # Validate file
@@ -161,9 +218,45 @@ async def summarize_audio(
     try:
         tmp_file_path = save_upload_file_tmp(audio_file)
         logger.debug(f"Processing audio file at: {tmp_file_path}")
-        summary_response = generate_summary(str(tmp_file_path))
+        # Rate-limit fairness is per account; anonymous requests share one bucket rather than
+        # being keyed on the peer IP, which behind a load balancer is the proxy's address
+        user_id = auth.id if auth else None
+        # With an Idempotency-Key a retry can pick the result up, so only the deadline stops the work
+        async with request_cancel_token(request, watch_disconnect=not idempotency_key) as cancel_token:
+            # Run off the event loop so queued LLM calls don't block other requests
+            run = lambda: run_in_threadpool(
+                generate_summary, str(tmp_file_path), user_id=user_id, cancel_token=cancel_token
+            )
+            if not idempotency_key:
+                summary_response = await run()
+            else:
+                fingerprint = await run_in_threadpool(file_sha256, str(tmp_file_path))
+                # Keys are scoped to the account, or to the audio itself for anonymous callers, so
+                # a retry attaches to its own job whichever address it arrives from
+                scope = f"summarize:user:{auth.id}" if auth else f"summarize:file:{fingerprint}"
+                summary_response, replayed = await run_idempotent(scope, idempotency_key, fingerprint, run)
+                if replayed:
+                    response.headers["Idempotent-Replayed"] = "true"
         logger.info(f"Summary generated successfully for: {audio_file.filename}")
         return summary_response
+    except OperationCancelled as oc:
+        logger.info(f"Summarization cancelled for {audio_file.filename}: {oc.reason}")
+        raise cancelled_http_exception(oc)
+    except IdempotencyConflict as ic:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(ic))
+    except IdempotencyInProgress as ip:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(ip),
+            headers={"Retry-After": str(ip.retry_after)}
+        )
+    except RateLimitExceeded as rle:
+        logger.warning(f"Summarization rate limited for {audio_file.filename}: {str(rle)}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="LLM providers are at capacity, please retry shortly",
+            headers={"Retry-After": str(rle.retry_after)}
+        )
     except ValueError as ve:
         logger.warning(f"Validation error for {audio_file.filename}: {str(ve)}")
         raise HTTPException(
@@ -184,7 +277,7 @@ async def summarize_audio(
                 pass
 
 @app.post("/transcript", tags=['Transcript'])
-async def get_transcript(audio_file: UploadFile = File(...)):
+async def get_transcript(request: Request, audio_file: UploadFile = File(...)):
     
     logger.info(f"Transcript request received: file={audio_file.filename}")
     # Validate file
@@ -194,9 +287,15 @@ async def get_transcript(audio_file: UploadFile = File(...)):
     try:
         tmp_file_path=save_upload_file_tmp(audio_file)
         logger.debug(f"Transcribing audio file at: {tmp_file_path}")
-        transcript_response=transcribe_audio_simple(str(tmp_file_path))
+        async with request_cancel_token(request) as cancel_token:
+            transcript_response = await run_in_threadpool(
+                transcribe_audio_simple, str(tmp_file_path), cancel_token=cancel_token
+            )
         logger.info(f"Transcript generated successfully for: {audio_file.filename}")
         return transcript_response
+    except OperationCancelled as oc:
+        logger.info(f"Transcription cancelled for {audio_file.filename}: {oc.reason}")
+        raise cancelled_http_exception(oc)
     except Exception as e:
         logger.error(f"Transcription failed for {audio_file.filename}: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -204,12 +303,19 @@ async def get_transcript(audio_file: UploadFile = File(...)):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to process audio file: {str(e)}"
         ))
+    finally:
+        if tmp_file_path and tmp_file_path.exists():
+            try:
+                os.unlink(tmp_file_path)
+            except Exception:
+                pass
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     return JSONResponse(
         status_code=exc.status_code,
-        content={"error": exc.detail, "status_code": exc.status_code}
+        content={"error": exc.detail, "status_code": exc.status_code},
+        headers=getattr(exc, "headers", None)
     )
 
 @app.exception_handler(Exception)
@@ -225,6 +331,9 @@ async def general_exception_handler(request, exc):
 
 @app.on_event("startup")
 async def startup_event():
+    # Warm up in the background so /health answers immediately; /ready flips once it's done.
+    # A daemon thread rather than the threadpool, since it keeps retrying until Whisper is usable.
+    threading.Thread(target=run_warmup, name="warmup", daemon=True).start()
     logger.info("🟢 FastAPI application startup complete")
     logger.info("All routers registered and middleware configured")
 
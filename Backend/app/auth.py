@@ -7,10 +7,14 @@ from utils.supabase_client import (
     sign_up_user, sign_in_user, sign_out_user, get_user_from_token
 )
 from utils.auth_helpers import create_user_response
+from typing import Optional
+import base64
+import json
 import logging
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 @router.post("/signup", response_model=AuthResponse, status_code=status.HTTP_201_CREATED)
 async def signup(user_data: UserSignUp):
@@ -123,6 +127,16 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Invalid or expired token"
         )
 
+def token_expiry(token: str) -> Optional[float]:
+    """``exp`` claim of a JWT as a unix timestamp. Only trust it once Supabase has verified the token."""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except Exception:
+        return None
+
+
 # Dependency for protected routes
 class AuthContext:
     """Context object containing authenticated user and access token."""
@@ -156,3 +170,17 @@ async def get_authenticated_user(
             detail="Authentication failed",
             headers={"WWW-Authenticate": "Bearer"}
         )
+
+
+async def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> Optional[AuthContext]:
+    """Authenticated user for endpoints that also accept anonymous requests, else None."""
+    if credentials is None:
+        return None
+    try:
+        user = await get_user_from_token(credentials.credentials)
+    except Exception as e:
+        logger.debug(f"Ignoring invalid bearer token on optional-auth endpoint: {str(e)}")
+        return None
+    return AuthContext(user=user, access_token=credentials.credentials) if user else None
@@ -1,97 +1,50 @@
 from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
 from core.models import ChatQueryRequest, ChatQueryResponse, SourceDocument
-from core.chatbot import process_query, process_query_with_context
+from core.chatbot import process_query, process_query_with_context, retrieve_call_chunks
+from core.rate_limiter import RateLimitExceeded
+from core.analytics import detect_aggregate_intent, format_aggregate_answer
+from core.answer_cache import answer_scope, content_version, lookup_answer, store_answer
 from app.auth import get_authenticated_user, AuthContext
-from utils.supabase_client import get_records
+from utils.supabase_client import get_records, call_rpc
+from utils.context_packer import pack_user_context
+from utils.single_flight import SingleFlight
+import hashlib
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chat", tags=["Chatbot"])
 
+chat_flight = SingleFlight("chat")
 
-def build_user_context(audio_files: list, selected_call_id: str = None) -> str:
-    """Build context string from user's audio files, prioritizing selected call"""
-    if not audio_files:
-        return ""
-    
-    # Separate selected call from others
-    selected_call = None
-    other_calls = []
-    
-    for file in audio_files:
-        if selected_call_id and file.get('id') == selected_call_id:
-            selected_call = file
-        else:
-            other_calls.append(file)
-    
-    context_parts = []
-    
-    # If there's a selected call, put it first with clear marking
-    if selected_call:
-        context_parts.append("=== CURRENTLY SELECTED CALL (User is viewing this call) ===\n")
-        context_parts.append(f"Filename: {selected_call.get('filename', 'Unknown')}")
-        context_parts.append(f"Created: {selected_call.get('created_at', 'Unknown')}")
-        
-        if selected_call.get('summary'):
-            context_parts.append(f"\nSummary: {selected_call['summary']}")
-        
-        if selected_call.get('duration_minutes'):
-            context_parts.append(f"Duration: {selected_call['duration_minutes']} minutes")
-        
-        if selected_call.get('no_of_participants'):
-            context_parts.append(f"Participants: {selected_call['no_of_participants']}")
-        
-        if selected_call.get('sentiment'):
-            context_parts.append(f"Sentiment: {selected_call['sentiment']}")
-        
-        if selected_call.get('key_aspects'):
-            aspects = selected_call['key_aspects']
-            if isinstance(aspects, list):
-                context_parts.append(f"Key Points: {', '.join(aspects)}")
-            elif isinstance(aspects, str):
-                context_parts.append(f"Key Points: {aspects}")
-        
-        if selected_call.get('transcript'):
-            # Include more of the transcript for selected call
-            transcript = selected_call['transcript'][:5000]
-            context_parts.append(f"\nTranscript: {transcript}")
-        
-        context_parts.append("\n" + "="*60 + "\n")
-    
-    # Add other calls
-    if other_calls:
-        context_parts.append("\n=== OTHER RECENT CALLS ===\n")
-        
-        for file in other_calls[:5]:  # Limit to 5 other calls to avoid token limits
-            context_parts.append(f"\n--- Call: {file.get('filename', 'Unknown')} ---")
-            context_parts.append(f"Created: {file.get('created_at', 'Unknown')}")
-            
-            if file.get('summary'):
-                context_parts.append(f"Summary: {file['summary']}")
-            
-            if file.get('duration_minutes'):
-                context_parts.append(f"Duration: {file['duration_minutes']} minutes")
-            
-            if file.get('no_of_participants'):
-                context_parts.append(f"Participants: {file['no_of_participants']}")
-            
-            if file.get('sentiment'):
-                context_parts.append(f"Sentiment: {file['sentiment']}")
-            
-            if file.get('key_aspects'):
-                aspects = file['key_aspects']
-                if isinstance(aspects, list):
-                    context_parts.append(f"Key Points: {', '.join(aspects)}")
-                elif isinstance(aspects, str):
-                    context_parts.append(f"Key Points: {aspects}")
-            
-            # Include less transcript for other calls
-            if file.get('transcript'):
-                transcript = file['transcript'][:1000]
-                context_parts.append(f"Transcript excerpt: {transcript}...")
-    
-    return "\n".join(context_parts)
+
+def build_user_context(
+    audio_files: list,
+    question: str,
+    selected_call_id: str = None,
+    retrieved_chunks: list = None
+) -> str:
+    """Build a token-budgeted context string from the user's calls, ranked against the question"""
+    call_windows = None
+    if retrieved_chunks:
+        call_windows = {}
+        for chunk in sorted(retrieved_chunks, key=lambda c: c.get("chunk_index") or 0):
+            call_windows.setdefault(chunk["audio_file_id"], []).append(chunk["content"])
+    return pack_user_context(audio_files, question, selected_call_id, call_windows=call_windows)
+
+
+def chat_request_key(request: ChatQueryRequest, user_id: str) -> str:
+    payload = json.dumps({
+        "user_id": user_id,
+        "question": request.question,
+        "history": [(m.role, m.content) for m in request.chat_history or []],
+        "model_choice": request.model_choice,
+        "selected_call_id": request.selected_call_id,
+        "conversation_id": request.conversation_id,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
 
 @router.post("/query", response_model=ChatQueryResponse)
@@ -99,8 +52,30 @@ async def query_chatbot(
     request: ChatQueryRequest,
     auth: AuthContext = Depends(get_authenticated_user)
 ):
+    # Identical concurrent requests (double submits, client retries) share one answer
+    return await chat_flight.do_async(
+        chat_request_key(request, auth.id),
+        lambda: _run_chat_query(request, auth)
+    )
+
+
+async def _run_chat_query(request: ChatQueryRequest, auth: AuthContext) -> ChatQueryResponse:
     logger.info(f"Chat query received from user_id: {auth.id}, question: {request.question[:50]}..., selected_call: {request.selected_call_id}")
     try:
+        # Aggregate questions (counts, minutes, sentiment over a period) are answered exactly from SQL
+        aggregate = detect_aggregate_intent(request.question, selected_call_id=request.selected_call_id)
+        if aggregate:
+            try:
+                rows = await call_rpc("call_stats", aggregate.rpc_params(auth.id))
+                logger.info(f"Answered aggregate query from SQL: metric={aggregate.metric}, period={aggregate.period}")
+                return ChatQueryResponse(
+                    answer=format_aggregate_answer(aggregate, rows),
+                    sources=[],
+                    model_used="sql"
+                )
+            except Exception as e:
+                logger.warning(f"Aggregate query failed, falling back to LLM: {str(e)}")
+
         # Fetch user's audio files to provide context
         audio_files = await get_records(
             table="audio_files",
@@ -109,8 +84,38 @@ async def query_chatbot(
         
         logger.debug(f"Fetched {len(audio_files)} audio files for user {auth.id}")
         
-        # Build context from user's calls, prioritizing selected call
-        user_context = build_user_context(audio_files, request.selected_call_id)
+        # Context-free questions can be served from the answer cache; follow-ups depend on the conversation
+        cache_key = None
+        if audio_files and not request.chat_history:
+            scope = answer_scope(request.selected_call_id)
+            version = content_version(audio_files, request.selected_call_id)
+            model = request.model_choice or "gemini"
+            cached, embedding = await run_in_threadpool(
+                lookup_answer, auth.id, scope, version, model, request.question
+            )
+            if cached:
+                logger.info(f"Chat query served from answer cache for user_id: {auth.id}")
+                return ChatQueryResponse(**cached)
+            cache_key = (scope, version, model, embedding)
+        
+        # Retrieve relevant transcript chunks from this user's indexed calls
+        retrieved_chunks = []
+        if audio_files:
+            try:
+                retrieved_chunks = await run_in_threadpool(
+                    retrieve_call_chunks,
+                    request.question,
+                    auth.id,
+                    request.selected_call_id
+                )
+                logger.debug(f"Retrieved {len(retrieved_chunks)} transcript chunks for user {auth.id}")
+            except Exception as e:
+                logger.warning(f"Chunk retrieval failed, falling back to local transcript windows: {str(e)}")
+        
+        # Build context from user's calls, ranked against the question, prioritizing selected call
+        user_context = build_user_context(
+            audio_files, request.question, request.selected_call_id, retrieved_chunks
+        )
         
         chat_history = None
         if request.chat_history:
@@ -122,19 +127,25 @@ async def query_chatbot(
         # Use direct context-based query if user has audio files
         if user_context:
             logger.info(f"Using direct context query with {len(audio_files)} files, selected_call: {request.selected_call_id}")
-            result = process_query_with_context(
+            result = await run_in_threadpool(
+                process_query_with_context,
                 question=request.question,
                 user_context=user_context,
                 chat_history=chat_history,
-                model_choice=request.model_choice or "gemini"
+                model_choice=request.model_choice or "gemini",
+                user_id=auth.id,
+                conversation_id=request.conversation_id
             )
         else:
             # Fallback to vector store query if no user files
             logger.info("No user files found, using vector store query")
-            result = process_query(
+            result = await run_in_threadpool(
+                process_query,
                 question=request.question,
                 chat_history=chat_history,
-                model_choice=request.model_choice or "gemini"
+                model_choice=request.model_choice or "gemini",
+                user_id=auth.id,
+                conversation_id=request.conversation_id
             )
         
         sources = [
@@ -144,12 +155,37 @@ async def query_chatbot(
             )
             for src in result.get("sources", [])
         ]
+        if user_context and retrieved_chunks:
+            sources += [
+                SourceDocument(
+                    content=chunk["content"],
+                    metadata={
+                        "audio_file_id": chunk["audio_file_id"],
+                        "chunk_index": chunk["chunk_index"],
+                        "score": chunk["score"]
+                    }
+                )
+                for chunk in retrieved_chunks
+            ]
         logger.info(f"Chat query processed successfully, model: {result['model_used']}, files_context: {len(audio_files)}")
-        return ChatQueryResponse(
+        response = ChatQueryResponse(
             answer=result["answer"],
             sources=sources,
             model_used=result["model_used"]
         )
+        if cache_key:
+            scope, version, model, embedding = cache_key
+            await run_in_threadpool(
+                store_answer, auth.id, scope, version, model, request.question, response.model_dump(), embedding
+            )
+        return response
+    except RateLimitExceeded as rle:
+        logger.warning(f"Chat query rate limited for user_id: {auth.id}: {str(rle)}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="LLM providers are at capacity, please retry shortly",
+            headers={"Retry-After": str(rle.retry_after)}
+        )
     except Exception as e:  
         logger.error(f"Chatbot query error: {str(e)}", exc_info=True)
         raise HTTPException(
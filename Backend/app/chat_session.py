@@ -0,0 +1,410 @@
+"""
+WebSocket chat sessions.
+
+A session keeps its conversation history, the user's call rows and the selected
+call in server memory. Each turn sends only the question and streams the answer
+back; turns are persisted to chat_conversations/chat_messages in the background.
+Idle sessions are evicted, and reconnecting to a live session reuses its state
+without touching the database.
+
+Protocol (JSON messages):
+    client -> {"type": "start", "token": "...", "conversation_id"?, "selected_call_id"?, "model_choice"?}
+    server <- {"type": "session", "conversation_id": ..., "messages": n}
+    client -> {"type": "question", "question": "...", "selected_call_id"?, "model_choice"?}
+    server <- {"type": "start", "provider": ...}   (again on failover: discard partial output)
+    server <- {"type": "token", "content": "..."}  (repeated)
+    server <- {"type": "answer", "answer": ..., "model_used": ..., "sources": [...]}
+    client -> {"type": "select_call", "call_id": ...} | {"type": "refresh"}
+    client -> {"type": "auth", "token": "..."}    (refreshed access token for the same user)
+    server <- {"type": "auth", "expires_at": ...}
+    server <- {"type": "error", "detail": ..., "retry_after"?, "code"?}
+
+The access token is re-checked every CHAT_SESSION_REAUTH_SECONDS and when its
+expiry passes; questions are then refused with code "auth_expired" until the
+client sends a fresh token. A selected call must be one of the user's calls,
+otherwise the selection (and a question carrying it) is refused with code
+"unknown_call"; malformed messages get an error frame. Turns are persisted with the service client scoped
+to the session's user, so they don't depend on the token still being valid.
+"""
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from core.analytics import detect_aggregate_intent, format_aggregate_answer
+from core.chatbot import stream_query_with_context, retrieve_call_chunks
+from core.rate_limiter import RateLimitExceeded
+from app.auth import AuthContext, token_expiry
+from app.chat_query import build_user_context
+from utils.cancellation import CancelToken
+from utils.supabase_client import (
+    get_user_from_token,
+    get_records,
+    insert_service_record,
+    update_user_record,
+    call_rpc,
+)
+from config import (
+    CHAT_SESSION_IDLE_SECONDS,
+    CHAT_SESSION_MAX,
+    CHAT_SESSION_FILES_TTL_SECONDS,
+    CHAT_SESSION_REAUTH_SECONDS,
+)
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+import asyncio
+import contextlib
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/chat", tags=["Chat Session"])
+
+
+class ChatSession:
+    def __init__(self, auth: AuthContext, conversation_id: Optional[str], history: List[Dict[str, str]]):
+        self.auth = auth
+        self.user_id = auth.id
+        self.token_expires_at = token_expiry(auth.access_token)
+        self.auth_checked_at = time.monotonic()
+        self.conversation_id = conversation_id or str(uuid.uuid4())
+        self.persisted = conversation_id is not None
+        self.history = history
+        self.selected_call_id: Optional[str] = None
+        self.model_choice = "gemini"
+        self.audio_files: Optional[List[Dict[str, Any]]] = None
+        self.files_loaded_at = 0.0
+        self.last_active = time.monotonic()
+        self.connections = 0
+        self.lock = asyncio.Lock()
+        self.persist_lock = asyncio.Lock()
+
+    def set_auth(self, auth: AuthContext) -> None:
+        self.auth = auth
+        self.token_expires_at = token_expiry(auth.access_token)
+        self.auth_checked_at = time.monotonic()
+
+    async def auth_valid(self) -> bool:
+        if self.token_expires_at is not None and time.time() >= self.token_expires_at:
+            return False
+        if time.monotonic() - self.auth_checked_at < CHAT_SESSION_REAUTH_SECONDS:
+            return True
+        try:
+            # Catches revoked sessions and signed-out users, not just expiry
+            await get_user_from_token(self.auth.access_token)
+        except Exception:
+            return False
+        self.auth_checked_at = time.monotonic()
+        return True
+
+    async def get_audio_files(self) -> List[Dict[str, Any]]:
+        if self.audio_files is None or time.monotonic() - self.files_loaded_at > CHAT_SESSION_FILES_TTL_SECONDS:
+            self.audio_files = await get_records(table="audio_files", filters={"user_id": self.user_id})
+            self.files_loaded_at = time.monotonic()
+            logger.debug(f"Session {self.conversation_id} loaded {len(self.audio_files)} audio files")
+        return self.audio_files
+
+
+_sessions: Dict[str, ChatSession] = {}
+_sweeper: Optional[asyncio.Task] = None
+# Strong references so fire-and-forget persistence tasks aren't garbage collected mid-flight
+_background_tasks: set = set()
+
+
+async def _sweep_idle_sessions():
+    while True:
+        await asyncio.sleep(min(60, CHAT_SESSION_IDLE_SECONDS))
+        now = time.monotonic()
+        idle = [
+            cid for cid, s in _sessions.items()
+            if s.connections == 0 and now - s.last_active > CHAT_SESSION_IDLE_SECONDS
+        ]
+        for cid in idle:
+            _sessions.pop(cid, None)
+        if idle:
+            logger.info(f"Evicted {len(idle)} idle chat sessions, {len(_sessions)} active")
+
+
+def _ensure_sweeper():
+    global _sweeper
+    if _sweeper is None or _sweeper.done():
+        _sweeper = asyncio.create_task(_sweep_idle_sessions())
+
+
+def _evict_for_capacity():
+    if len(_sessions) < CHAT_SESSION_MAX:
+        return
+    idle = sorted((s for s in _sessions.values() if s.connections == 0), key=lambda s: s.last_active)
+    for s in idle[: len(_sessions) - CHAT_SESSION_MAX + 1]:
+        _sessions.pop(s.conversation_id, None)
+
+
+async def _open_session(auth: AuthContext, conversation_id: Optional[str]) -> ChatSession:
+    session = _sessions.get(conversation_id) if conversation_id else None
+    if session is not None:
+        if session.user_id != auth.id:
+            raise PermissionError("Conversation not found")
+        session.set_auth(auth)
+        return session
+
+    history = []
+    if conversation_id:
+        conversations = await get_records(
+            table="chat_conversations",
+            filters={"id": conversation_id, "user_id": auth.id}
+        )
+        if not conversations:
+            raise PermissionError("Conversation not found")
+        messages = await get_records(
+            table="chat_messages",
+            filters={"conversation_id": conversation_id},
+            order_by="created_at"
+        )
+        history = [{"role": m["role"], "content": m["content"]} for m in messages]
+
+    _evict_for_capacity()
+    session = ChatSession(auth, conversation_id, history)
+    _sessions[session.conversation_id] = session
+    return session
+
+
+async def _persist_turn(session: ChatSession, question: str, answer: str, audio_file_id: Optional[str]):
+    # Serialised per session so the conversation row exists before its messages
+    async with session.persist_lock:
+        try:
+            now = datetime.utcnow().isoformat()
+            # The conversation belongs to session.user_id (created here or ownership-checked on open)
+            if not session.persisted:
+                await insert_service_record("chat_conversations", {
+                    "id": session.conversation_id,
+                    "user_id": session.user_id,
+                    "title": question[:80],
+                    "created_at": now,
+                    "updated_at": now
+                })
+                session.persisted = True
+            else:
+                await update_user_record(
+                    "chat_conversations", session.conversation_id, session.user_id, {"updated_at": now}
+                )
+            for role, content in (("user", question), ("assistant", answer)):
+                await insert_service_record("chat_messages", {
+                    "id": str(uuid.uuid4()),
+                    "conversation_id": session.conversation_id,
+                    "role": role,
+                    "content": content,
+                    "audio_file_id": audio_file_id,
+                    "created_at": datetime.utcnow().isoformat()
+                })
+        except Exception:
+            logger.exception(f"Persisting chat turn failed for conversation_id={session.conversation_id}")
+
+
+async def _select_call(websocket: WebSocket, session: ChatSession, call_id: Any) -> bool:
+    """Select one of the user's calls (a falsy id clears the selection). False if it isn't theirs."""
+    if call_id:
+        try:
+            audio_files = await session.get_audio_files()
+        except Exception as e:
+            logger.error(f"Loading calls failed for conversation_id={session.conversation_id}: {str(e)}")
+            await websocket.send_json({"type": "error", "detail": "Failed to load calls"})
+            return False
+        if not isinstance(call_id, str) or not any(f.get("id") == call_id for f in audio_files):
+            await websocket.send_json({"type": "error", "detail": "Unknown call", "code": "unknown_call"})
+            return False
+    session.selected_call_id = call_id or None
+    return True
+
+
+async def _answer(websocket: WebSocket, session: ChatSession, question: str) -> Dict[str, Any]:
+    aggregate = detect_aggregate_intent(question, selected_call_id=session.selected_call_id)
+    if aggregate:
+        try:
+            rows = await call_rpc("call_stats", aggregate.rpc_params(session.user_id))
+            return {"answer": format_aggregate_answer(aggregate, rows), "sources": [], "model_used": "sql"}
+        except Exception as e:
+            logger.warning(f"Aggregate query failed, falling back to LLM: {str(e)}")
+
+    audio_files = await session.get_audio_files()
+    retrieved_chunks = []
+    if audio_files:
+        try:
+            retrieved_chunks = await run_in_threadpool(
+                retrieve_call_chunks, question, session.user_id, session.selected_call_id
+            )
+        except Exception as e:
+            logger.warning(f"Chunk retrieval failed, falling back to local transcript windows: {str(e)}")
+    user_context = build_user_context(audio_files, question, session.selected_call_id, retrieved_chunks)
+
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def on_event(kind: str, data: str):
+        loop.call_soon_threadsafe(events.put_nowait, (kind, data))
+
+    cancel_token = CancelToken()
+
+    def worker():
+        try:
+            return stream_query_with_context(
+                question,
+                user_context,
+                on_event,
+                chat_history=session.history,
+                model_choice=session.model_choice,
+                user_id=session.user_id,
+                conversation_id=session.conversation_id,
+                cancel_token=cancel_token
+            )
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+
+    task = asyncio.ensure_future(run_in_threadpool(worker))
+    try:
+        while (event := await events.get()) is not None:
+            kind, data = event
+            if kind == "start":
+                await websocket.send_json({"type": "start", "provider": data})
+            else:
+                await websocket.send_json({"type": "token", "content": data})
+    except BaseException:
+        # The client is gone: stop the stream at its next chunk and reap the worker
+        cancel_token.cancel("client disconnected")
+        with contextlib.suppress(BaseException):
+            await task
+        raise
+    result = await task
+
+    result["sources"] = [
+        {
+            "content": chunk["content"],
+            "metadata": {
+                "audio_file_id": chunk["audio_file_id"],
+                "chunk_index": chunk["chunk_index"],
+                "score": chunk["score"]
+            }
+        }
+        for chunk in retrieved_chunks
+    ]
+    return result
+
+
+@router.websocket("/session")
+async def chat_session(websocket: WebSocket):
+    await websocket.accept()
+    _ensure_sweeper()
+
+    try:
+        start = await websocket.receive_json()
+        if start.get("type") != "start" or not start.get("token"):
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Expected start message with token")
+            return
+        user = await get_user_from_token(start["token"])
+        auth = AuthContext(user=user, access_token=start["token"])
+        session = await _open_session(auth, start.get("conversation_id"))
+    except WebSocketDisconnect:
+        return
+    except Exception as e:
+        logger.warning(f"Chat session rejected: {str(e)}")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Authentication failed")
+        return
+
+    if start.get("model_choice") in ("gemini", "groq"):
+        session.model_choice = start["model_choice"]
+
+    session.connections += 1
+    logger.info(f"Chat session opened: conversation_id={session.conversation_id}, user_id={session.user_id}")
+    try:
+        await websocket.send_json({
+            "type": "session",
+            "conversation_id": session.conversation_id,
+            "messages": len(session.history)
+        })
+        if start.get("selected_call_id"):
+            await _select_call(websocket, session, start["selected_call_id"])
+
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except (ValueError, KeyError):
+                # Not JSON, or a binary frame
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+            if not isinstance(message, dict):
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+            session.last_active = time.monotonic()
+            kind = message.get("type")
+
+            if kind == "select_call":
+                await _select_call(websocket, session, message.get("call_id"))
+                continue
+            if kind == "refresh":
+                session.audio_files = None
+                continue
+            if kind == "auth":
+                try:
+                    user = await get_user_from_token(message.get("token") or "")
+                    if user.id != session.user_id:
+                        raise PermissionError("Token belongs to a different user")
+                except Exception as e:
+                    logger.warning(f"Chat session re-auth failed for conversation_id={session.conversation_id}: {str(e)}")
+                    await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Authentication failed")
+                    return
+                session.set_auth(AuthContext(user=user, access_token=message["token"]))
+                await websocket.send_json({"type": "auth", "expires_at": session.token_expires_at})
+                continue
+            question = message.get("question")
+            if kind != "question" or not isinstance(question, str) or not question.strip():
+                await websocket.send_json({"type": "error", "detail": "Expected a question message"})
+                continue
+
+            if "selected_call_id" in message and not await _select_call(
+                websocket, session, message["selected_call_id"]
+            ):
+                continue
+            if message.get("model_choice") in ("gemini", "groq"):
+                session.model_choice = message["model_choice"]
+            question = question.strip()
+
+            if not await session.auth_valid():
+                await websocket.send_json({
+                    "type": "error",
+                    "detail": "Access token expired, send a refreshed token",
+                    "code": "auth_expired"
+                })
+                continue
+
+            async with session.lock:
+                try:
+                    result = await _answer(websocket, session, question)
+                except RateLimitExceeded as rle:
+                    logger.warning(f"Chat session rate limited for user_id: {session.user_id}: {str(rle)}")
+                    await websocket.send_json({
+                        "type": "error",
+                        "detail": "LLM providers are at capacity, please retry shortly",
+                        "retry_after": rle.retry_after
+                    })
+                    continue
+                except WebSocketDisconnect:
+                    raise
+                except Exception as e:
+                    logger.error(f"Chat session query error: {str(e)}", exc_info=True)
+                    await websocket.send_json({"type": "error", "detail": "Failed to process chatbot query"})
+                    continue
+
+                session.history += [
+                    {"role": "user", "content": question},
+                    {"role": "assistant", "content": result["answer"]}
+                ]
+
+            await websocket.send_json({"type": "answer", **result})
+            task = asyncio.create_task(_persist_turn(session, question, result["answer"], session.selected_call_id))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+            session.last_active = time.monotonic()
+
+    except WebSocketDisconnect:
+        logger.info(f"Chat session disconnected: conversation_id={session.conversation_id}")
+    finally:
+        session.connections -= 1
+        session.last_active = time.monotonic()
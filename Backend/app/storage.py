@@ -3,25 +3,41 @@ Storage API Endpoints
 Upload, list, fetch and delete audio files using Supabase Storage + RLS
 """
 
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
+from fastapi import APIRouter, BackgroundTasks, File, UploadFile, HTTPException, Depends, Header, Query, Response
 from fastapi.security import HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from core.models import AudioFileMetadata, AudioFileUploadResponse
+from core.models import (
+    AudioFileMetadata,
+    AudioFileUploadResponse,
+    CallSearchResponse,
+    CallSearchResult,
+    KeyAspectCount,
+    UserCallStats,
+)
 from utils.supabase_client import (
     upload_file_to_storage,
     delete_file_from_storage,
     get_signed_file_url,
+    get_signed_file_urls,
     insert_record,
     get_records,
     delete_record,
     update_record,
+    call_rpc,
 )
 from app.auth import get_authenticated_user, security, AuthContext
+from config import SIGNED_URL_EXPIRES_IN
+from utils.vector_store import delete_call_vectors, user_namespace
+from utils.lexical_index import delete_call_chunks
+from core.answer_cache import invalidate_call_answers
+from utils.ingestion import ingest_call_transcript
+from utils.idempotency import run_idempotent, IdempotencyConflict, IdempotencyInProgress
 from pathlib import Path
 from typing import List, Optional
+import hashlib
 import logging
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import json
 
 logger = logging.getLogger(__name__)
@@ -47,9 +63,11 @@ class UpdateSummaryRequest(BaseModel):
 
 @router.post("/upload", response_model=AudioFileUploadResponse)
 async def upload_audio_file(
+    response: Response,
     audio_file: UploadFile = File(...),
     credentials: HTTPAuthorizationCredentials = Depends(security),
     user=Depends(get_authenticated_user),
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key"),
 ):
     logger.info(f"File upload initiated: {audio_file.filename} by user={user.id}")
     try:
@@ -64,47 +82,60 @@ async def upload_audio_file(
         file_size = len(file_data)
         logger.debug(f"File read: size={file_size} bytes, type={audio_file.content_type}")
 
-
-
-        file_id = str(uuid.uuid4())
-        filename = f"{file_id}{ext}"
-
-
-        storage_path = f"{user.id}/{filename}"
-
-        storage_url = await upload_file_to_storage(
-            bucket_name=AUDIO_BUCKET,
-            file_path=storage_path,
-            file_data=file_data,
-            content_type=audio_file.content_type,
-        )
-        logger.debug(f"File uploaded to storage: {storage_path}")
-
-        metadata = {
-            "id": file_id,
-            "user_id": user.id,
-            "filename": audio_file.filename,
-            "storage_path": storage_path,
-            "file_size": file_size,
-            "created_at": datetime.utcnow().isoformat(),
-        }
-
-        await insert_record(
-            table="audio_files",
-            data=metadata,
-            access_token=credentials.credentials,
-        )
-        
-        logger.info(f"File upload successful: {audio_file.filename}, file_id={file_id}")
-        return AudioFileUploadResponse(
-            file_id=file_id,
-            filename=audio_file.filename,
-            storage_url=storage_url,
-            message="File uploaded successfully",
-        )
+        async def _store() -> AudioFileUploadResponse:
+            file_id = str(uuid.uuid4())
+            filename = f"{file_id}{ext}"
+            storage_path = f"{user.id}/{filename}"
+
+            storage_url = await upload_file_to_storage(
+                bucket_name=AUDIO_BUCKET,
+                file_path=storage_path,
+                file_data=file_data,
+                content_type=audio_file.content_type,
+            )
+            logger.debug(f"File uploaded to storage: {storage_path}")
+
+            metadata = {
+                "id": file_id,
+                "user_id": user.id,
+                "filename": audio_file.filename,
+                "storage_path": storage_path,
+                "file_size": file_size,
+                "created_at": datetime.utcnow().isoformat(),
+            }
+
+            await insert_record(
+                table="audio_files",
+                data=metadata,
+                access_token=credentials.credentials,
+            )
+
+            logger.info(f"File upload successful: {audio_file.filename}, file_id={file_id}")
+            return AudioFileUploadResponse(
+                file_id=file_id,
+                filename=audio_file.filename,
+                storage_url=storage_url,
+                message="File uploaded successfully",
+            )
+
+        if not idempotency_key:
+            return await _store()
+
+        # A retried upload returns the original file_id instead of storing a duplicate row
+        fingerprint = hashlib.sha256(audio_file.filename.encode("utf-8") + b"\x00" + file_data).hexdigest()
+        result, replayed = await run_idempotent(f"upload:{user.id}", idempotency_key, fingerprint, _store)
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        return result
 
     except HTTPException:
         raise
+    except IdempotencyConflict as ic:
+        raise HTTPException(422, str(ic))
+    except IdempotencyInProgress as ip:
+        raise HTTPException(409, str(ip), headers={"Retry-After": str(ip.retry_after)})
+    except ValueError as ve:
+        raise HTTPException(400, str(ve))
     except Exception as e:
         logger.exception("Upload failed")
         raise HTTPException(500, str(e))
@@ -113,8 +144,8 @@ async def upload_audio_file(
 
 
 @router.get("/files", response_model=List[AudioFileMetadata])
-async def list_user_files(user=Depends(get_authenticated_user)):
-    logger.debug(f"Listing files for user_id: {user.id}")
+async def list_user_files(include_urls: bool = False, user=Depends(get_authenticated_user)):
+    logger.debug(f"Listing files for user_id: {user.id}, include_urls={include_urls}")
     try:
         files = await get_records(
             table="audio_files",
@@ -122,6 +153,17 @@ async def list_user_files(user=Depends(get_authenticated_user)):
             order_by="created_at.desc",
             limit=100,
         )
+
+        if include_urls and files:
+            # One batched signing call for the whole page instead of one per click
+            urls = await get_signed_file_urls(
+                bucket_name=AUDIO_BUCKET,
+                file_paths=[f["storage_path"] for f in files if f.get("storage_path")],
+                expires_in=SIGNED_URL_EXPIRES_IN,
+            )
+            for f in files:
+                f["url"] = urls.get(f.get("storage_path"))
+
         logger.info(f"Retrieved {len(files)} files for user_id: {user.id}")
         return [AudioFileMetadata(**f) for f in files]
 
@@ -132,6 +174,73 @@ async def list_user_files(user=Depends(get_authenticated_user)):
 
 
 
+@router.get("/search", response_model=CallSearchResponse)
+async def search_files(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    user=Depends(get_authenticated_user),
+):
+    logger.debug(f"Searching files for user_id: {user.id}, q={q!r}, limit={limit}, offset={offset}")
+    try:
+        rows = await call_rpc(
+            "search_audio_files",
+            {"p_user_id": user.id, "p_query": q, "p_limit": limit, "p_offset": offset},
+        )
+        total = rows[0]["total_count"] if rows else 0
+        logger.info(f"Search returned {len(rows)}/{total} files for user_id: {user.id}")
+        return CallSearchResponse(
+            query=q,
+            total=total,
+            limit=limit,
+            offset=offset,
+            results=[CallSearchResult(**{**r, "id": str(r["id"])}) for r in rows],
+        )
+
+    except Exception:
+        logger.exception("Search files failed")
+        raise HTTPException(500, "Failed to search files")
+
+
+
+
+@router.get("/stats", response_model=UserCallStats)
+async def get_user_stats(
+    days: int = Query(30, ge=1, le=366),
+    top_aspects: int = Query(10, ge=0, le=100),
+    user=Depends(get_authenticated_user),
+):
+    logger.debug(f"Fetching call stats for user_id: {user.id}")
+    try:
+        # user_call_stats is maintained by a trigger on audio_files (database/add_call_stats.sql)
+        rows = await get_records(table="user_call_stats", filters={"user_id": user.id})
+        if not rows:
+            return UserCallStats()
+        row = rows[0]
+
+        summarized = row["summarized_calls"]
+        since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        aspects = sorted(row["key_aspect_counts"].items(), key=lambda item: (-item[1], item[0]))
+
+        return UserCallStats(
+            total_calls=row["total_calls"],
+            summarized_calls=summarized,
+            total_minutes=row["total_minutes"],
+            average_minutes=round(row["total_minutes"] / summarized, 1) if summarized else None,
+            average_participants=round(row["total_participants"] / summarized, 1) if summarized else None,
+            sentiment_counts=row["sentiment_counts"],
+            calls_per_day={day: n for day, n in sorted(row["calls_per_day"].items()) if day >= since},
+            top_key_aspects=[KeyAspectCount(aspect=a, count=n) for a, n in aspects[:top_aspects]],
+            updated_at=row.get("updated_at"),
+        )
+
+    except Exception:
+        logger.exception("Get stats failed")
+        raise HTTPException(500, "Failed to retrieve stats")
+
+
+
+
 @router.get("/file/{file_id}")
 async def get_file(file_id: str, user=Depends(get_authenticated_user)):
     logger.debug(f"Retrieving file: file_id={file_id}, user_id={user.id}")
@@ -149,7 +258,7 @@ async def get_file(file_id: str, user=Depends(get_authenticated_user)):
         signed_url = await get_signed_file_url(
             bucket_name=AUDIO_BUCKET,
             file_path=meta["storage_path"],
-            expires_in=300,
+            expires_in=SIGNED_URL_EXPIRES_IN,
         )
         
         logger.info(f"File retrieved: file_id={file_id}, filename={meta['filename']}")
@@ -173,6 +282,7 @@ async def get_file(file_id: str, user=Depends(get_authenticated_user)):
 @router.delete("/file/{file_id}")
 async def delete_file(
     file_id: str,
+    background_tasks: BackgroundTasks,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     user=Depends(get_authenticated_user),
 ):
@@ -195,6 +305,8 @@ async def delete_file(
             record_id=file_id,
             access_token=credentials.credentials,
         )
+
+        background_tasks.add_task(remove_transcript_chunks, user.id, file_id)
         
         logger.info(f"File deleted successfully: file_id={file_id}")
         return {"message": "File deleted successfully"}
@@ -208,10 +320,32 @@ async def delete_file(
 
 
 
+def index_transcript_chunks(transcript: str, user_id: str, file_id: str):
+    try:
+        ingest_call_transcript(transcript, user_id=user_id, audio_file_id=file_id)
+    except Exception:
+        logger.exception(f"Transcript indexing failed for file_id={file_id}")
+
+
+
+
+def remove_transcript_chunks(user_id: str, file_id: str):
+    # Vectors first: a failure in the local caches below must not leave the call searchable
+    try:
+        delete_call_vectors(user_id=user_id, audio_file_id=file_id)
+    except Exception:
+        logger.exception(f"Vector cleanup failed for file_id={file_id}")
+    delete_call_chunks(user_namespace(user_id), file_id)
+    invalidate_call_answers(user_id, file_id)
+
+
+
+
 @router.put("/file/{file_id}/summary")
 async def update_file_summary(
     file_id: str,
     summary_data: UpdateSummaryRequest,
+    background_tasks: BackgroundTasks,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     user=Depends(get_authenticated_user),
 ):
@@ -253,6 +387,17 @@ async def update_file_summary(
             data=update_data,
             access_token=credentials.credentials,
         )
+        invalidate_call_answers(user.id, file_id)
+
+        if summary_data.transcript is not None:
+            # Chunk and embed off the request path so chat can retrieve from this call
+            if summary_data.transcript.strip():
+                background_tasks.add_task(
+                    index_transcript_chunks, summary_data.transcript, user.id, file_id
+                )
+            else:
+                # A cleared transcript must not stay searchable
+                background_tasks.add_task(remove_transcript_chunks, user.id, file_id)
 
         logger.info(f"Summary updated for file_id={file_id}")
         return {"message": "Summary updated successfully", "file_id": file_id}
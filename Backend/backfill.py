@@ -0,0 +1,304 @@
+"""
+ConvoxAI - Backfill Entry Point
+Summarize and index existing audio_files rows in bulk, outside the API servers.
+
+    python backfill.py                      # summarize rows that have no summary yet
+    python backfill.py --reindex            # (re)index transcripts of summarized rows
+    python backfill.py --reset-checkpoint   # start again from the first row
+    python backfill.py --retry-failed       # re-run the calls recorded as failed
+
+Failed calls are recorded in the checkpoint and skipped by later runs until
+they are retried with --retry-failed.
+"""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import json
+import logging
+import os
+import tempfile
+
+import httpx
+
+from config import (
+    AUDIO_BUCKET_NAME,
+    BACKFILL_CHECKPOINT_PATH,
+    BACKFILL_PAGE_SIZE,
+    BACKFILL_TRANSCRIBE_WORKERS,
+    BACKFILL_SUMMARY_CONCURRENCY,
+)
+from utils.logger_config import setup_logging, get_log_level_from_env
+from utils.supabase_client import SupabaseClient
+
+logger = logging.getLogger("backfill")
+
+ROW_COLUMNS = "id,user_id,filename,storage_path,file_size,transcript"
+
+
+def _transcribe(path: str) -> str:
+    # Runs in a worker process; each process keeps its own Whisper model loaded
+    from utils.audio import transcribe_audio_simple
+    return transcribe_audio_simple(path)
+
+
+def _summarize_and_index(row: Dict[str, Any], transcript: str, index: bool) -> Tuple[bool, Optional[Exception]]:
+    """Summarize, write the summary, then index. Returns (written, indexing error).
+
+    The call is only indexed once the write matched its row, so a call deleted
+    or edited during the run is neither resurrected nor left with orphaned
+    chunks. An indexing failure doesn't discard the summary; the call can be
+    indexed later with --reindex.
+    """
+    from core.summarizer import summarize_transcript
+    from utils.ingestion import ingest_call_transcript
+
+    result = summarize_transcript(transcript, user_id="backfill")
+    if not write_summary(row, transcript, result):
+        return False, None
+    index_error = None
+    if index and transcript:
+        try:
+            ingest_call_transcript(transcript, user_id=row["user_id"], audio_file_id=row["id"])
+        except Exception as e:
+            index_error = e
+    return True, index_error
+
+
+def _index_only(row: Dict[str, Any]) -> None:
+    from utils.ingestion import ingest_call_transcript
+    ingest_call_transcript(row["transcript"], user_id=row["user_id"], audio_file_id=row["id"])
+
+
+def download_audio(storage_path: str) -> str:
+    """Stream an object from storage into a temp file and return its path."""
+    client = SupabaseClient.service()
+    signed = client.storage.from_(AUDIO_BUCKET_NAME).create_signed_url(storage_path, 600)
+    suffix = Path(storage_path).suffix
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        completed = False
+        try:
+            with httpx.stream("GET", signed["signedURL"], timeout=120, follow_redirects=True) as response:
+                response.raise_for_status()
+                for chunk in response.iter_bytes(1024 * 1024):
+                    tmp_file.write(chunk)
+            completed = True
+        finally:
+            if not completed:
+                # A partial download is useless and nobody else knows its path
+                tmp_file.close()
+                os.unlink(tmp_file.name)
+        return tmp_file.name
+
+
+def _remove_audio(path: Optional[str]) -> None:
+    if not path:
+        return
+    for candidate in {path, path.rsplit(".", 1)[0] + ".wav"}:
+        try:
+            os.unlink(candidate)
+        except FileNotFoundError:
+            pass
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.last_id: Optional[str] = None
+        self.processed = 0
+        self.failed: List[str] = []
+        # Summarized and written, but not indexed; fix with --reindex
+        self.index_failed: List[str] = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            self.last_id = data.get("last_id")
+            self.processed = data.get("processed", 0)
+            self.failed = data.get("failed", [])
+            self.index_failed = data.get("index_failed", [])
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump({
+                "last_id": self.last_id,
+                "processed": self.processed,
+                "failed": self.failed,
+                "index_failed": self.index_failed,
+            }, fh)
+        os.replace(tmp_path, self.path)
+
+
+def fetch_page(after_id: Optional[str], page_size: int, reindex: bool, user_id: Optional[str]) -> List[Dict[str, Any]]:
+    """Keyset pagination over audio_files ordered by id."""
+    q = SupabaseClient.service().table("audio_files").select(ROW_COLUMNS)
+    if reindex:
+        q = q.not_.is_("summary", "null").not_.is_("transcript", "null")
+    else:
+        q = q.is_("summary", "null")
+    if user_id:
+        q = q.eq("user_id", user_id)
+    if after_id:
+        q = q.gt("id", after_id)
+    res = q.order("id").limit(page_size).execute()
+    return res.data or []
+
+
+def fetch_rows(ids: List[str], reindex: bool) -> List[Dict[str, Any]]:
+    """The given rows, if they still need work (used to retry checkpointed failures)."""
+    if not ids:
+        return []
+    q = SupabaseClient.service().table("audio_files").select(ROW_COLUMNS).in_("id", ids)
+    if reindex:
+        q = q.not_.is_("summary", "null").not_.is_("transcript", "null")
+    else:
+        q = q.is_("summary", "null")
+    return q.order("id").execute().data or []
+
+
+def write_summary(row: Dict[str, Any], transcript: str, result: Dict[str, Any]) -> bool:
+    """Fill in the summary columns of a call that still has none. False if no row matched."""
+    data = {
+        "summary": result["summary"],
+        "key_aspects": json.dumps(result["key_aspects"]),
+        "duration_minutes": result["duration_minutes"],
+        "no_of_participants": result["no_of_participants"],
+        "sentiment": result["sentiment"],
+    }
+    if not row.get("transcript"):
+        data["transcript"] = transcript
+    # Only touch the row if it still exists and nobody summarized or edited it meanwhile
+    q = SupabaseClient.service().table("audio_files").update(data).eq("id", row["id"]).is_("summary", "null")
+    if "transcript" in data:
+        q = q.is_("transcript", "null")
+    return bool(q.execute().data)
+
+
+def process_page(
+    rows: List[Dict[str, Any]],
+    io_pool: ThreadPoolExecutor,
+    transcribe_pool: ProcessPoolExecutor,
+    summary_pool: ThreadPoolExecutor,
+    args: argparse.Namespace,
+    checkpoint: Checkpoint,
+) -> None:
+    stages = {}
+    for row in rows:
+        if row.get("transcript"):
+            stages[summary_pool.submit(_summarize_and_index, row, row["transcript"], not args.skip_index)] = ("summary", row, None)
+        else:
+            stages[io_pool.submit(download_audio, row["storage_path"])] = ("download", row, None)
+
+    pending = set(stages)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            stage, row, path = stages.pop(future)
+            error = future.exception()
+            if error is not None:
+                logger.error(f"{stage} failed for audio_file_id={row['id']}: {error}")
+                checkpoint.failed.append(row["id"])
+                _remove_audio(path)
+                continue
+
+            if stage == "download":
+                path = future.result()
+                next_future = transcribe_pool.submit(_transcribe, path)
+                stages[next_future] = ("transcribe", row, path)
+                pending.add(next_future)
+            elif stage == "transcribe":
+                _remove_audio(path)
+                next_future = summary_pool.submit(_summarize_and_index, row, future.result(), not args.skip_index)
+                stages[next_future] = ("summary", row, None)
+                pending.add(next_future)
+            else:
+                written, index_error = future.result()
+                if not written:
+                    logger.info(f"Skipped audio_file_id={row['id']}: deleted or edited during the backfill")
+                    continue
+                if index_error is not None:
+                    logger.error(f"Indexing failed for audio_file_id={row['id']}, summary was written: {index_error}")
+                    checkpoint.index_failed.append(row["id"])
+                checkpoint.processed += 1
+
+
+def reindex_page(rows: List[Dict[str, Any]], summary_pool: ThreadPoolExecutor, checkpoint: Checkpoint) -> None:
+    futures = {summary_pool.submit(_index_only, row): row for row in rows}
+    for future, row in futures.items():
+        if future.exception() is not None:
+            logger.error(f"Indexing failed for audio_file_id={row['id']}: {future.exception()}")
+            checkpoint.failed.append(row["id"])
+        else:
+            checkpoint.processed += 1
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Backfill summaries, transcripts and embeddings for existing calls")
+    parser.add_argument("--page-size", type=int, default=BACKFILL_PAGE_SIZE)
+    parser.add_argument("--transcribe-workers", type=int, default=BACKFILL_TRANSCRIBE_WORKERS)
+    parser.add_argument("--summary-concurrency", type=int, default=BACKFILL_SUMMARY_CONCURRENCY)
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT_PATH)
+    parser.add_argument("--reset-checkpoint", action="store_true", help="Ignore any saved progress")
+    parser.add_argument("--user-id", help="Only backfill calls of this user")
+    parser.add_argument("--limit", type=int, help="Stop after this many rows")
+    parser.add_argument("--skip-index", action="store_true", help="Do not embed transcripts")
+    parser.add_argument("--reindex", action="store_true", help="Only (re)index transcripts of summarized calls")
+    parser.add_argument("--retry-failed", action="store_true", help="Re-run only the calls that failed in earlier runs")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    setup_logging(log_level=get_log_level_from_env(), log_to_file=True, log_filename="backfill.log")
+
+    checkpoint_path = args.checkpoint + (".reindex" if args.reindex else "")
+    if args.reset_checkpoint and os.path.exists(checkpoint_path):
+        os.unlink(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+    logger.info(f"Starting backfill after id={checkpoint.last_id}, already processed={checkpoint.processed}")
+
+    seen = 0
+    with ThreadPoolExecutor(max_workers=args.transcribe_workers * 2, thread_name_prefix="download") as io_pool, \
+            ProcessPoolExecutor(max_workers=args.transcribe_workers) as transcribe_pool, \
+            ThreadPoolExecutor(max_workers=args.summary_concurrency, thread_name_prefix="summary") as summary_pool:
+
+        def run_page(rows: List[Dict[str, Any]]) -> None:
+            if args.reindex:
+                reindex_page(rows, summary_pool, checkpoint)
+            else:
+                process_page(rows, io_pool, transcribe_pool, summary_pool, args, checkpoint)
+
+        if args.retry_failed:
+            # Calls that still fail are recorded again; ones that no longer need work drop out
+            ids, checkpoint.failed = checkpoint.failed, []
+            logger.info(f"Retrying {len(ids)} failed calls")
+            for start in range(0, len(ids), args.page_size):
+                run_page(fetch_rows(ids[start:start + args.page_size], args.reindex))
+                checkpoint.save()
+        else:
+            while args.limit is None or seen < args.limit:
+                page_size = args.page_size if args.limit is None else min(args.page_size, args.limit - seen)
+                rows = fetch_page(checkpoint.last_id, page_size, args.reindex, args.user_id)
+                if not rows:
+                    break
+
+                run_page(rows)
+
+                seen += len(rows)
+                checkpoint.last_id = rows[-1]["id"]
+                checkpoint.save()
+                logger.info(
+                    f"Checkpoint at id={checkpoint.last_id}: processed={checkpoint.processed}, failed={len(checkpoint.failed)}"
+                )
+
+    logger.info(
+        f"Backfill finished: processed={checkpoint.processed}, failed={len(checkpoint.failed)}, "
+        f"index_failed={len(checkpoint.index_failed)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,8 +11,11 @@ GEMINI_API_KEY = os.getenv("Gemini_API_Key")
 if not GEMINI_API_KEY:
     raise EnvironmentError("Gemini_API_Key not found in .env file")
 
+# "pinecone" (managed) or "local" (embedded memory-mapped index, see utils/local_vector_store.py)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone").lower()
+
 PINECONE_API_KEY = os.getenv("Pinecone_API_Key")
-if not PINECONE_API_KEY:
+if VECTOR_STORE_BACKEND == "pinecone" and not PINECONE_API_KEY:
     raise EnvironmentError("Pinecone_API_Key not found in .env file")
 
 GEMINI_MODEL_NAME = "gemini-2.5-flash"
@@ -21,14 +24,112 @@ GEMINI_TEMPERATURE = 0.7
 GROQ_MODEL_NAME = "qwen/qwen3-32b"
 GROQ_TEMPERATURE = 0.6
 
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+
+# Provider routing: failover order, health tracking and optional hedging
+LLM_PROVIDERS = ["gemini", "groq"]
+LLM_ROUTER_WINDOW = 50
+LLM_ROUTER_MIN_SAMPLES = 5
+LLM_ROUTER_MAX_ERROR_RATE = 0.5
+LLM_PROVIDER_COOLDOWN_SECONDS = 30
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = 0.95
+LLM_HEDGE_MIN_DELAY_SECONDS = 1.0
+LLM_HEDGE_MAX_WORKERS = 16
+
+# Per-provider request/token budgets (per minute) and in-flight caps
+LLM_RATE_LIMITS = {
+    "gemini": {
+        "rpm": int(os.getenv("GEMINI_RPM", "1000")),
+        "tpm": int(os.getenv("GEMINI_TPM", "1000000")),
+        "max_in_flight": int(os.getenv("GEMINI_MAX_IN_FLIGHT", "16")),
+    },
+    "groq": {
+        "rpm": int(os.getenv("GROQ_RPM", "60")),
+        "tpm": int(os.getenv("GROQ_TPM", "6000")),
+        "max_in_flight": int(os.getenv("GROQ_MAX_IN_FLIGHT", "8")),
+    },
+}
+LLM_QUEUE_MAX_WAIT_SECONDS = float(os.getenv("LLM_QUEUE_MAX_WAIT_SECONDS", "10"))
+
 WHISPER_MODEL_SIZE = "tiny"
 
+# Transcription worker service (transcriber.py). When TRANSCRIBER_SOCKET is set, API workers
+# send jobs to it over a Unix socket instead of loading Whisper themselves.
+TRANSCRIBER_SOCKET = os.getenv("TRANSCRIBER_SOCKET")  # e.g. /tmp/convoxai-transcriber.sock
+TRANSCRIBER_AUTHKEY = os.getenv("TRANSCRIBER_AUTHKEY", "")  # shared secret, required by transcriber.py
+TRANSCRIBER_NUM_WORKERS = int(os.getenv("TRANSCRIBER_NUM_WORKERS", "2"))
+TRANSCRIBER_CPU_THREADS = int(os.getenv("TRANSCRIBER_CPU_THREADS", "0"))  # per worker, 0 = library default
+TRANSCRIBER_CPUS = os.getenv("TRANSCRIBER_CPUS", "")  # CPU affinity, e.g. "0-3" or "4,5,6,7"
+
+# Startup warm-up (core/warmup.py); /ready returns 503 until it has finished
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_WHISPER_SIZES = [
+    size.strip() for size in os.getenv("WARMUP_WHISPER_SIZES", WHISPER_MODEL_SIZE).split(",") if size.strip()
+]
+WARMUP_SAMPLE_AUDIO = os.getenv("WARMUP_SAMPLE_AUDIO", "data/sample_testing1.wav")
+WARMUP_RETRY_MAX_SECONDS = 30
+
+# Admission control for expensive POST endpoints (app/admission.py)
+ADMISSION_LIMITS = {
+    "/summarize": {
+        "max_concurrent": int(os.getenv("SUMMARIZE_MAX_CONCURRENT", "2")),
+        "max_queue": int(os.getenv("SUMMARIZE_MAX_QUEUE", "8")),
+    },
+    "/transcript": {
+        "max_concurrent": int(os.getenv("TRANSCRIPT_MAX_CONCURRENT", "2")),
+        "max_queue": int(os.getenv("TRANSCRIPT_MAX_QUEUE", "8")),
+    },
+    "/storage/upload": {
+        "max_concurrent": int(os.getenv("UPLOAD_MAX_CONCURRENT", "8")),
+        "max_queue": int(os.getenv("UPLOAD_MAX_QUEUE", "32")),
+    },
+}
+ADMISSION_MAX_QUEUED_PER_USER = 2
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "30"))
+# How long a token verified for admission fairness is trusted before asking Supabase again
+ADMISSION_AUTH_CACHE_SECONDS = 300
+ADMISSION_AUTH_CACHE_SIZE = 10000
+# Reverse proxies in front of the API; the client address is this many hops from the end of
+# X-Forwarded-For. 0 = use the peer address (no proxy, or an untrusted header)
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+# Cooperative cancellation of /summarize and /transcript work (utils/cancellation.py)
+AUDIO_REQUEST_DEADLINE_SECONDS = float(os.getenv("AUDIO_REQUEST_DEADLINE_SECONDS", "900"))
+CANCEL_POLL_SECONDS = 0.5
+
+SUMMARY_CACHE_ENABLED = os.getenv("SUMMARY_CACHE_ENABLED", "true").lower() == "true"
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "data/cache/summary_cache.sqlite3")
+SUMMARY_CACHE_TTL_SECONDS = int(os.getenv("SUMMARY_CACHE_TTL_SECONDS", str(30 * 86400)))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "10000"))
+
+# Semantic cache for context-free chat answers (core/answer_cache.py)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "data/cache/answer_cache.sqlite3")
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_MAX_PER_SCOPE = 200
+
+# Idempotency-Key handling for /summarize and /storage/upload (utils/idempotency.py)
+IDEMPOTENCY_STORE_PATH = os.getenv("IDEMPOTENCY_STORE_PATH", "data/cache/idempotency.sqlite3")
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_LOCK_SECONDS = 1800
+IDEMPOTENCY_WAIT_SECONDS = 120
+
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 50
 TEXT_SEPARATORS = ["\n\n", "\n", ".", " "]
 
 EMBEDDINGS_MODEL_NAME = "models/text-embedding-004"
 EMBEDDINGS_DIMENSION = 768
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_BATCH_WINDOW_MS = 10
+EMBEDDING_MAX_BATCH_SIZE = 100
+EMBEDDING_MAX_CONCURRENT_BATCHES = 4
+# Upper bound on waiting for a batched embedding, including time queued behind other batches
+EMBEDDING_WAIT_TIMEOUT_SECONDS = 120
 
 PINECONE_INDEX_NAME = "convox-ai-gemini"
 PINECONE_DIMENSION = 768
@@ -36,8 +137,52 @@ PINECONE_METRIC = "cosine"
 PINECONE_CLOUD = "aws"
 PINECONE_REGION = "us-east-1"
 
+LOCAL_VECTOR_STORE_DIR = os.getenv("LOCAL_VECTOR_STORE_DIR", "data/vectors")
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float32")  # or "float16" to halve disk/RAM
+LOCAL_VECTOR_COMPACT_RATIO = 0.25
+
 RETRIEVER_SEARCH_TYPE = "similarity"
 RETRIEVER_TOP_K = 5
+RETRIEVER_SELECTED_CALL_TOP_K = 3
+RETRIEVER_SELECTED_CALL_BOOST = 1.2
+
+# Hybrid retrieval: BM25 inverted index fused with vector hits (reciprocal rank fusion)
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "data/cache/lexical_index.sqlite3")
+HYBRID_RRF_K = 60
+# Minimum top BM25 score before an exact-term question skips the embedding search
+LEXICAL_EXACT_MIN_SCORE = 3.0
+
+# Transcript chunk ingestion
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "4"))
+INGEST_MAX_RETRIES = 3
+
+# Bulk backfill (backfill.py)
+BACKFILL_CHECKPOINT_PATH = os.getenv("BACKFILL_CHECKPOINT_PATH", "data/cache/backfill_checkpoint.json")
+BACKFILL_PAGE_SIZE = 100
+BACKFILL_TRANSCRIBE_WORKERS = int(os.getenv("BACKFILL_TRANSCRIBE_WORKERS", "2"))
+BACKFILL_SUMMARY_CONCURRENCY = int(os.getenv("BACKFILL_SUMMARY_CONCURRENCY", "4"))
+
+# Per-process caches of vector stores/retrievers and retrieval chains (keyed by namespace)
+VECTORSTORE_CACHE_SIZE = 1024
+CHATBOT_CHAIN_CACHE_SIZE = 1024
+
+# Chat history compression: recent turns verbatim, older turns folded into a summary
+CHAT_HISTORY_RECENT_TURNS = int(os.getenv("CHAT_HISTORY_RECENT_TURNS", "3"))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500"))
+CHAT_HISTORY_SUMMARY_WORDS = 200
+CHAT_HISTORY_CACHE_SIZE = 5000
+
+# WebSocket chat sessions (app/chat_session.py)
+CHAT_SESSION_IDLE_SECONDS = int(os.getenv("CHAT_SESSION_IDLE_SECONDS", "900"))
+CHAT_SESSION_MAX = int(os.getenv("CHAT_SESSION_MAX", "2000"))
+CHAT_SESSION_FILES_TTL_SECONDS = 300
+CHAT_SESSION_REAUTH_SECONDS = 300
+
+# Direct chat context packing
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "6000"))
+CHAT_CONTEXT_WINDOW_CHARS = 800
+CHAT_CONTEXT_SELECTED_BOOST = 2.0
 
 
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
@@ -55,3 +200,7 @@ ALLOWED_AUDIO_MIME_TYPES = {
 MAX_FILE_SIZE = 50 * 1024 * 1024
 AUDIO_BUCKET_NAME = "audio-files"
 
+SIGNED_URL_EXPIRES_IN = 300
+SIGNED_URL_REFRESH_MARGIN = 60
+SIGNED_URL_CACHE_MAX_ENTRIES = 5000
+
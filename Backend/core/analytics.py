@@ -0,0 +1,206 @@
+"""
+Aggregate question routing.
+
+Questions about counts, minutes, participants or sentiment over a time range
+("how many negative calls did I have this month") are answered exactly from
+the grouped ``call_stats`` query instead of asking the LLM to guess from a
+handful of calls in its context. Anything narrative goes to the LLM as before.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import re
+
+METRIC_COUNT = "count"
+METRIC_TOTAL_MINUTES = "total_minutes"
+METRIC_AVG_MINUTES = "avg_minutes"
+METRIC_AVG_PARTICIPANTS = "avg_participants"
+METRIC_SENTIMENT = "sentiment_breakdown"
+
+SENTIMENTS = ("positive", "negative", "neutral")
+
+# Questions about what was said stay with the LLM even if they contain "how many"
+_NARRATIVE_RE = re.compile(
+    r"\b(why|who|mention\w*|said|say|says|talk\w*|discuss\w*|about|regarding|summar\w*|explain|describe|"
+    r"what did|what was|what were|decid\w*|agree\w*|promis\w*|ask\w*)\b"
+)
+_SUBJECT_RE = re.compile(r"\b(calls?|meetings?|conversations?|minutes?|hours?|participants?|sentiment)\b")
+# Questions about one call ("my last call", "this meeting") are per-call, not aggregates
+_SINGLE_CALL_RE = re.compile(
+    r"\b(this|that|the|my|last|latest|previous|selected|current|first|recent|same|one)\s+"
+    r"(call|meeting|conversation|recording)\b"
+)
+# "with Acme", "from John": counting calls for one entity needs the LLM, not a global total.
+# Time ranges and sentiments after these words are still aggregates.
+_ENTITY_RE = re.compile(
+    r"\b(with|from|involving|between|for|to)\s+"
+    r"(?!(?:the\s+)?(?:last|past|previous|this|today|yesterday|each|every|per|day|week|month|year)\b"
+    r"|(?:an?\s+)?(?:positive|negative|neutral)\b)"
+    r"\w+"
+)
+_PRONOUNS = {"I", "I'm", "I've", "I'd", "I'll"}
+
+_METRIC_PATTERNS: List[Tuple[str, re.Pattern]] = [
+    (METRIC_AVG_PARTICIPANTS, re.compile(r"\b(average|avg|mean|typical)\b.*\bparticipants?\b|\bparticipants?\b.*\bon average\b")),
+    (METRIC_AVG_MINUTES, re.compile(r"\b(average|avg|mean|typical)\b.*\b(duration|length|minutes?|long)\b|\bhow long\b.*\bon average\b")),
+    (METRIC_TOTAL_MINUTES, re.compile(r"\b(total|overall|combined|sum)\b.*\b(minutes?|hours?|duration|time)\b|\bhow (much time|many (minutes|hours))\b")),
+    (METRIC_SENTIMENT, re.compile(r"\bsentiment\b.*\b(breakdown|distribution|split|mix|overview)\b|\b(breakdown|distribution|split)\b.*\bsentiment\b")),
+    (METRIC_COUNT, re.compile(
+        r"\b(how many|number of|count of|count)\s+(?:(?:positive|negative|neutral|total|separate|different)\s+)?"
+        r"(calls|meetings|conversations)\b"
+    )),
+]
+
+_BUCKET_RE = re.compile(r"\b(per|each|by|every)\s+(day|week|month)\b|\b(daily|weekly|monthly)\b")
+_LAST_N_RE = re.compile(r"\b(?:last|past|previous)\s+(\d{1,3})\s+(day|week|month)s?\b")
+
+
+@dataclass
+class AggregateQuery:
+    metric: str
+    sentiment: Optional[str] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    period: str = "in total"
+    bucket: Optional[str] = None
+
+    def rpc_params(self, user_id: str) -> Dict[str, Any]:
+        return {
+            "p_user_id": user_id,
+            "p_start": self.start.isoformat() if self.start else None,
+            "p_end": self.end.isoformat() if self.end else None,
+            "p_sentiment": self.sentiment,
+            "p_bucket": self.bucket,
+        }
+
+
+def _month_start(day: datetime, months_back: int = 0) -> datetime:
+    month_index = day.year * 12 + day.month - 1 - months_back
+    return day.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+
+
+def _time_range(text: str, now: datetime) -> Tuple[Optional[datetime], Optional[datetime], str]:
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    week = today - timedelta(days=today.weekday())
+
+    match = _LAST_N_RE.search(text)
+    if match:
+        n, unit = int(match.group(1)), match.group(2)
+        if unit == "month":
+            return _month_start(today, n), None, f"in the last {n} months"
+        days = n * 7 if unit == "week" else n
+        return today - timedelta(days=days - 1), None, f"in the last {n} {unit}s"
+
+    ranges = [
+        ("today", today, None, "today"),
+        ("yesterday", today - timedelta(days=1), today, "yesterday"),
+        ("this week", week, None, "this week"),
+        ("last week", week - timedelta(days=7), week, "last week"),
+        ("this month", _month_start(today), None, "this month"),
+        ("last month", _month_start(today, 1), _month_start(today), "last month"),
+        ("this year", today.replace(month=1, day=1), None, "this year"),
+        ("last year", today.replace(year=today.year - 1, month=1, day=1), today.replace(month=1, day=1), "last year"),
+    ]
+    for phrase, start, end, label in ranges:
+        if re.search(rf"\b{phrase}\b", text):
+            return start, end, label
+    return None, None, "in total"
+
+
+def _mentions_named_entity(question: str) -> bool:
+    """Capitalised words past the first one ("calls with Acme Corp") usually name a person or company."""
+    words = re.findall(r"[A-Za-z][\w'&]*", question)
+    return any(word[0].isupper() and word not in _PRONOUNS for word in words[1:])
+
+
+def detect_aggregate_intent(
+    question: str,
+    now: Optional[datetime] = None,
+    selected_call_id: Optional[str] = None,
+) -> Optional[AggregateQuery]:
+    """Return the aggregate query behind ``question``, or None if it needs the LLM.
+
+    Only questions about the user's whole set of calls are routed; anything
+    about one call, a selected call or a named entity is left to the LLM.
+    """
+    if selected_call_id:
+        return None
+    text = question.lower()
+    if _NARRATIVE_RE.search(text) or not _SUBJECT_RE.search(text):
+        return None
+    if _SINGLE_CALL_RE.search(text) or _ENTITY_RE.search(text) or _mentions_named_entity(question):
+        return None
+
+    metric = next((name for name, pattern in _METRIC_PATTERNS if pattern.search(text)), None)
+    if metric is None:
+        return None
+
+    sentiment = next((s for s in SENTIMENTS if re.search(rf"\b{s}\b", text)), None)
+    start, end, period = _time_range(text, now or datetime.now(timezone.utc))
+
+    bucket = None
+    match = _BUCKET_RE.search(text)
+    if match:
+        bucket = match.group(2) or {"daily": "day", "weekly": "week", "monthly": "month"}[match.group(3)]
+
+    return AggregateQuery(metric=metric, sentiment=sentiment, start=start, end=end, period=period, bucket=bucket)
+
+
+def _totals(rows: List[Dict[str, Any]]) -> Dict[str, int]:
+    keys = ("calls", "total_minutes", "timed_calls", "total_participants", "counted_calls")
+    return {key: sum(int(row.get(key) or 0) for row in rows) for key in keys}
+
+
+def _plural(n: int, word: str) -> str:
+    return f"{n} {word}" if n == 1 else f"{n} {word}s"
+
+
+def _describe(query: AggregateQuery, totals: Dict[str, int]) -> str:
+    calls = totals["calls"]
+    label = f"{query.sentiment} call" if query.sentiment else "call"
+
+    if query.metric == METRIC_TOTAL_MINUTES:
+        minutes = totals["total_minutes"]
+        hours, rest = divmod(minutes, 60)
+        duration = f"{minutes} minutes" + (f" ({hours}h {rest}m)" if hours else "")
+        return f"{duration} across {_plural(calls, label)}"
+    if query.metric == METRIC_AVG_MINUTES:
+        if not totals["timed_calls"]:
+            return f"no duration recorded for {_plural(calls, label)}"
+        return f"{totals['total_minutes'] / totals['timed_calls']:.1f} minutes on average over {_plural(calls, label)}"
+    if query.metric == METRIC_AVG_PARTICIPANTS:
+        if not totals["counted_calls"]:
+            return f"no participant count recorded for {_plural(calls, label)}"
+        return f"{totals['total_participants'] / totals['counted_calls']:.1f} participants on average over {_plural(calls, label)}"
+    return _plural(calls, label)
+
+
+def _sentiment_split(rows: List[Dict[str, Any]]) -> str:
+    counts: Dict[str, int] = {}
+    for row in rows:
+        name = (row.get("sentiment") or "unknown").lower()
+        counts[name] = counts.get(name, 0) + int(row.get("calls") or 0)
+    return ", ".join(f"{n} {name}" for name, n in sorted(counts.items(), key=lambda item: -item[1]))
+
+
+def format_aggregate_answer(query: AggregateQuery, rows: List[Dict[str, Any]]) -> str:
+    totals = _totals(rows)
+    if not totals["calls"]:
+        label = f"{query.sentiment} calls" if query.sentiment else "calls"
+        return f"You had no {label} {query.period}."
+
+    if query.metric == METRIC_SENTIMENT:
+        answer = f"Sentiment of your {_plural(totals['calls'], 'call')} {query.period}: {_sentiment_split(rows)}."
+    else:
+        answer = f"You had {_describe(query, totals)} {query.period}."
+        if query.metric == METRIC_COUNT and not query.sentiment:
+            answer = answer[:-1] + f" ({_sentiment_split(rows)})."
+
+    if query.bucket:
+        buckets: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            buckets.setdefault(str(row.get("bucket") or "")[:10], []).append(row)
+        lines = [f"- {day}: {_describe(query, _totals(group))}" for day, group in sorted(buckets.items())]
+        answer += f"\n\nBy {query.bucket}:\n" + "\n".join(lines)
+
+    return answer
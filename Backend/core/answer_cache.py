@@ -0,0 +1,176 @@
+"""
+Semantic answer cache for context-free chat questions.
+
+Entries are scoped to a user and either the selected call or "*" (all calls),
+keyed by the requested model, and stamped with a content version of the calls
+the answer was built from. A question hits when its normalized text matches
+exactly, or its embedding is within ANSWER_CACHE_SIMILARITY of a cached
+question for the same scope, model and version. Entries expire after
+ANSWER_CACHE_TTL_SECONDS, and editing a call drops its entries (see
+invalidate_call_answers).
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+from config import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_PATH,
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_MAX_PER_SCOPE,
+)
+from utils.embeddings import load_embeddings
+from utils.sqlite_store import LazySQLite
+
+logger = logging.getLogger(__name__)
+
+ALL_CALLS_SCOPE = "*"
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cached_answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    question TEXT NOT NULL,
+    embedding BLOB,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cached_answers_scope ON cached_answers(user_id, scope, model, version);
+"""
+_db = LazySQLite(ANSWER_CACHE_PATH, _SCHEMA, "Answer cache")
+
+
+def normalize_question(question: str) -> str:
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", question.lower())).strip()
+
+
+def answer_scope(selected_call_id: Optional[str]) -> str:
+    return selected_call_id or ALL_CALLS_SCOPE
+
+
+def content_version(audio_files: List[Dict[str, Any]], selected_call_id: Optional[str] = None) -> str:
+    """Hash of the call content an answer depends on (only the selected call when there is one)."""
+    calls = [f for f in audio_files if f.get("id") == selected_call_id] if selected_call_id else audio_files
+    h = hashlib.sha256()
+    for call in sorted(calls, key=lambda f: str(f.get("id"))):
+        for field in ("id", "summary", "transcript", "key_aspects", "sentiment"):
+            h.update(str(call.get(field)).encode("utf-8"))
+            h.update(b"\x00")
+    return h.hexdigest()
+
+
+def lookup_answer(
+    user_id: str,
+    scope: str,
+    version: str,
+    model: str,
+    question: str,
+) -> Tuple[Optional[Dict[str, Any]], Optional[List[float]]]:
+    """Return (cached response or None, question embedding for a later store_answer)."""
+    if not ANSWER_CACHE_ENABLED:
+        return None, None
+    normalized = normalize_question(question)
+    cutoff = time.time() - ANSWER_CACHE_TTL_SECONDS
+    try:
+        with _db.lock:
+            rows = _db.connection().execute(
+                "SELECT question, embedding, response FROM cached_answers "
+                "WHERE user_id = ? AND scope = ? AND model = ? AND version = ? AND created_at > ? "
+                "ORDER BY created_at DESC",
+                (user_id, scope, model, version, cutoff),
+            ).fetchall()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Answer cache lookup failed: {e}")
+        return None, None
+
+    for cached_question, _, response in rows:
+        if cached_question == normalized:
+            logger.debug(f"Answer cache exact hit for user_id={user_id}, scope={scope}")
+            return json.loads(response), None
+
+    try:
+        embedding = load_embeddings().embed_query(normalized)
+    except Exception as e:
+        logger.warning(f"Answer cache embedding failed: {e}")
+        return None, None
+
+    candidates = [(blob, response) for _, blob, response in rows if blob]
+    if candidates:
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        matrix = np.stack([np.frombuffer(blob, dtype=np.float32) for blob, _ in candidates])
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] >= ANSWER_CACHE_SIMILARITY:
+            logger.debug(f"Answer cache semantic hit ({scores[best]:.3f}) for user_id={user_id}, scope={scope}")
+            return json.loads(candidates[best][1]), embedding
+    return None, embedding
+
+
+def store_answer(
+    user_id: str,
+    scope: str,
+    version: str,
+    model: str,
+    question: str,
+    response: Dict[str, Any],
+    embedding: Optional[List[float]] = None,
+) -> None:
+    if not ANSWER_CACHE_ENABLED:
+        return
+    blob = None
+    if embedding is not None:
+        vector = np.asarray(embedding, dtype=np.float32)
+        blob = (vector / (np.linalg.norm(vector) or 1.0)).tobytes()
+    try:
+        with _db.lock:
+            conn = _db.connection()
+            conn.execute(
+                "INSERT INTO cached_answers "
+                "(user_id, scope, version, model, question, embedding, response, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, scope, version, model, normalize_question(question), blob, json.dumps(response), time.time()),
+            )
+            # Drop expired and stale-version entries, and keep each scope bounded
+            conn.execute(
+                "DELETE FROM cached_answers WHERE user_id = ? AND scope = ? AND (version != ? OR created_at <= ?)",
+                (user_id, scope, version, time.time() - ANSWER_CACHE_TTL_SECONDS),
+            )
+            conn.execute(
+                "DELETE FROM cached_answers WHERE id IN (SELECT id FROM cached_answers "
+                "WHERE user_id = ? AND scope = ? AND model = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (user_id, scope, model, ANSWER_CACHE_MAX_PER_SCOPE),
+            )
+            conn.commit()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Answer cache write failed: {e}")
+
+
+def invalidate_call_answers(user_id: str, audio_file_id: str) -> None:
+    """Forget answers built from this call: its own scope and the user's all-calls scope."""
+    if not ANSWER_CACHE_ENABLED:
+        return
+    try:
+        with _db.lock:
+            conn = _db.connection()
+            deleted = conn.execute(
+                "DELETE FROM cached_answers WHERE user_id = ? AND scope IN (?, ?)",
+                (user_id, audio_file_id, ALL_CALLS_SCOPE),
+            ).rowcount
+            conn.commit()
+        logger.debug(f"Invalidated {deleted} cached answers for audio_file_id={audio_file_id}")
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Answer cache invalidation failed: {e}")
@@ -0,0 +1,151 @@
+"""
+Rolling chat-history compression.
+
+The last few turns are replayed verbatim, within a token budget. Everything
+older is folded into a running summary. The summary is cached per conversation
+and extended incrementally: each turn only summarizes the messages that fell
+out of the verbatim window since the last fold. That keeps the prompt size,
+and so the per-turn cost, flat as a conversation grows.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+import hashlib
+import logging
+import threading
+
+from core.llm_router import llm_router
+from utils.tokens import estimate_tokens
+from config import (
+    CHAT_HISTORY_RECENT_TURNS,
+    CHAT_HISTORY_TOKEN_BUDGET,
+    CHAT_HISTORY_SUMMARY_WORDS,
+    CHAT_HISTORY_CACHE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Long messages are clipped before folding so one pasted transcript can't blow the fold prompt
+_FOLD_MESSAGE_MAX_CHARS = 1500
+
+FOLD_PROMPT = """You maintain a running summary of a conversation between a user and an assistant about the user's recorded calls.
+
+Current summary:
+{summary}
+
+New messages to fold in:
+{messages}
+
+Rewrite the summary so it also covers the new messages. Keep call names, people, numbers, dates, decisions, open questions and the user's stated preferences. Drop pleasantries. Use at most {max_words} words and plain sentences."""
+
+
+@dataclass
+class _FoldState:
+    folded: int
+    digest: str
+    summary: str
+
+
+_states: "OrderedDict[str, _FoldState]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _digest(messages: List[Dict[str, str]]) -> str:
+    h = hashlib.sha256()
+    for msg in messages:
+        h.update(f"{msg['role']}\x00{msg['content']}\x01".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _conversation_key(user_id: Optional[str], conversation_id: Optional[str], history: List[Dict[str, str]]) -> str:
+    if conversation_id:
+        return f"{user_id}:{conversation_id}"
+    # Clients without a conversation id are keyed on their opening message
+    return f"{user_id}:anon:{_digest(history[:1])[:16]}"
+
+
+def _summarize(
+    base: Optional[str],
+    pending: List[Dict[str, str]],
+    llm_factory: Callable,
+    model_choice: str,
+    user_id: Optional[str],
+) -> str:
+    transcript = "\n".join(
+        f"{msg['role'].capitalize()}: {msg['content'][:_FOLD_MESSAGE_MAX_CHARS]}" for msg in pending
+    )
+    prompt = FOLD_PROMPT.format(
+        summary=base or "(empty)",
+        messages=transcript,
+        max_words=CHAT_HISTORY_SUMMARY_WORDS,
+    )
+    response, _ = llm_router.invoke(
+        lambda p: llm_factory(p).invoke(prompt),
+        preferred=model_choice,
+        user_id=user_id,
+        tokens=estimate_tokens(prompt) + CHAT_HISTORY_SUMMARY_WORDS * 2,
+    )
+    return response.content.strip()
+
+
+def _fold(
+    key: str,
+    older: List[Dict[str, str]],
+    llm_factory: Callable,
+    model_choice: str,
+    user_id: Optional[str],
+) -> Optional[str]:
+    with _lock:
+        state = _states.get(key)
+        if state:
+            _states.move_to_end(key)
+
+    base, pending = None, older
+    if state and state.folded <= len(older) and state.digest == _digest(older[:state.folded]):
+        if state.folded == len(older):
+            return state.summary
+        base, pending = state.summary, older[state.folded:]
+
+    try:
+        summary = _summarize(base, pending, llm_factory, model_choice, user_id)
+    except Exception as e:
+        # Answering without the oldest turns beats failing the whole query
+        logger.warning(f"History fold failed for {key}, using previous summary: {str(e)}")
+        return base
+
+    with _lock:
+        _states[key] = _FoldState(folded=len(older), digest=_digest(older), summary=summary)
+        _states.move_to_end(key)
+        while len(_states) > CHAT_HISTORY_CACHE_SIZE:
+            _states.popitem(last=False)
+    logger.debug(f"Folded {len(pending)} messages into summary for {key} ({len(older)} total)")
+    return summary
+
+
+def compact_history(
+    chat_history: Optional[List[Dict[str, str]]],
+    llm_factory: Callable,
+    conversation_id: Optional[str] = None,
+    model_choice: str = "gemini",
+    user_id: Optional[str] = None,
+) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """Split history into (summary of older turns, recent messages kept verbatim)."""
+    if not chat_history:
+        return None, []
+
+    # Walk back from the newest message while both the turn cap and the token budget allow
+    floor = max(0, len(chat_history) - CHAT_HISTORY_RECENT_TURNS * 2)
+    start, used = len(chat_history), 0
+    while start > floor:
+        cost = estimate_tokens(chat_history[start - 1]["content"])
+        if used + cost > CHAT_HISTORY_TOKEN_BUDGET:
+            break
+        used += cost
+        start -= 1
+
+    older, recent = chat_history[:start], chat_history[start:]
+    if not older:
+        return None, recent
+
+    key = _conversation_key(user_id, conversation_id, chat_history)
+    return _fold(key, older, llm_factory, model_choice, user_id), recent
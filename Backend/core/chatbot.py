@@ -4,17 +4,36 @@ from langchain_classic.chains import ConversationalRetrievalChain
 from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from core.prompts.templates import CHATBOT_PROMPT
-from utils.vector_store import get_retriever
-from typing import List, Dict, Optional
+from core.llm_router import llm_router
+from core.chat_memory import compact_history
+from utils.tokens import estimate_tokens
+from utils.vector_store import get_retriever, search_user_chunks, user_namespace
+from utils.lexical import is_exact_lookup
+from utils.lexical_index import search_chunks
+from utils.cancellation import CancelToken
+from typing import Callable, List, Dict, Optional
+from functools import lru_cache
 from config import (
     GEMINI_API_KEY, 
     GEMINI_MODEL_NAME, 
     GEMINI_TEMPERATURE,
     GROQ_API_KEY,
     GROQ_MODEL_NAME,
-    GROQ_TEMPERATURE
+    GROQ_TEMPERATURE,
+    LLM_REQUEST_TIMEOUT_SECONDS,
+    LLM_MAX_RETRIES,
+    RETRIEVER_TOP_K,
+    RETRIEVER_SELECTED_CALL_TOP_K,
+    RETRIEVER_SELECTED_CALL_BOOST,
+    HYBRID_RRF_K,
+    LEXICAL_EXACT_MIN_SCORE,
+    CHATBOT_CHAIN_CACHE_SIZE
 )
 
+# Token budget estimates used for rate limiting before the call is made
+CHAT_OUTPUT_TOKENS = 512
+RETRIEVAL_CONTEXT_TOKENS = 1500
+
 chatbot_prompt_template = PromptTemplate.from_template(
     template=CHATBOT_PROMPT
 )
@@ -38,24 +57,31 @@ Instructions:
 
 {user_context}"""
 
+# LLM clients and chains hold no per-request state, so one instance per process is shared
+@lru_cache(maxsize=None)
 def create_chatbot_llm(model_choice: str = "gemini"):
     if model_choice.lower() == "groq":
         return ChatGroq(
             model=GROQ_MODEL_NAME,
             api_key=GROQ_API_KEY,
-            temperature=GROQ_TEMPERATURE
+            temperature=GROQ_TEMPERATURE,
+            timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+            max_retries=LLM_MAX_RETRIES
         )
     else:
         return ChatGoogleGenerativeAI(
             model=GEMINI_MODEL_NAME,
             api_key=GEMINI_API_KEY,
-            temperature=GEMINI_TEMPERATURE
+            temperature=GEMINI_TEMPERATURE,
+            timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+            max_retries=LLM_MAX_RETRIES
         )
 
 
-def create_chatbot_chain(model_choice: str = "groq"):
+@lru_cache(maxsize=CHATBOT_CHAIN_CACHE_SIZE)
+def create_chatbot_chain(model_choice: str = "groq", user_id: Optional[str] = None):
     llm = create_chatbot_llm(model_choice)
-    retriever = get_retriever()
+    retriever = get_retriever(user_id)
     chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
         retriever=retriever,
@@ -67,64 +93,203 @@ def create_chatbot_chain(model_choice: str = "groq"):
     return chain
 
 
+def _vector_chunks(question: str, user_id: str, k: int, audio_file_id: Optional[str] = None) -> List[Dict[str, any]]:
+    return [
+        {
+            "audio_file_id": doc.metadata.get("audio_file_id"),
+            "chunk_index": doc.metadata.get("chunk_index"),
+            "content": doc.page_content,
+            "score": score
+        }
+        for doc, score in search_user_chunks(question, user_id, k=k, audio_file_id=audio_file_id)
+    ]
+
+
+def _fuse_ranked(ranked_lists: List[tuple]) -> List[Dict[str, any]]:
+    """Weighted reciprocal rank fusion of (hits, weight) lists, deduplicated by chunk."""
+    fused = {}
+    for hits, weight in ranked_lists:
+        for rank, hit in enumerate(hits):
+            key = (hit["audio_file_id"], hit["chunk_index"])
+            entry = fused.setdefault(key, {**hit, "score": 0.0})
+            entry["score"] += weight / (HYBRID_RRF_K + rank + 1)
+    return sorted(fused.values(), key=lambda c: c["score"], reverse=True)
+
+
+def retrieve_call_chunks(
+    question: str,
+    user_id: str,
+    selected_call_id: Optional[str] = None,
+    k: int = RETRIEVER_TOP_K
+) -> List[Dict[str, any]]:
+    """Top-k transcript chunks from the user's own calls, weighted toward the selected call.
+
+    BM25 hits from the lexical index are fused with vector hits. Exact-term
+    questions (numbers, identifiers, quoted phrases) whose top lexical hit
+    scores at least LEXICAL_EXACT_MIN_SCORE skip the embedding call entirely.
+    """
+    namespace = user_namespace(user_id)
+    limit = k + RETRIEVER_SELECTED_CALL_TOP_K
+
+    ranked = [(search_chunks(namespace, question, k), 1.0)]
+    if selected_call_id:
+        ranked.append((
+            search_chunks(namespace, question, RETRIEVER_SELECTED_CALL_TOP_K, audio_file_id=selected_call_id),
+            RETRIEVER_SELECTED_CALL_BOOST
+        ))
+    lexical_hits = ranked[0][0]
+    if lexical_hits and lexical_hits[0]["score"] >= LEXICAL_EXACT_MIN_SCORE and is_exact_lookup(question):
+        return _fuse_ranked(ranked)[:limit]
+
+    ranked.append((_vector_chunks(question, user_id, k), 1.0))
+    if selected_call_id:
+        ranked.append((
+            _vector_chunks(question, user_id, RETRIEVER_SELECTED_CALL_TOP_K, audio_file_id=selected_call_id),
+            RETRIEVER_SELECTED_CALL_BOOST
+        ))
+    return _fuse_ranked(ranked)[:limit]
+
+
+def _history_messages(
+    chat_history: Optional[List[Dict[str, str]]],
+    conversation_id: Optional[str],
+    model_choice: str,
+    user_id: Optional[str]
+) -> List:
+    """Recent turns as messages, preceded by a summary of everything older."""
+    summary, recent = compact_history(
+        chat_history,
+        create_chatbot_llm,
+        conversation_id=conversation_id,
+        model_choice=model_choice,
+        user_id=user_id
+    )
+    messages = []
+    if summary:
+        messages.append(SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+    for msg in recent:
+        if msg["role"] == "user":
+            messages.append(HumanMessage(content=msg["content"]))
+        elif msg["role"] == "assistant":
+            messages.append(AIMessage(content=msg["content"]))
+    return messages
+
+
+def _context_messages(
+    question: str,
+    user_context: str,
+    chat_history: Optional[List[Dict[str, str]]],
+    model_choice: str,
+    user_id: Optional[str],
+    conversation_id: Optional[str]
+) -> List:
+    # System message with user context, then history (older turns folded into a summary), then the question
+    messages = [SystemMessage(content=DIRECT_CHAT_SYSTEM_PROMPT.format(user_context=user_context))]
+    messages += _history_messages(chat_history, conversation_id, model_choice, user_id)
+    messages.append(HumanMessage(content=question))
+    return messages
+
+
 def process_query_with_context(
     question: str,
     user_context: str,
     chat_history: Optional[List[Dict[str, str]]] = None,
-    model_choice: str = "gemini"
+    model_choice: str = "gemini",
+    user_id: Optional[str] = None,
+    conversation_id: Optional[str] = None
 ) -> Dict[str, any]:
     try:
-        llm = create_chatbot_llm(model_choice)
-        
-        # Build messages list
-        messages = []
-        
-        # Add system message with user context
-        system_prompt = DIRECT_CHAT_SYSTEM_PROMPT.format(user_context=user_context)
-        messages.append(SystemMessage(content=system_prompt))
-        
-        # Add chat history
-        if chat_history:
-            for msg in chat_history:
-                if msg["role"] == "user":
-                    messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    messages.append(AIMessage(content=msg["content"]))
-        
-        # Add current question
-        messages.append(HumanMessage(content=question))
+        messages = _context_messages(
+            question, user_context, chat_history, model_choice, user_id, conversation_id
+        )
         
-        # Get response from LLM
-        response = llm.invoke(messages)
+        # Get response from LLM, failing over to the other provider if needed
+        response, provider = llm_router.invoke(
+            lambda p: create_chatbot_llm(p).invoke(messages),
+            preferred=model_choice,
+            user_id=user_id,
+            tokens=sum(estimate_tokens(m.content) for m in messages) + CHAT_OUTPUT_TOKENS
+        )
         
         return {
             "answer": response.content,
             "sources": [],
-            "model_used": model_choice
+            "model_used": provider
         }
         
     except Exception as e:
         raise
 
 
+def stream_query_with_context(
+    question: str,
+    user_context: str,
+    on_event: Callable[[str, str], None],
+    chat_history: Optional[List[Dict[str, str]]] = None,
+    model_choice: str = "gemini",
+    user_id: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> Dict[str, any]:
+    """Like process_query_with_context, but reports ("start", provider) and ("token", text) events.
+
+    A second "start" means the first provider failed mid-answer and the
+    answer is being regenerated, so partial output should be discarded.
+    Cancelling ``cancel_token`` stops the stream at the next chunk.
+    """
+    messages = _context_messages(
+        question, user_context, chat_history, model_choice, user_id, conversation_id
+    )
+
+    def _stream(provider: str) -> str:
+        on_event("start", provider)
+        parts = []
+        for chunk in create_chatbot_llm(provider).stream(messages):
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            if chunk.content:
+                parts.append(chunk.content)
+                on_event("token", chunk.content)
+        return "".join(parts)
+
+    answer, provider = llm_router.invoke(
+        _stream,
+        preferred=model_choice,
+        user_id=user_id,
+        tokens=sum(estimate_tokens(m.content) for m in messages) + CHAT_OUTPUT_TOKENS,
+        hedge=False,
+        cancel_token=cancel_token
+    )
+    return {
+        "answer": answer,
+        "sources": [],
+        "model_used": provider
+    }
+
+
 def process_query(
     question: str,
     chat_history: Optional[List[Dict[str, str]]] = None,
-    model_choice: str = "gemini"
+    model_choice: str = "gemini",
+    user_id: Optional[str] = None,
+    conversation_id: Optional[str] = None
 ) -> Dict[str, any]:
     try:
-        chain = create_chatbot_chain(model_choice)
-        formatted_history = []
-        if chat_history:
-            for msg in chat_history:
-                if msg["role"] == "user":
-                    formatted_history.append(("human", msg["content"]))
-                elif msg["role"] == "assistant":
-                    formatted_history.append(("ai", msg["content"]))
-        result = chain({
-            "question": question,
-            "chat_history": formatted_history
-        })
+        formatted_history = _history_messages(chat_history, conversation_id, model_choice, user_id)
+        result, provider = llm_router.invoke(
+            lambda p: create_chatbot_chain(p, user_id)({
+                "question": question,
+                "chat_history": formatted_history
+            }),
+            preferred=model_choice,
+            user_id=user_id,
+            tokens=(
+                estimate_tokens(question)
+                + sum(estimate_tokens(m.content) for m in formatted_history)
+                + RETRIEVAL_CONTEXT_TOKENS
+                + CHAT_OUTPUT_TOKENS
+            )
+        )
         sources = []
         if "source_documents" in result:
             for doc in result["source_documents"]:
@@ -136,7 +301,7 @@ def process_query(
         return {
             "answer": result["answer"],
             "sources": sources,
-            "model_used": model_choice
+            "model_used": provider
         }
         
     except Exception as e:
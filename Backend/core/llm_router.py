@@ -0,0 +1,224 @@
+"""
+Provider routing for LLM calls.
+
+Tracks rolling latency and error rates per provider, fails over to the next
+healthy provider on errors and can optionally hedge slow requests by firing
+the same call at a second provider once the primary exceeds its p95 latency.
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+import logging
+import threading
+import time
+
+from config import (
+    LLM_PROVIDERS,
+    LLM_ROUTER_WINDOW,
+    LLM_ROUTER_MIN_SAMPLES,
+    LLM_ROUTER_MAX_ERROR_RATE,
+    LLM_PROVIDER_COOLDOWN_SECONDS,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_PERCENTILE,
+    LLM_HEDGE_MIN_DELAY_SECONDS,
+    LLM_HEDGE_MAX_WORKERS,
+    CANCEL_POLL_SECONDS,
+)
+from core.rate_limiter import RateLimitExceeded, provider_slot
+from utils.cancellation import CancelToken, OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ProviderStats:
+    """Rolling latency and outcome window for a single provider."""
+
+    def __init__(self, window: int):
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.cooldown_until = 0.0
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._outcomes.append(False)
+            if self._error_rate() > LLM_ROUTER_MAX_ERROR_RATE and len(self._outcomes) >= LLM_ROUTER_MIN_SAMPLES:
+                self.cooldown_until = time.monotonic() + LLM_PROVIDER_COOLDOWN_SECONDS
+
+    def _error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._error_rate()
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < LLM_ROUTER_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(percentile * len(ordered)))
+        return ordered[index]
+
+    def is_healthy(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        return {
+            "error_rate": round(self.error_rate(), 3),
+            "p50_latency": self.latency_percentile(0.5),
+            "p95_latency": self.latency_percentile(0.95),
+            "healthy": self.is_healthy(),
+        }
+
+
+class LLMRouter:
+    def __init__(self, providers: List[str]):
+        self.providers = list(providers)
+        self.stats = {p: ProviderStats(LLM_ROUTER_WINDOW) for p in self.providers}
+        self._executor = ThreadPoolExecutor(
+            max_workers=LLM_HEDGE_MAX_WORKERS, thread_name_prefix="llm-hedge"
+        )
+
+    def ordered_providers(self, preferred: Optional[str] = None) -> List[str]:
+        order = list(self.providers)
+        if preferred in order:
+            order.remove(preferred)
+            order.insert(0, preferred)
+        # Healthy providers first, keeping the preference order within each group
+        return sorted(order, key=lambda p: not self.stats[p].is_healthy())
+
+    def _timed_call(
+        self,
+        call: Callable[[str], T],
+        provider: str,
+        user_id: Optional[str],
+        tokens: int,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> T:
+        with provider_slot(provider, user_id, tokens, cancel_token):
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            start = time.monotonic()
+            try:
+                result = call(provider)
+            except OperationCancelled:
+                # Our caller gave up; that says nothing about the provider's health
+                raise
+            except Exception:
+                self.stats[provider].record_failure()
+                raise
+            self.stats[provider].record_success(time.monotonic() - start)
+            return result
+
+    def _hedge_delay(self, provider: str) -> Optional[float]:
+        p95 = self.stats[provider].latency_percentile(LLM_HEDGE_PERCENTILE)
+        if p95 is None:
+            return None
+        return max(p95, LLM_HEDGE_MIN_DELAY_SECONDS)
+
+    def invoke(
+        self,
+        call: Callable[[str], T],
+        preferred: Optional[str] = None,
+        user_id: Optional[str] = None,
+        tokens: int = 0,
+        hedge: bool = True,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> Tuple[T, str]:
+        """Run ``call(provider)`` with failover, returning the result and the provider that served it.
+
+        ``user_id`` and ``tokens`` feed the per-provider rate limiter. If every
+        provider is saturated the smallest RateLimitExceeded is re-raised.
+        Pass ``hedge=False`` for calls with side effects, such as streaming.
+        Once ``cancel_token`` fires, no further provider call is started and
+        OperationCancelled is raised instead of failing over.
+        """
+        order = self.ordered_providers(preferred)
+        last_error: Optional[Exception] = None
+        rate_limited: Optional[RateLimitExceeded] = None
+
+        while order:
+            primary = order.pop(0)
+            hedge_delay = self._hedge_delay(primary) if hedge and LLM_HEDGE_ENABLED and order else None
+            try:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                if hedge_delay is None:
+                    return self._timed_call(call, primary, user_id, tokens, cancel_token), primary
+                return self._invoke_hedged(call, primary, order, hedge_delay, user_id, tokens, cancel_token)
+            except OperationCancelled:
+                raise
+            except RateLimitExceeded as e:
+                if rate_limited is None or e.retry_after < rate_limited.retry_after:
+                    rate_limited = e
+                logger.warning(f"LLM provider '{primary}' is saturated")
+            except Exception as e:
+                last_error = e
+                logger.warning(f"LLM provider '{primary}' failed: {e}")
+            if order:
+                logger.info(f"Failing over to provider '{order[0]}'")
+
+        raise last_error or rate_limited
+
+    def _invoke_hedged(
+        self,
+        call: Callable[[str], T],
+        primary: str,
+        remaining: List[str],
+        hedge_delay: float,
+        user_id: Optional[str],
+        tokens: int,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> Tuple[T, str]:
+        futures = {self._executor.submit(self._timed_call, call, primary, user_id, tokens, cancel_token): primary}
+        done, _ = self._wait(futures, hedge_delay, cancel_token)
+
+        if not done:
+            secondary = remaining.pop(0)
+            logger.info(
+                f"Provider '{primary}' exceeded {hedge_delay:.2f}s, hedging with '{secondary}'"
+            )
+            futures[self._executor.submit(self._timed_call, call, secondary, user_id, tokens, cancel_token)] = secondary
+
+        last_error: Optional[Exception] = None
+        pending = set(futures)
+        while pending:
+            done, pending = self._wait(pending, None, cancel_token)
+            for future in done:
+                if future.exception() is None:
+                    return future.result(), futures[future]
+                last_error = future.exception()
+                logger.warning(f"LLM provider '{futures[future]}' failed: {last_error}")
+        raise last_error
+
+    @staticmethod
+    def _wait(futures, timeout: Optional[float], cancel_token: Optional[CancelToken]):
+        """wait(FIRST_COMPLETED) that gives up early once the token is cancelled.
+
+        Abandoned calls finish in the background and still release their slot.
+        """
+        if cancel_token is None:
+            return wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            cancel_token.raise_if_cancelled()
+            step = CANCEL_POLL_SECONDS if deadline is None else min(CANCEL_POLL_SECONDS, max(0.0, deadline - time.monotonic()))
+            done, pending = wait(futures, timeout=step, return_when=FIRST_COMPLETED)
+            if done or (deadline is not None and time.monotonic() >= deadline):
+                return done, pending
+
+    def snapshot(self) -> Dict[str, Dict[str, Optional[float]]]:
+        return {p: s.snapshot() for p, s in self.stats.items()}
+
+
+llm_router = LLMRouter(LLM_PROVIDERS)
@@ -68,6 +68,7 @@ class AudioFileMetadata(BaseModel):
     no_of_participants: Optional[int] = None
     sentiment: Optional[str] = None
     created_at: Optional[datetime] = None
+    url: Optional[str] = Field(default=None, description="Signed playback URL, only set when requested")
     
     @field_validator('key_aspects', mode='before')
     @classmethod
@@ -82,6 +83,37 @@ class AudioFileMetadata(BaseModel):
                 return [v]  # Return as single-item list if not valid JSON
         return v
 
+class CallSearchResult(BaseModel):
+    id: str
+    filename: str
+    created_at: Optional[datetime] = None
+    sentiment: Optional[str] = None
+    duration_minutes: Optional[int] = None
+    rank: float
+    snippet: str
+
+class CallSearchResponse(BaseModel):
+    query: str
+    total: int
+    limit: int
+    offset: int
+    results: List[CallSearchResult]
+
+class KeyAspectCount(BaseModel):
+    aspect: str
+    count: int
+
+class UserCallStats(BaseModel):
+    total_calls: int = 0
+    summarized_calls: int = 0
+    total_minutes: int = 0
+    average_minutes: Optional[float] = None
+    average_participants: Optional[float] = None
+    sentiment_counts: Dict[str, int] = {}
+    calls_per_day: Dict[str, int] = Field(default={}, description="Call counts keyed by UTC date (YYYY-MM-DD)")
+    top_key_aspects: List[KeyAspectCount] = []
+    updated_at: Optional[datetime] = None
+
 class AudioFileUploadResponse(BaseModel):
     file_id: str
     filename: str
@@ -125,6 +157,7 @@ class ChatQueryRequest(BaseModel):
     chat_history: Optional[List[ChatMessage]] = Field(default=None, description="Optional conversation history")
     model_choice: Optional[Literal["gemini", "groq"]] = Field(default="gemini", description="LLM model to use")
     selected_call_id: Optional[str] = Field(default=None, description="ID of the currently selected/viewed call for context")
+    conversation_id: Optional[str] = Field(default=None, description="Conversation ID, used to cache the running summary of older turns")
 
 class SourceDocument(BaseModel):
     content: str = Field(..., description="Content of the source document")
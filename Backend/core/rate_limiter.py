@@ -0,0 +1,174 @@
+"""
+Provider-aware rate limiting for LLM calls.
+
+Each provider gets a request bucket and a token bucket (per-minute budgets),
+a bounded number of in-flight calls and a wait queue that is served
+round-robin across users so one heavy user cannot starve everybody else.
+Callers that cannot be admitted within the queue wait limit get a
+RateLimitExceeded carrying a Retry-After hint.
+"""
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional
+import logging
+import math
+import threading
+import time
+
+from config import LLM_RATE_LIMITS, LLM_QUEUE_MAX_WAIT_SECONDS, CANCEL_POLL_SECONDS
+from utils.cancellation import CancelToken, OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, provider: str, retry_after: float):
+        self.provider = provider
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"Rate limit reached for provider '{provider}', retry after {self.retry_after}s")
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+class _Waiter:
+    __slots__ = ("tokens", "event")
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.event = threading.Event()
+
+
+class ProviderGovernor:
+    def __init__(self, provider: str, rpm: int, tpm: int, max_in_flight: int):
+        self.provider = provider
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.rejected = 0
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _dispatch(self) -> float:
+        """Admit queued waiters in round-robin user order. Returns the time until the next admission."""
+        now = time.monotonic()
+        while self._queues and self.in_flight < self.max_in_flight:
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            wait_for = max(
+                self.requests.time_until(1, now),
+                self.tokens.time_until(waiter.tokens, now),
+            )
+            if wait_for > 0:
+                return wait_for
+            self.requests.consume(1)
+            self.tokens.consume(waiter.tokens)
+            self.in_flight += 1
+            queue.popleft()
+            del self._queues[user_id]
+            if queue:
+                # Move the user to the back so other users get the next slot
+                self._queues[user_id] = queue
+            waiter.event.set()
+        return 0.05 if self._queues else 0.0
+
+    def _remove(self, user_id: str, waiter: _Waiter) -> None:
+        queue = self._queues.get(user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[user_id]
+
+    def acquire(
+        self,
+        user_id: Optional[str],
+        tokens: int,
+        max_wait: float = LLM_QUEUE_MAX_WAIT_SECONDS,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> None:
+        user_id = user_id or "anonymous"
+        waiter = _Waiter(tokens)
+        deadline = time.monotonic() + max_wait
+
+        with self._lock:
+            self._queues.setdefault(user_id, deque()).append(waiter)
+            wait_hint = self._dispatch()
+
+        while not waiter.event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    if waiter.event.is_set():
+                        break
+                    self._remove(user_id, waiter)
+                    self.rejected += 1
+                    wait_hint = self._dispatch()
+                logger.warning(f"LLM queue wait exceeded for provider={self.provider}, user={user_id}")
+                raise RateLimitExceeded(self.provider, wait_hint)
+            if cancel_token is not None:
+                if cancel_token.cancelled:
+                    with self._lock:
+                        if waiter.event.is_set():
+                            break
+                        self._remove(user_id, waiter)
+                        self._dispatch()
+                    raise OperationCancelled(cancel_token.reason)
+                wait_hint = min(wait_hint, CANCEL_POLL_SECONDS)
+            waiter.event.wait(timeout=min(remaining, max(wait_hint, 0.01)))
+            with self._lock:
+                wait_hint = self._dispatch()
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, user_id: Optional[str], tokens: int, cancel_token: Optional[CancelToken] = None):
+        self.acquire(user_id, tokens, cancel_token=cancel_token)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "rejected": self.rejected,
+            }
+
+
+governors: Dict[str, ProviderGovernor] = {
+    provider: ProviderGovernor(provider, **limits)
+    for provider, limits in LLM_RATE_LIMITS.items()
+}
+
+
+def provider_slot(provider: str, user_id: Optional[str], tokens: int, cancel_token: Optional[CancelToken] = None):
+    return governors[provider].slot(user_id, tokens, cancel_token)
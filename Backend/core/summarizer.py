@@ -1,7 +1,10 @@
 import warnings
+import hashlib
+import json
+from functools import lru_cache
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_groq import ChatGroq
-from utils.audio import transcribe_audio_simple
+from utils.audio import transcribe_audio_simple, file_sha256
 from core.prompts.templates import system_prompt
 from config import (
     GEMINI_API_KEY,
@@ -9,52 +12,135 @@ from config import (
     GEMINI_TEMPERATURE,
     GROQ_API_KEY,
     GROQ_MODEL_NAME,
-    GROQ_TEMPERATURE
+    GROQ_TEMPERATURE,
+    LLM_REQUEST_TIMEOUT_SECONDS,
+    LLM_MAX_RETRIES
 )
 from core.models import SummaryResponse
+from core.llm_router import llm_router
+from utils.tokens import estimate_tokens
+from utils.summary_cache import build_summary_cache_key, get_cached_summary, store_summary
+from utils.single_flight import SingleFlight
+from utils.cancellation import CancelToken
 import logging
 
 logger = logging.getLogger(__name__)
 warnings.filterwarnings("ignore")
 
+# Identical concurrent requests (double clicks, client retries) share one pipeline run
+summary_flight = SingleFlight("summary")
+
+# Changes to the prompt text or the structured output schema invalidate cached summaries
+SUMMARY_PROMPT_VERSION = hashlib.sha256(
+    (system_prompt + json.dumps(SummaryResponse.model_json_schema(), sort_keys=True)).encode("utf-8")
+).hexdigest()[:16]
+
+@lru_cache(maxsize=1)
 def create_gemini_llm():
     return ChatGoogleGenerativeAI(
         model=GEMINI_MODEL_NAME,
         api_key=GEMINI_API_KEY,
-        temperature=GEMINI_TEMPERATURE
+        temperature=GEMINI_TEMPERATURE,
+        timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+        max_retries=LLM_MAX_RETRIES
     )
 
+@lru_cache(maxsize=1)
 def create_groq_llm():
     return ChatGroq(
         model=GROQ_MODEL_NAME,
         api_key=GROQ_API_KEY,
-        temperature=GROQ_TEMPERATURE
+        temperature=GROQ_TEMPERATURE,
+        timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+        max_retries=LLM_MAX_RETRIES
     )
 
-def generate_summary(audio_file_path: str | None = None) -> dict:
-    logger.info(f"Generating summary for audio file: {audio_file_path}")
-    if audio_file_path is None:
-        logger.error("No audio file path provided")
-        raise ValueError("Provide the valid Audio File for processing")
-    
-    logger.debug("Starting transcription...")
-    transcript = transcribe_audio_simple(audio_file_path)
-    logger.debug(f"Transcription complete, length: {len(transcript)} characters")
-    
-    logger.debug("Generating summary with Gemini...")
-    llm = create_gemini_llm()
-    st_llm = llm.with_structured_output(SummaryResponse)
+PROVIDER_MODELS = {
+    "gemini": (GEMINI_MODEL_NAME, GEMINI_TEMPERATURE),
+    "groq": (GROQ_MODEL_NAME, GROQ_TEMPERATURE),
+}
+
+def create_llm(provider: str):
+    if provider == "groq":
+        return create_groq_llm()
+    return create_gemini_llm()
+
+# Room reserved in the token budget for the structured summary itself
+SUMMARY_OUTPUT_TOKENS = 1024
+
+def summarize_transcript(
+    transcript: str,
+    preferred_provider: str = "gemini",
+    user_id: str | None = None,
+    cancel_token: CancelToken | None = None
+) -> dict:
+    model_name, temperature = PROVIDER_MODELS[preferred_provider]
+    cache_key = build_summary_cache_key(transcript, SUMMARY_PROMPT_VERSION, model_name, temperature)
+    cached = get_cached_summary(cache_key)
+    if cached is not None:
+        logger.info("Summary cache hit, skipping LLM call")
+        return {**cached, "transcript": transcript}
+
+    result = summary_flight.do(
+        f"llm:{cache_key}",
+        lambda: _summarize_uncached(transcript, preferred_provider, user_id, cancel_token)
+    )
+    return {**result, "transcript": transcript}
+
+
+def _summarize_uncached(
+    transcript: str,
+    preferred_provider: str,
+    user_id: str | None,
+    cancel_token: CancelToken | None = None
+) -> dict:
     final_prompt = system_prompt.format(transcript=transcript)
-    response = st_llm.invoke(final_prompt)
-    logger.info("Summary generation complete")
-    
-    return {
+
+    def _summarize(provider: str) -> SummaryResponse:
+        logger.debug(f"Generating summary with {provider}...")
+        st_llm = create_llm(provider).with_structured_output(SummaryResponse)
+        return st_llm.invoke(final_prompt)
+
+    response, provider = llm_router.invoke(
+        _summarize,
+        preferred=preferred_provider,
+        user_id=user_id,
+        tokens=estimate_tokens(final_prompt) + SUMMARY_OUTPUT_TOKENS,
+        cancel_token=cancel_token
+    )
+    logger.info(f"Summary generation complete, provider={provider}")
+
+    result = {
         "summary": response.summary,
         "duration_minutes": response.duration_minutes,
         "no_of_participants": response.no_of_participants,
         "key_aspects": response.key_aspects,
         "sentiment": response.sentiment,
-        "transcript": transcript
     }
+    model_name, temperature = PROVIDER_MODELS[provider]
+    store_summary(
+        build_summary_cache_key(transcript, SUMMARY_PROMPT_VERSION, model_name, temperature),
+        result,
+    )
+    return result
+
+
+def generate_summary(
+    audio_file_path: str | None = None,
+    user_id: str | None = None,
+    cancel_token: CancelToken | None = None
+) -> dict:
+    logger.info(f"Generating summary for audio file: {audio_file_path}")
+    if audio_file_path is None:
+        logger.error("No audio file path provided")
+        raise ValueError("Provide the valid Audio File for processing")
+    
+    def _run() -> dict:
+        logger.debug("Starting transcription...")
+        transcript = transcribe_audio_simple(audio_file_path, cancel_token=cancel_token)
+        logger.debug(f"Transcription complete, length: {len(transcript)} characters")
+        return summarize_transcript(transcript, user_id=user_id, cancel_token=cancel_token)
 
+    # Keyed on the audio bytes so re-uploads of the same recording coalesce too
+    return dict(summary_flight.do(f"audio:{file_sha256(audio_file_path)}", _run))
 
@@ -0,0 +1,124 @@
+"""
+Startup warm-up and readiness state.
+
+Runs once in the background after startup. It loads and exercises the
+Whisper models, builds the LLM clients, loads the embedding service, and
+opens connections to Supabase and Pinecone, so the first user request
+doesn't pay for any of it. /ready reports 503 until Whisper (or the
+transcription worker's socket) is usable. That required check is retried with
+backoff until it passes, since the worker may still be loading its model when
+the API starts. Failures of external services are recorded but don't block
+readiness, because those services recover on their own and requests retry
+them anyway.
+"""
+from typing import Any, Callable, Dict
+import logging
+import threading
+import time
+
+from config import (
+    TRANSCRIBER_SOCKET,
+    VECTOR_STORE_BACKEND,
+    WARMUP_ENABLED,
+    WARMUP_WHISPER_SIZES,
+    WARMUP_SAMPLE_AUDIO,
+    WARMUP_RETRY_MAX_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_state: Dict[str, Any] = {"ready": not WARMUP_ENABLED, "started_at": None, "finished_at": None, "checks": {}}
+
+
+def _check(name: str, fn: Callable[[], Any], required: bool = False) -> bool:
+    start = time.monotonic()
+    try:
+        fn()
+        result = {"status": "ok"}
+    except Exception as e:
+        logger.warning(f"Warm-up step '{name}' failed: {e}")
+        result = {"status": "failed", "error": str(e)}
+    result["seconds"] = round(time.monotonic() - start, 3)
+    result["required"] = required
+    with _lock:
+        result["attempts"] = _state["checks"].get(name, {}).get("attempts", 0) + 1
+        _state["checks"][name] = result
+    return result["status"] == "ok"
+
+
+def _warm_whisper():
+    from utils.audio import warm_whisper_model
+    for size in WARMUP_WHISPER_SIZES:
+        # Only the default size gets a dummy decode; the others are just loaded
+        warm_whisper_model(size, WARMUP_SAMPLE_AUDIO if size == WARMUP_WHISPER_SIZES[0] else None)
+
+
+def _warm_transcriber():
+    from multiprocessing.connection import Client
+    from config import TRANSCRIBER_AUTHKEY
+    # The worker service preloads its own model; just make sure it is reachable
+    Client(TRANSCRIBER_SOCKET, family="AF_UNIX", authkey=TRANSCRIBER_AUTHKEY.encode()).close()
+
+
+def _warm_llm_clients():
+    from core.summarizer import create_gemini_llm, create_groq_llm
+    create_gemini_llm()
+    create_groq_llm()
+
+
+def _warm_embeddings():
+    from utils.embeddings import load_embeddings
+    load_embeddings()
+
+
+def _warm_supabase():
+    from utils.supabase_client import SupabaseClient
+    SupabaseClient.anon()
+    SupabaseClient.service().table("audio_files").select("id").limit(1).execute()
+
+
+def _warm_vector_store():
+    from utils.vector_store import get_index
+    get_index().describe_index_stats()
+
+
+def run_warmup() -> None:
+    """Blocking; run it in a daemon thread. Returns once the required check has passed."""
+    if not WARMUP_ENABLED:
+        return
+    logger.info("Starting warm-up")
+    with _lock:
+        _state["started_at"] = time.time()
+
+    if TRANSCRIBER_SOCKET:
+        required = ("transcriber", _warm_transcriber)
+    else:
+        required = ("whisper", _warm_whisper)
+    ready = _check(*required, required=True)
+    _check("llm_clients", _warm_llm_clients)
+    _check("embeddings", _warm_embeddings)
+    _check("supabase", _warm_supabase)
+    if VECTOR_STORE_BACKEND == "pinecone":
+        _check("pinecone", _warm_vector_store)
+
+    delay = 1.0
+    while not ready:
+        logger.info(f"Warm-up check '{required[0]}' not passing yet, retrying in {delay:.0f}s")
+        time.sleep(delay)
+        delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+        ready = _check(*required, required=True)
+
+    with _lock:
+        _state["finished_at"] = time.time()
+        _state["ready"] = True
+    logger.info(f"Warm-up finished in {_state['finished_at'] - _state['started_at']:.1f}s")
+
+
+def is_ready() -> bool:
+    return _state["ready"]
+
+
+def readiness_snapshot() -> Dict[str, Any]:
+    with _lock:
+        return {**_state, "checks": {k: dict(v) for k, v in _state["checks"].items()}}
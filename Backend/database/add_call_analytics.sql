@@ -0,0 +1,46 @@
+-- Grouped call statistics used to answer aggregate chat questions
+-- ("how many negative calls this month", "total minutes last week") exactly.
+CREATE INDEX IF NOT EXISTS idx_audio_files_user_created_at
+ON audio_files(user_id, created_at DESC);
+
+-- One row per (bucket, sentiment). Sums and non-null counts are returned instead
+-- of averages so callers can combine groups without losing precision.
+CREATE OR REPLACE FUNCTION public.call_stats(
+    p_user_id UUID,
+    p_start TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_end TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_sentiment TEXT DEFAULT NULL,
+    p_bucket TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    bucket TIMESTAMP WITH TIME ZONE,
+    sentiment TEXT,
+    calls BIGINT,
+    total_minutes BIGINT,
+    timed_calls BIGINT,
+    total_participants BIGINT,
+    counted_calls BIGINT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        CASE WHEN p_bucket IN ('day', 'week', 'month') THEN date_trunc(p_bucket, f.created_at) END,
+        f.sentiment,
+        COUNT(*),
+        COALESCE(SUM(f.duration_minutes), 0),
+        COUNT(f.duration_minutes),
+        COALESCE(SUM(f.no_of_participants), 0),
+        COUNT(f.no_of_participants)
+    FROM audio_files f
+    WHERE f.user_id = p_user_id
+      AND (p_start IS NULL OR f.created_at >= p_start)
+      AND (p_end IS NULL OR f.created_at < p_end)
+      AND (p_sentiment IS NULL OR lower(f.sentiment) = lower(p_sentiment))
+    GROUP BY 1, 2
+    ORDER BY 1 NULLS FIRST, 2;
+$$;
+
+-- p_user_id is trusted, so only the backend (service role) may call this
+REVOKE EXECUTE ON FUNCTION public.call_stats(UUID, TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE, TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.call_stats(UUID, TIMESTAMP WITH TIME ZONE, TIMESTAMP WITH TIME ZONE, TEXT, TEXT) TO service_role;
@@ -0,0 +1,151 @@
+-- Per-user call statistics, maintained incrementally by a trigger on audio_files
+-- so dashboards read one row instead of scanning every call.
+CREATE TABLE IF NOT EXISTS user_call_stats (
+    user_id UUID PRIMARY KEY REFERENCES auth.users(id) ON DELETE CASCADE,
+    total_calls INTEGER NOT NULL DEFAULT 0,
+    summarized_calls INTEGER NOT NULL DEFAULT 0,
+    total_minutes BIGINT NOT NULL DEFAULT 0,
+    total_participants BIGINT NOT NULL DEFAULT 0,
+    sentiment_counts JSONB NOT NULL DEFAULT '{}'::jsonb,
+    calls_per_day JSONB NOT NULL DEFAULT '{}'::jsonb,
+    key_aspect_counts JSONB NOT NULL DEFAULT '{}'::jsonb,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE user_call_stats ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view their own call stats" ON user_call_stats;
+CREATE POLICY "Users can view their own call stats"
+    ON user_call_stats FOR SELECT
+    USING (auth.uid() = user_id);
+
+-- Add delta to a counter in a JSON object, dropping keys that reach zero
+CREATE OR REPLACE FUNCTION public.jsonb_increment(obj JSONB, counter TEXT, delta INTEGER)
+RETURNS JSONB
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN coalesce((obj ->> counter)::INTEGER, 0) + delta <= 0 THEN obj - counter
+        ELSE jsonb_set(obj, ARRAY[counter], to_jsonb(coalesce((obj ->> counter)::INTEGER, 0) + delta))
+    END;
+$$;
+
+-- key_aspects may be a JSON array or a JSON-encoded string holding one
+CREATE OR REPLACE FUNCTION public.normalize_key_aspects(aspects JSONB)
+RETURNS SETOF TEXT
+LANGUAGE plpgsql
+IMMUTABLE
+AS $$
+DECLARE
+    arr JSONB := aspects;
+BEGIN
+    IF jsonb_typeof(arr) = 'string' THEN
+        BEGIN
+            arr := (aspects #>> '{}')::JSONB;
+        EXCEPTION WHEN others THEN
+            arr := jsonb_build_array(aspects #>> '{}');
+        END;
+    END IF;
+    IF jsonb_typeof(arr) <> 'array' THEN
+        RETURN;
+    END IF;
+    RETURN QUERY
+        SELECT DISTINCT left(lower(trim(value)), 200)
+        FROM jsonb_array_elements_text(arr) AS value
+        WHERE trim(value) <> '';
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.apply_call_stats_delta(call audio_files, sign INTEGER)
+RETURNS VOID
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    aspect TEXT;
+    aspect_counts JSONB;
+BEGIN
+    INSERT INTO user_call_stats (user_id) VALUES (call.user_id) ON CONFLICT (user_id) DO NOTHING;
+
+    SELECT key_aspect_counts INTO aspect_counts
+    FROM user_call_stats WHERE user_id = call.user_id FOR UPDATE;
+
+    FOR aspect IN SELECT normalize_key_aspects(coalesce(call.key_aspects, '[]'::jsonb)) LOOP
+        aspect_counts := jsonb_increment(aspect_counts, aspect, sign);
+    END LOOP;
+
+    UPDATE user_call_stats SET
+        total_calls = total_calls + sign,
+        summarized_calls = summarized_calls + CASE WHEN call.summary IS NOT NULL THEN sign ELSE 0 END,
+        total_minutes = total_minutes + sign * coalesce(call.duration_minutes, 0),
+        total_participants = total_participants + sign * coalesce(call.no_of_participants, 0),
+        sentiment_counts = CASE
+            WHEN call.sentiment IS NULL THEN sentiment_counts
+            ELSE jsonb_increment(sentiment_counts, call.sentiment, sign)
+        END,
+        calls_per_day = jsonb_increment(
+            calls_per_day, to_char(coalesce(call.created_at, NOW()) AT TIME ZONE 'UTC', 'YYYY-MM-DD'), sign
+        ),
+        key_aspect_counts = aspect_counts,
+        updated_at = NOW()
+    WHERE user_id = call.user_id;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.handle_audio_file_stats()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+        AND OLD.user_id = NEW.user_id
+        AND OLD.created_at IS NOT DISTINCT FROM NEW.created_at
+        AND OLD.summary IS NOT DISTINCT FROM NEW.summary
+        AND OLD.duration_minutes IS NOT DISTINCT FROM NEW.duration_minutes
+        AND OLD.no_of_participants IS NOT DISTINCT FROM NEW.no_of_participants
+        AND OLD.sentiment IS NOT DISTINCT FROM NEW.sentiment
+        AND OLD.key_aspects IS NOT DISTINCT FROM NEW.key_aspects THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_call_stats_delta(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_call_stats_delta(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS on_audio_file_stats_change ON audio_files;
+CREATE TRIGGER on_audio_file_stats_change
+    AFTER INSERT OR UPDATE OR DELETE ON audio_files
+    FOR EACH ROW
+    EXECUTE FUNCTION public.handle_audio_file_stats();
+
+-- One-off rebuild from existing rows (also safe to re-run after manual data fixes)
+CREATE OR REPLACE FUNCTION public.rebuild_user_call_stats()
+RETURNS VOID
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    call audio_files;
+BEGIN
+    DELETE FROM user_call_stats;
+    FOR call IN SELECT * FROM audio_files LOOP
+        PERFORM apply_call_stats_delta(call, 1);
+    END LOOP;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION public.rebuild_user_call_stats() FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.apply_call_stats_delta(audio_files, INTEGER) FROM PUBLIC, anon, authenticated;
+
+SELECT public.rebuild_user_call_stats();
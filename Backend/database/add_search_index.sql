@@ -0,0 +1,78 @@
+-- Full-text search over call summaries, key aspects and transcripts.
+-- Summary matches rank above key aspects, which rank above transcript matches.
+ALTER TABLE audio_files
+ADD COLUMN IF NOT EXISTS search_vector tsvector
+GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(summary, '')), 'A') ||
+    setweight(jsonb_to_tsvector('english', coalesce(key_aspects, '[]'::jsonb), '["string"]'), 'B') ||
+    setweight(to_tsvector('english', coalesce(transcript, '')), 'C')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_audio_files_search_vector
+ON audio_files USING GIN (search_vector);
+
+COMMENT ON COLUMN audio_files.search_vector IS 'Weighted full-text vector over summary, key_aspects and transcript';
+
+-- Ranked, highlighted search for one user's calls. Only the requested page is
+-- headlined, so transcript bodies never leave the database.
+CREATE OR REPLACE FUNCTION public.search_audio_files(
+    p_user_id UUID,
+    p_query TEXT,
+    p_limit INTEGER DEFAULT 20,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS TABLE (
+    id UUID,
+    filename TEXT,
+    created_at TIMESTAMP WITH TIME ZONE,
+    sentiment TEXT,
+    duration_minutes INTEGER,
+    rank REAL,
+    snippet TEXT,
+    total_count BIGINT
+)
+LANGUAGE sql
+STABLE
+AS $$
+    WITH query AS (
+        SELECT websearch_to_tsquery('english', p_query) AS tsq
+    ),
+    page AS (
+        SELECT
+            f.id,
+            f.filename,
+            f.created_at,
+            f.sentiment,
+            f.duration_minutes,
+            f.summary,
+            f.transcript,
+            ts_rank(f.search_vector, query.tsq) AS score,
+            COUNT(*) OVER () AS total_count
+        FROM audio_files f, query
+        WHERE f.user_id = p_user_id
+          AND f.search_vector @@ query.tsq
+        ORDER BY score DESC, f.created_at DESC
+        LIMIT p_limit
+        OFFSET p_offset
+    )
+    SELECT
+        page.id,
+        page.filename,
+        page.created_at,
+        page.sentiment,
+        page.duration_minutes,
+        page.score,
+        ts_headline(
+            'english',
+            coalesce(page.summary, '') || ' ' || coalesce(page.transcript, ''),
+            query.tsq,
+            'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=30, MinWords=10, FragmentDelimiter=" ... "'
+        ),
+        page.total_count
+    FROM page, query
+    ORDER BY page.score DESC, page.created_at DESC;
+$$;
+
+-- p_user_id is trusted, so only the backend (service role) may call this
+REVOKE EXECUTE ON FUNCTION public.search_audio_files(UUID, TEXT, INTEGER, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.search_audio_files(UUID, TEXT, INTEGER, INTEGER) TO service_role;
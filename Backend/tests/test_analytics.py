@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from core.analytics import (
+    METRIC_AVG_MINUTES,
+    METRIC_AVG_PARTICIPANTS,
+    METRIC_COUNT,
+    METRIC_SENTIMENT,
+    METRIC_TOTAL_MINUTES,
+    detect_aggregate_intent,
+)
+
+NOW = datetime(2026, 3, 18, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("question", [
+    "How many participants were in my last call?",
+    "how many action items came up in this call?",
+    "How many calls did I have with Acme Corp?",
+    "How many minutes was the selected call?",
+    "how many calls did I have with acme?",
+    "How many calls from John this week?",
+    "How many people joined the meeting?",
+    "how long was that conversation?",
+    "How many participants were there?",
+    "What was discussed in my calls this week?",
+    "How many calls mentioned pricing?",
+])
+def test_per_call_and_entity_questions_are_not_routed(question):
+    assert detect_aggregate_intent(question, now=NOW) is None
+
+
+def test_selected_call_skips_routing():
+    assert detect_aggregate_intent("How many calls did I have this month?", now=NOW, selected_call_id="abc") is None
+
+
+@pytest.mark.parametrize("question, metric", [
+    ("How many calls did I have this month?", METRIC_COUNT),
+    ("how many negative calls last week?", METRIC_COUNT),
+    ("What is the total minutes of calls this year?", METRIC_TOTAL_MINUTES),
+    ("How many minutes did I spend on calls in the last 7 days?", METRIC_TOTAL_MINUTES),
+    ("average call duration this month", METRIC_AVG_MINUTES),
+    ("average number of participants per call", METRIC_AVG_PARTICIPANTS),
+    ("sentiment breakdown of my calls", METRIC_SENTIMENT),
+    ("how many calls with a negative sentiment this week?", METRIC_COUNT),
+])
+def test_whole_set_questions_are_routed(question, metric):
+    query = detect_aggregate_intent(question, now=NOW)
+    assert query is not None
+    assert query.metric == metric
+
+
+def test_time_range_and_bucket():
+    query = detect_aggregate_intent("how many calls per day last week", now=NOW)
+    assert query.bucket == "day"
+    assert query.period == "last week"
+    assert query.start == datetime(2026, 3, 9, tzinfo=timezone.utc)
+    assert query.end == datetime(2026, 3, 16, tzinfo=timezone.utc)
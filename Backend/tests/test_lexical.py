@@ -0,0 +1,28 @@
+import pytest
+
+from utils.lexical import is_exact_lookup, tokenize
+
+
+@pytest.mark.parametrize("question", [
+    "What's the customer's name?",
+    "any follow-up items?",
+    "summarize my last 3 calls",
+    "what happened in my last 10 calls?",
+    "what did they say about pricing in the last 30 days?",
+])
+def test_conversational_questions_are_not_exact_lookups(question):
+    assert not is_exact_lookup(question)
+
+
+@pytest.mark.parametrize("question", [
+    "what was said about invoice INV-4471?",
+    "find order 88231",
+    "who mentioned ticket a1b2c3",
+    'where did they say "renewal discount"?',
+])
+def test_identifier_questions_are_exact_lookups(question):
+    assert is_exact_lookup(question)
+
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("What did the customer say about the refund?") == ["customer", "say", "refund"]
@@ -0,0 +1,168 @@
+"""
+ConvoxAI - Transcription Worker Service
+Runs Whisper in one dedicated process per node so API workers don't each load
+their own copy of the model or compete with request handling for CPU.
+
+    TRANSCRIBER_SOCKET=/tmp/convoxai-transcriber.sock python transcriber.py
+
+Start the API with the same TRANSCRIBER_SOCKET to route transcription here.
+The model is loaded once with TRANSCRIBER_NUM_WORKERS parallel decoders of
+TRANSCRIBER_CPU_THREADS threads each, and the process can be pinned to a CPU
+set (TRANSCRIBER_CPUS) so API workers keep the remaining cores.
+
+Connections must authenticate with TRANSCRIBER_AUTHKEY, messages are JSON, and
+only files under the system temp directory (where the API saves uploads) are
+read.
+"""
+from multiprocessing.connection import Connection, Listener
+from typing import Set
+import logging
+import os
+import tempfile
+import threading
+
+from config import (
+    TRANSCRIBER_SOCKET,
+    TRANSCRIBER_AUTHKEY,
+    TRANSCRIBER_NUM_WORKERS,
+    TRANSCRIBER_CPU_THREADS,
+    TRANSCRIBER_CPUS,
+    WHISPER_MODEL_SIZE,
+    WARMUP_SAMPLE_AUDIO,
+    CANCEL_POLL_SECONDS,
+)
+from utils.audio import WHISPER_MODEL_SIZES, get_whisper_model, warm_whisper_model, transcribe_local
+from utils.cancellation import CancelToken, OperationCancelled
+from utils.transcription_client import recv_message, send_message
+from utils.logger_config import setup_logging, get_log_level_from_env
+
+logger = logging.getLogger("transcriber")
+
+# Bounds concurrent decodes to the number of model workers; extra jobs wait here
+_decode_slots = threading.BoundedSemaphore(TRANSCRIBER_NUM_WORKERS)
+_UPLOAD_DIR = os.path.realpath(tempfile.gettempdir())
+
+
+def _parse_cpus(spec: str) -> Set[int]:
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.update(range(int(start), int(end) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def _is_upload(path: str) -> bool:
+    real = os.path.realpath(path)
+    return os.path.commonpath([real, _UPLOAD_DIR]) == _UPLOAD_DIR and os.path.isfile(real)
+
+
+def _load_model(model_size: str):
+    # Every size gets the worker's thread and decoder settings, not the library defaults
+    return get_whisper_model(model_size, cpu_threads=TRANSCRIBER_CPU_THREADS, num_workers=TRANSCRIBER_NUM_WORKERS)
+
+
+def _watch_for_cancel(conn: Connection, token: CancelToken, done: threading.Event) -> None:
+    """Cancel the job when the API side sends a cancel message or hangs up."""
+    while not done.is_set():
+        try:
+            if conn.poll(CANCEL_POLL_SECONDS):
+                message = recv_message(conn)
+                if message.get("op") == "cancel":
+                    token.cancel("client disconnected")
+                    return
+        except (EOFError, OSError, ValueError):
+            token.cancel("client disconnected")
+            return
+
+
+def _handle(conn: Connection) -> None:
+    with conn:
+        try:
+            job = recv_message(conn)
+        except (EOFError, OSError, ValueError):
+            return
+        if job.get("op") != "transcribe":
+            send_message(conn, {"ok": False, "error": f"Unknown op: {job.get('op')}", "error_type": "ValueError"})
+            return
+        path = job.get("path")
+        if not isinstance(path, str) or not _is_upload(path):
+            logger.warning(f"Rejected transcription job for a path outside {_UPLOAD_DIR}: {path}")
+            send_message(conn, {"ok": False, "error": "Invalid audio path", "error_type": "ValueError"})
+            return
+        model_size = job.get("model_size", WHISPER_MODEL_SIZE)
+        if model_size not in WHISPER_MODEL_SIZES:
+            send_message(conn, {"ok": False, "error": "Invalid model size.", "error_type": "ValueError"})
+            return
+
+        token = CancelToken()
+        done = threading.Event()
+        watcher = threading.Thread(target=_watch_for_cancel, args=(conn, token, done), daemon=True)
+        watcher.start()
+        try:
+            while not _decode_slots.acquire(timeout=CANCEL_POLL_SECONDS):
+                token.raise_if_cancelled()
+            try:
+                _load_model(model_size)
+                text = transcribe_local(path, model_size, token)
+            finally:
+                _decode_slots.release()
+            reply = {"ok": True, "text": text}
+        except OperationCancelled as oc:
+            logger.info(f"Transcription job cancelled: {oc.reason}")
+            return
+        except Exception as e:
+            logger.exception(f"Transcription job failed: {path}")
+            reply = {"ok": False, "error": str(e), "error_type": type(e).__name__}
+        finally:
+            done.set()
+            watcher.join()
+
+        try:
+            send_message(conn, reply)
+        except (OSError, ValueError):
+            logger.warning("API worker hung up before the transcript was sent")
+
+
+def main():
+    setup_logging(log_level=get_log_level_from_env(), log_to_file=True, log_filename="transcriber.log")
+    if not TRANSCRIBER_SOCKET:
+        raise SystemExit("TRANSCRIBER_SOCKET must be set")
+    if not TRANSCRIBER_AUTHKEY:
+        raise SystemExit("TRANSCRIBER_AUTHKEY must be set")
+
+    if TRANSCRIBER_CPUS:
+        os.sched_setaffinity(0, _parse_cpus(TRANSCRIBER_CPUS))
+        logger.info(f"Pinned transcriber to CPUs: {sorted(os.sched_getaffinity(0))}")
+
+    _load_model(WHISPER_MODEL_SIZE)
+    warm_whisper_model(WHISPER_MODEL_SIZE, WARMUP_SAMPLE_AUDIO)
+
+    if os.path.exists(TRANSCRIBER_SOCKET):
+        os.unlink(TRANSCRIBER_SOCKET)
+    listener = Listener(TRANSCRIBER_SOCKET, family="AF_UNIX", authkey=TRANSCRIBER_AUTHKEY.encode())
+    os.chmod(TRANSCRIBER_SOCKET, 0o660)
+    logger.info(
+        f"Transcriber listening on {TRANSCRIBER_SOCKET}: model={WHISPER_MODEL_SIZE}, "
+        f"workers={TRANSCRIBER_NUM_WORKERS}, cpu_threads={TRANSCRIBER_CPU_THREADS or 'auto'}"
+    )
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # Failed handshakes (wrong authkey) shouldn't take the service down
+                logger.warning(f"Rejected transcriber connection: {e}")
+                continue
+            threading.Thread(target=_handle, args=(conn,), daemon=True).start()
+    except KeyboardInterrupt:
+        logger.info("Transcriber shutting down")
+    finally:
+        listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 from faster_whisper import WhisperModel
 import warnings
+import hashlib
 import os
-from config import WHISPER_MODEL_SIZE
+import threading
+from config import WHISPER_MODEL_SIZE, TRANSCRIBER_SOCKET
+from utils.cancellation import CancelToken
+from utils.transcription_client import transcribe_remote
+from typing import Optional
 import logging
 
 try:
@@ -14,15 +19,36 @@ except (ImportError, ModuleNotFoundError) as e:
 logger = logging.getLogger(__name__)
 warnings.filterwarnings("ignore", category=UserWarning)
 
+WHISPER_MODEL_SIZES = ("tiny", "base", "small", "medium", "large")
+
 _MODEL_CACHE = {}
+_MODEL_LOCK = threading.Lock()
 
-def get_whisper_model(model_size):
+def get_whisper_model(model_size, cpu_threads=0, num_workers=1):
     if model_size not in _MODEL_CACHE:
-        logger.debug(f"Loading Whisper model: {model_size}")
-        _MODEL_CACHE[model_size] = WhisperModel(model_size, device="cpu", compute_type="int8")
-        logger.info(f"Whisper model '{model_size}' loaded successfully")
+        # Startup warm-up and the first request may race to load the same model
+        with _MODEL_LOCK:
+            if model_size not in _MODEL_CACHE:
+                logger.debug(f"Loading Whisper model: {model_size}")
+                _MODEL_CACHE[model_size] = WhisperModel(
+                    model_size,
+                    device="cpu",
+                    compute_type="int8",
+                    cpu_threads=cpu_threads,
+                    num_workers=num_workers
+                )
+                logger.info(f"Whisper model '{model_size}' loaded successfully")
     return _MODEL_CACHE[model_size]
 
+def warm_whisper_model(model_size, sample_path=None):
+    """Load the model and decode the first window of a sample so the first request skips init."""
+    model = get_whisper_model(model_size)
+    if sample_path and os.path.exists(sample_path):
+        segments, _ = model.transcribe(sample_path)
+        next(iter(segments), None)
+        logger.info(f"Whisper model '{model_size}' warmed up on {sample_path}")
+    return model
+
 def convert_to_wav(input_file_path, output_file_path):
     if not PYDUB_AVAILABLE:
         raise RuntimeError(
@@ -35,20 +61,50 @@ def convert_to_wav(input_file_path, output_file_path):
     except Exception as e:
         raise RuntimeError(f"Audio conversion failed: {e}")
 
-def transcribe_audio_simple(audio_file_path, model_size=WHISPER_MODEL_SIZE):
-    logger.info(f"Starting transcription: file={audio_file_path}, model={model_size}")
-    if model_size not in ["tiny", "base", "small", "medium", "large"]:
+def transcribe_audio_simple(audio_file_path, model_size=WHISPER_MODEL_SIZE, cancel_token: Optional[CancelToken] = None):
+    if model_size not in WHISPER_MODEL_SIZES:
         logger.error(f"Invalid model size: {model_size}")
         raise ValueError("Invalid model size.")
+    if TRANSCRIBER_SOCKET:
+        return transcribe_remote(audio_file_path, model_size, cancel_token)
+    return transcribe_local(audio_file_path, model_size, cancel_token)
+
+
+def transcribe_local(audio_file_path, model_size=WHISPER_MODEL_SIZE, cancel_token: Optional[CancelToken] = None):
+    logger.info(f"Starting transcription: file={audio_file_path}, model={model_size}")
+    converted_path = None
     if not audio_file_path.lower().endswith(".wav"):
         wav_file_path = audio_file_path.rsplit(".", 1)[0] + ".wav"
         if not os.path.exists(wav_file_path):
             convert_to_wav(audio_file_path, wav_file_path)
+            converted_path = wav_file_path
         audio_file_path = wav_file_path
-    model = get_whisper_model(model_size)
-    logger.debug("Running Whisper transcription...")
-    segments, info = model.transcribe(audio_file_path)
-    text = " ".join([segment.text for segment in segments])
-    logger.info(f"Transcription complete: {len(text)} characters, language={info.language}")
-    return text
+    try:
+        model = get_whisper_model(model_size)
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        logger.debug("Running Whisper transcription...")
+        segments, info = model.transcribe(audio_file_path)
+        texts = []
+        # segments is lazy: each step decodes the next window, so stop between them when cancelled
+        for segment in segments:
+            texts.append(segment.text)
+            if cancel_token and cancel_token.cancelled:
+                logger.info(f"Transcription cancelled after {len(texts)} segments: {cancel_token.reason}")
+                cancel_token.raise_if_cancelled()
+        text = " ".join(texts)
+        logger.info(f"Transcription complete: {len(text)} characters, language={info.language}")
+        return text
+    finally:
+        if converted_path and os.path.exists(converted_path):
+            try:
+                os.unlink(converted_path)
+            except OSError:
+                pass
 
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,57 @@
+"""
+Cooperative cancellation for long-running request work.
+
+A CancelToken is created per request and passed down to blocking code running
+in worker threads (Whisper segment loop, LLM rate-limit queue, provider
+failover). That code calls ``raise_if_cancelled()`` at safe points, so the
+thread stops soon after the client disconnects or the deadline passes. An
+in-progress HTTP call to an LLM provider cannot be interrupted; the check
+happens before the next one starts.
+"""
+from typing import Optional
+import asyncio
+import threading
+import time
+
+from config import CANCEL_POLL_SECONDS
+
+
+class OperationCancelled(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+        super().__init__(f"Operation cancelled: {reason}")
+
+
+class CancelToken:
+    def __init__(self, deadline_seconds: Optional[float] = None):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+        self.deadline = time.monotonic() + deadline_seconds if deadline_seconds else None
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline exceeded")
+        return self._event.is_set()
+
+    @property
+    def deadline_exceeded(self) -> bool:
+        return self.cancelled and self.reason == "deadline exceeded"
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise OperationCancelled(self.reason)
+
+
+async def cancel_on_disconnect(request, token: CancelToken, interval: float = CANCEL_POLL_SECONDS) -> None:
+    """Poll a Starlette request and cancel ``token`` once the client has gone away."""
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("client disconnected")
+            return
+        await asyncio.sleep(interval)
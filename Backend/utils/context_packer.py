@@ -0,0 +1,173 @@
+"""
+Token-budgeted context packing for the direct chat path.
+
+Calls and transcript windows are ranked against the question with BM25 and
+added greedily until the token budget is used up. The selected call's header
+is always included and its transcript windows are boosted, so follow-up
+questions about the call the user is viewing stay grounded.
+"""
+from typing import Any, Dict, List, Optional
+import logging
+
+from config import (
+    CHAT_CONTEXT_TOKEN_BUDGET,
+    CHAT_CONTEXT_WINDOW_CHARS,
+    CHAT_CONTEXT_SELECTED_BOOST,
+)
+from utils.lexical import tokenize, bm25_scores
+from utils.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tie-break ranks when scores are equal (e.g. questions with no lexical overlap)
+_RANK_SELECTED_WINDOW = 0
+_RANK_HEADER = 1
+_RANK_OTHER_WINDOW = 2
+
+
+def _key_points(call: Dict[str, Any]) -> Optional[str]:
+    aspects = call.get("key_aspects")
+    if isinstance(aspects, list):
+        return ", ".join(aspects)
+    if isinstance(aspects, str):
+        return aspects
+    return None
+
+
+def _call_header_lines(call: Dict[str, Any], selected: bool) -> List[str]:
+    lines = []
+    if not selected:
+        lines.append(f"\n--- Call: {call.get('filename', 'Unknown')} ---")
+    else:
+        lines.append(f"Filename: {call.get('filename', 'Unknown')}")
+    lines.append(f"Created: {call.get('created_at', 'Unknown')}")
+    if call.get("summary"):
+        prefix = "\n" if selected else ""
+        lines.append(f"{prefix}Summary: {call['summary']}")
+    if call.get("duration_minutes"):
+        lines.append(f"Duration: {call['duration_minutes']} minutes")
+    if call.get("no_of_participants"):
+        lines.append(f"Participants: {call['no_of_participants']}")
+    if call.get("sentiment"):
+        lines.append(f"Sentiment: {call['sentiment']}")
+    key_points = _key_points(call)
+    if key_points:
+        lines.append(f"Key Points: {key_points}")
+    return lines
+
+
+def split_transcript_windows(transcript: Optional[str], window_chars: int = CHAT_CONTEXT_WINDOW_CHARS) -> List[str]:
+    """Split a transcript into roughly ``window_chars``-sized windows on word boundaries."""
+    if not transcript:
+        return []
+    windows, current, length = [], [], 0
+    for word in transcript.split():
+        current.append(word)
+        length += len(word) + 1
+        if length >= window_chars:
+            windows.append(" ".join(current))
+            current, length = [], 0
+    if current:
+        windows.append(" ".join(current))
+    return windows
+
+
+def pack_user_context(
+    audio_files: List[Dict[str, Any]],
+    question: str,
+    selected_call_id: Optional[str] = None,
+    token_budget: int = CHAT_CONTEXT_TOKEN_BUDGET,
+    call_windows: Optional[Dict[str, List[str]]] = None,
+) -> str:
+    """Build the chat context string for ``question`` within ``token_budget`` tokens.
+
+    ``call_windows`` maps call ids to retrieved transcript passages. When it is
+    given, only those passages are considered instead of windows cut from the
+    full transcripts.
+    """
+    if not audio_files:
+        return ""
+
+    selected = next(
+        (f for f in audio_files if selected_call_id and f.get("id") == selected_call_id), None
+    )
+    # Most recent first so ties (no lexical overlap) favour recent calls
+    calls = sorted(
+        (f for f in audio_files if f is not selected),
+        key=lambda f: str(f.get("created_at") or ""),
+        reverse=True,
+    )
+    if selected is not None:
+        calls.insert(0, selected)
+
+    query_tokens = tokenize(question)
+    windows = [
+        call_windows.get(call.get("id"), []) if call_windows is not None
+        else split_transcript_windows(call.get("transcript"))
+        for call in calls
+    ]
+
+    call_docs = [
+        tokenize(" ".join(filter(None, [
+            call.get("filename"), call.get("summary"), _key_points(call), call.get("transcript")
+        ])))
+        for call in calls
+    ]
+    call_scores = bm25_scores(query_tokens, call_docs)
+
+    flat_windows = [(i, j) for i, ws in enumerate(windows) for j in range(len(ws))]
+    window_scores = bm25_scores(query_tokens, [tokenize(windows[i][j]) for i, j in flat_windows])
+
+    candidates = []
+    for i, score in enumerate(call_scores):
+        if calls[i] is not selected:
+            candidates.append((score, _RANK_HEADER, i, -1))
+    for (i, j), score in zip(flat_windows, window_scores):
+        if calls[i] is selected:
+            candidates.append((score * CHAT_CONTEXT_SELECTED_BOOST, _RANK_SELECTED_WINDOW, i, j))
+        else:
+            candidates.append((score, _RANK_OTHER_WINDOW, i, j))
+    candidates.sort(key=lambda c: (-c[0], c[1], c[2], c[3]))
+
+    headers = {i: "\n".join(_call_header_lines(call, call is selected)) for i, call in enumerate(calls)}
+    included: Dict[int, List[int]] = {}
+    used = 0
+
+    if selected is not None:
+        included[0] = []
+        used += estimate_tokens(headers[0])
+
+    for _, kind, i, j in candidates:
+        cost = 0 if i in included else estimate_tokens(headers[i])
+        if kind != _RANK_HEADER:
+            cost += estimate_tokens(windows[i][j])
+        if used + cost > token_budget:
+            continue
+        included.setdefault(i, [])
+        if kind != _RANK_HEADER:
+            included[i].append(j)
+        used += cost
+
+    context_parts = []
+    if selected is not None:
+        context_parts.append("=== CURRENTLY SELECTED CALL (User is viewing this call) ===\n")
+        context_parts.append(headers[0])
+        for j in sorted(included[0]):
+            context_parts.append(f"\nTranscript excerpt: {windows[0][j]}")
+        context_parts.append("\n" + "=" * 60 + "\n")
+
+    others = sorted(
+        (i for i in included if calls[i] is not selected),
+        key=lambda i: (-call_scores[i], i),
+    )
+    if others:
+        context_parts.append("\n=== OTHER RELEVANT CALLS ===\n")
+        for i in others:
+            context_parts.append(headers[i])
+            for j in sorted(included[i]):
+                context_parts.append(f"Transcript excerpt: {windows[i][j]}")
+
+    logger.debug(
+        f"Packed context: {len(included)}/{len(calls)} calls, ~{used} tokens of {token_budget}"
+    )
+    return "\n".join(context_parts)
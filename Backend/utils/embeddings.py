@@ -1,9 +1,269 @@
+"""
+Shared embedding service.
+
+Wraps the Gemini embeddings client with a persistent, LRU-evicted vector
+cache keyed by text hash and a micro-batcher that coalesces concurrent
+embed calls arriving within a short window into a single provider request.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from config import GEMINI_API_KEY, EMBEDDINGS_MODEL_NAME
-
-def load_embeddings():
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model=EMBEDDINGS_MODEL_NAME,
-        google_api_key=GEMINI_API_KEY
-    )
-    return embeddings
+
+from config import (
+    GEMINI_API_KEY,
+    EMBEDDINGS_MODEL_NAME,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_BATCH_WINDOW_MS,
+    EMBEDDING_MAX_BATCH_SIZE,
+    EMBEDDING_MAX_CONCURRENT_BATCHES,
+    EMBEDDING_WAIT_TIMEOUT_SECONDS,
+)
+from utils.sqlite_store import open_sqlite
+
+logger = logging.getLogger(__name__)
+
+_TASK_TYPES = {"document": "RETRIEVAL_DOCUMENT", "query": "RETRIEVAL_QUERY"}
+
+
+class EmbeddingCache:
+    """SQLite-backed vector cache with least-recently-used eviction.
+
+    If the cache file can't be opened or used, it behaves as an empty cache and
+    every text is embedded.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._size = 0
+        try:
+            self._conn = open_sqlite(path, """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    cache_key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access);
+                """)
+            self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Embedding cache unavailable, embedding without it: {e}")
+            self._conn = None
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        if not keys or self._conn is None:
+            return {}
+        try:
+            return self._get_many(keys)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            return {}
+
+    def put_many(self, items: List[Tuple[str, List[float]]]) -> None:
+        if not items or self._conn is None:
+            return
+        try:
+            self._put_many(items)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def _get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT cache_key, vector FROM embeddings WHERE cache_key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE cache_key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _put_many(self, items: List[Tuple[str, List[float]]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (cache_key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items],
+            )
+            self._size += len(items)
+            if self._size > self.max_entries:
+                self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                overflow = self._size - self.max_entries
+                if overflow > 0:
+                    # Evict a little extra so we don't pay for eviction on every insert
+                    evict = overflow + self.max_entries // 20
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE cache_key IN "
+                        "(SELECT cache_key FROM embeddings ORDER BY last_access LIMIT ?)",
+                        (evict,),
+                    )
+                    self._size = max(0, self._size - evict)
+            self._conn.commit()
+
+
+class _MicroBatcher:
+    """Collects embed requests for one task type and flushes them as a single batch."""
+
+    def __init__(self, embed_batch, window_seconds: float, max_batch: int, on_flush):
+        self._embed_batch = embed_batch
+        self._window = window_seconds
+        self._max_batch = max_batch
+        self._on_flush = on_flush
+        self._pending: Dict[str, List[Future]] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        # Full batches are flushed in parallel so bulk ingestion isn't serialised
+        self._executor = ThreadPoolExecutor(
+            max_workers=EMBEDDING_MAX_CONCURRENT_BATCHES, thread_name_prefix="embedding-flush"
+        )
+
+    def submit(self, texts: List[str]) -> List[Future]:
+        futures = []
+        with self._cond:
+            for text in texts:
+                future = Future()
+                self._pending.setdefault(text, []).append(future)
+                futures.append(future)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return futures
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self._window
+                while len(self._pending) < self._max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(timeout=remaining)
+                texts = list(self._pending)[: self._max_batch]
+                waiters = {text: self._pending.pop(text) for text in texts}
+
+            self._executor.submit(self._flush, texts, waiters)
+
+    def _flush(self, texts: List[str], waiters: Dict[str, List[Future]]) -> None:
+        try:
+            vectors = self._embed_batch(texts)
+            if len(vectors) != len(texts):
+                raise ValueError(f"Embedding backend returned {len(vectors)} vectors for {len(texts)} texts")
+            self._on_flush(len(texts))
+            for text, vector in zip(texts, vectors):
+                for future in waiters[text]:
+                    future.set_result(vector)
+        except Exception as e:
+            for futures in waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+class EmbeddingService(Embeddings):
+    def __init__(self, backend: GoogleGenerativeAIEmbeddings):
+        self.backend = backend
+        self.cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._batches = 0
+        self._batched_texts = 0
+        self._batchers = {
+            kind: _MicroBatcher(
+                lambda texts, kind=kind: self._embed_batch(kind, texts),
+                EMBEDDING_BATCH_WINDOW_MS / 1000,
+                EMBEDDING_MAX_BATCH_SIZE,
+                self._record_batch,
+            )
+            for kind in _TASK_TYPES
+        }
+
+    def _embed_batch(self, kind: str, texts: List[str]) -> List[List[float]]:
+        return self.backend.embed_documents(texts, task_type=_TASK_TYPES[kind])
+
+    def _record_batch(self, size: int) -> None:
+        with self._stats_lock:
+            self._batches += 1
+            self._batched_texts += size
+        logger.debug(f"Embedded batch of {size} texts, stats={self.stats()}")
+
+    @staticmethod
+    def _cache_key(kind: str, text: str) -> str:
+        return hashlib.sha256(f"{EMBEDDINGS_MODEL_NAME}|{kind}|{text}".encode("utf-8")).hexdigest()
+
+    def _embed(self, kind: str, texts: List[str]) -> List[List[float]]:
+        keys = [self._cache_key(kind, text) for text in texts]
+        cached = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in cached))
+        with self._stats_lock:
+            self._hits += len(texts) - len(missing)
+            self._misses += len(missing)
+
+        if missing:
+            futures = self._batchers[kind].submit(missing)
+            deadline = time.monotonic() + EMBEDDING_WAIT_TIMEOUT_SECONDS
+            vectors = [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+            new_items = [(self._cache_key(kind, text), vector) for text, vector in zip(missing, vectors)]
+            self.cache.put_many(new_items)
+            cached.update(new_items)
+
+        return [cached[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("document", list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("query", [text])[0]
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            lookups = self._hits + self._misses
+            return {
+                "cache_hits": self._hits,
+                "cache_misses": self._misses,
+                "cache_hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+                "batches": self._batches,
+                "avg_batch_size": round(self._batched_texts / self._batches, 2) if self._batches else 0.0,
+            }
+
+
+_service: Optional[EmbeddingService] = None
+_service_lock = threading.Lock()
+
+
+def load_embeddings() -> EmbeddingService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService(
+                    GoogleGenerativeAIEmbeddings(
+                        model=EMBEDDINGS_MODEL_NAME,
+                        google_api_key=GEMINI_API_KEY
+                    )
+                )
+                logger.info(f"Embedding service initialised with cache at: {EMBEDDING_CACHE_PATH}")
+    return _service
@@ -0,0 +1,190 @@
+"""
+Idempotency-Key support for expensive POST endpoints.
+
+The first request with a key claims it and runs the job; its JSON result is
+kept for IDEMPOTENCY_TTL_SECONDS. A retry with the same key either attaches to
+the running job (same worker), waits for it to finish (another worker), or gets
+the stored result back without redoing any work. Failed jobs release their key
+so the client can retry. Reusing a key for a different request is rejected.
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import json
+import logging
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+
+from config import (
+    IDEMPOTENCY_STORE_PATH,
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_LOCK_SECONDS,
+    IDEMPOTENCY_WAIT_SECONDS,
+)
+from utils.sqlite_store import LazySQLite
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+_STATUS_IN_PROGRESS = "in_progress"
+_STATUS_COMPLETED = "completed"
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different payload."""
+
+
+class IdempotencyInProgress(Exception):
+    """The job for this key is still running on another worker."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Request with this Idempotency-Key is still in progress, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope TEXT NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    status TEXT NOT NULL,
+    response TEXT,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (scope, idempotency_key)
+);
+"""
+_db = LazySQLite(IDEMPOTENCY_STORE_PATH, _SCHEMA, "Idempotency store", isolation_level=None)
+_local_jobs: Dict[Tuple[str, str], Tuple[str, asyncio.Future]] = {}
+
+
+def _claim(scope: str, key: str, fingerprint: str) -> Tuple[str, Optional[Any]]:
+    """Atomically claim the key. Returns ("claimed", None) or the existing (status, stored response)."""
+    now = time.time()
+    with _db.lock:
+        conn = _db.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT fingerprint, status, response, created_at, expires_at FROM idempotency_keys "
+                "WHERE scope = ? AND idempotency_key = ?",
+                (scope, key),
+            ).fetchone()
+            if row:
+                stored_fingerprint, status, response, created_at, expires_at = row
+                abandoned = status == _STATUS_IN_PROGRESS and now - created_at > IDEMPOTENCY_LOCK_SECONDS
+                if expires_at <= now or abandoned:
+                    conn.execute(
+                        "DELETE FROM idempotency_keys WHERE scope = ? AND idempotency_key = ?", (scope, key)
+                    )
+                    row = None
+            if row:
+                conn.execute("COMMIT")
+                if stored_fingerprint != fingerprint:
+                    raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+                return status, json.loads(response) if response else None
+
+            conn.execute(
+                "INSERT INTO idempotency_keys (scope, idempotency_key, fingerprint, status, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (scope, key, fingerprint, _STATUS_IN_PROGRESS, now, now + IDEMPOTENCY_TTL_SECONDS),
+            )
+            conn.execute("COMMIT")
+            return "claimed", None
+        except IdempotencyConflict:
+            raise
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def _complete(scope: str, key: str, response: Any) -> None:
+    now = time.time()
+    with _db.lock:
+        _db.connection().execute(
+            "UPDATE idempotency_keys SET status = ?, response = ?, expires_at = ? "
+            "WHERE scope = ? AND idempotency_key = ?",
+            (_STATUS_COMPLETED, json.dumps(response), now + IDEMPOTENCY_TTL_SECONDS, scope, key),
+        )
+
+
+def _release(scope: str, key: str) -> None:
+    with _db.lock:
+        _db.connection().execute(
+            "DELETE FROM idempotency_keys WHERE scope = ? AND idempotency_key = ? AND status = ?",
+            (scope, key, _STATUS_IN_PROGRESS),
+        )
+
+
+def _local_job(scope: str, key: str, fingerprint: str) -> Optional[asyncio.Future]:
+    """The in-process task already running this key, if any."""
+    local = _local_jobs.get((scope, key))
+    if not local:
+        return None
+    local_fingerprint, task = local
+    if local_fingerprint != fingerprint:
+        raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+    return task
+
+
+async def _wait_for_other_worker(scope: str, key: str, fingerprint: str) -> Tuple[str, Optional[Any]]:
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+        task = _local_job(scope, key, fingerprint)
+        if task:
+            return _STATUS_COMPLETED, await asyncio.shield(task)
+        # Returns "claimed" if the other worker failed or abandoned the job
+        status, response = await run_in_threadpool(_claim, scope, key, fingerprint)
+        if status != _STATUS_IN_PROGRESS:
+            return status, response
+    raise IdempotencyInProgress(retry_after=5)
+
+
+async def run_idempotent(
+    scope: str,
+    key: str,
+    fingerprint: str,
+    job: Callable[[], Awaitable[Any]],
+) -> Tuple[Any, bool]:
+    """Run ``job`` at most once per (scope, key). Returns (JSON result, replayed)."""
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+
+    task = _local_job(scope, key, fingerprint)
+    if task:
+        logger.info(f"Idempotency-Key attached to in-progress job: scope={scope}")
+        return await asyncio.shield(task), True
+
+    # SQLite calls run off the event loop; BEGIN IMMEDIATE can wait on another worker's lock
+    status, response = await run_in_threadpool(_claim, scope, key, fingerprint)
+    if status == _STATUS_COMPLETED:
+        logger.info(f"Idempotency-Key replayed stored result: scope={scope}")
+        return response, True
+    if status == _STATUS_IN_PROGRESS:
+        # Another request in this process may have claimed the key while we waited on SQLite
+        task = _local_job(scope, key, fingerprint)
+        if task:
+            logger.info(f"Idempotency-Key attached to in-progress job: scope={scope}")
+            return await asyncio.shield(task), True
+        logger.info(f"Idempotency-Key in progress on another worker, waiting: scope={scope}")
+        status, response = await _wait_for_other_worker(scope, key, fingerprint)
+        if status == _STATUS_COMPLETED:
+            return response, True
+
+    async def _run():
+        try:
+            result = jsonable_encoder(await job())
+        except BaseException:
+            await run_in_threadpool(_release, scope, key)
+            raise
+        await run_in_threadpool(_complete, scope, key, result)
+        return result
+
+    # Runs as its own task so a client disconnect doesn't abandon the job its retry will attach to
+    task = asyncio.ensure_future(_run())
+    _local_jobs[(scope, key)] = (fingerprint, task)
+    task.add_done_callback(lambda _: _local_jobs.pop((scope, key), None))
+    return await asyncio.shield(task), False
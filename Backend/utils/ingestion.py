@@ -0,0 +1,143 @@
+"""
+Idempotent, batched ingestion of transcript chunks into the vector store.
+
+Chunk IDs are ``<audio_file_id>#<sha256(chunk)[:16]>``, so re-ingesting an
+unchanged transcript is a no-op and an edited transcript only embeds the
+chunks that actually changed. Stale chunks of the call are deleted, and
+unchanged chunks that moved get their chunk_index metadata updated without
+re-embedding. The lexical index is synced with the same chunk IDs.
+Embedding and upsert run concurrently in batches with retries.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, TypeVar
+import hashlib
+import logging
+import time
+
+from config import INGEST_BATCH_SIZE, INGEST_MAX_WORKERS, INGEST_MAX_RETRIES
+from utils.embeddings import load_embeddings
+from utils.lexical_index import sync_call_chunks
+from utils.text_processing import split_extracted_text
+from utils.vector_store import (
+    call_vector_id_prefix,
+    delete_vectors,
+    fetch_vector_metadata,
+    list_call_vector_ids,
+    update_vector_metadata,
+    upsert_vectors,
+    user_namespace,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+ProgressCallback = Callable[[int, int], None]
+
+
+def chunk_vector_id(audio_file_id: str, chunk: str) -> str:
+    digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:16]
+    return f"{call_vector_id_prefix(audio_file_id)}{digest}"
+
+
+def _with_retries(fn: Callable[[], T], description: str) -> T:
+    for attempt in range(INGEST_MAX_RETRIES + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == INGEST_MAX_RETRIES:
+                raise
+            delay = 0.5 * 2 ** attempt
+            logger.warning(f"{description} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def ingest_call_chunks(
+    chunks: List[str],
+    user_id: str,
+    audio_file_id: str,
+    batch_size: int = INGEST_BATCH_SIZE,
+    max_workers: int = INGEST_MAX_WORKERS,
+    on_progress: Optional[ProgressCallback] = None,
+) -> Dict[str, int]:
+    namespace = user_namespace(user_id)
+
+    # Identical chunks collapse to one vector; keep the first position for ordering
+    wanted: Dict[str, tuple] = {}
+    for i, chunk in enumerate(chunks):
+        wanted.setdefault(chunk_vector_id(audio_file_id, chunk), (i, chunk))
+
+    # Lexical postings need no embedding, so keep them in step before the vector work
+    sync_call_chunks(namespace, audio_file_id, wanted)
+
+    existing = set(list_call_vector_ids(user_id, audio_file_id))
+    stale = [id_ for id_ in existing if id_ not in wanted]
+    todo = [(id_, i, chunk) for id_, (i, chunk) in wanted.items() if id_ not in existing]
+
+    if stale:
+        _with_retries(lambda: delete_vectors(namespace, stale), f"Deleting stale vectors for {audio_file_id}")
+
+    # Unchanged chunks keep their vectors, but an edit may have moved them
+    kept = [id_ for id_ in wanted if id_ in existing]
+    current = _with_retries(
+        lambda: fetch_vector_metadata(namespace, kept), f"Fetching chunk metadata for {audio_file_id}"
+    ) if kept else {}
+    moved = {
+        id_: {"chunk_index": wanted[id_][0]}
+        for id_ in kept
+        if current.get(id_, {}).get("chunk_index") != wanted[id_][0]
+    }
+    if moved:
+        _with_retries(
+            lambda: update_vector_metadata(namespace, moved), f"Updating chunk positions for {audio_file_id}"
+        )
+
+    embeddings = load_embeddings()
+    batches = [todo[start:start + batch_size] for start in range(0, len(todo), batch_size)]
+
+    def _process(batch) -> int:
+        texts = [chunk for _, _, chunk in batch]
+        vectors = _with_retries(
+            lambda: embeddings.embed_documents(texts),
+            f"Embedding {len(batch)} chunks for {audio_file_id}",
+        )
+        metadatas = [
+            {"user_id": user_id, "audio_file_id": audio_file_id, "chunk_index": i}
+            for _, i, _ in batch
+        ]
+        _with_retries(
+            lambda: upsert_vectors(namespace, [id_ for id_, _, _ in batch], vectors, texts, metadatas),
+            f"Upserting {len(batch)} vectors for {audio_file_id}",
+        )
+        return len(batch)
+
+    done = 0
+    if batches:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest") as executor:
+            for future in as_completed([executor.submit(_process, batch) for batch in batches]):
+                done += future.result()
+                if on_progress:
+                    on_progress(done, len(todo))
+
+    report = {
+        "total": len(wanted),
+        "upserted": done,
+        "skipped": len(wanted) - len(todo),
+        "moved": len(moved),
+        "deleted": len(stale),
+    }
+    logger.info(f"Ingested audio_file_id={audio_file_id}: {report}")
+    return report
+
+
+def ingest_call_transcript(
+    transcript: str,
+    user_id: str,
+    audio_file_id: str,
+    on_progress: Optional[ProgressCallback] = None,
+) -> Dict[str, int]:
+    return ingest_call_chunks(
+        split_extracted_text(transcript or ""),
+        user_id=user_id,
+        audio_file_id=audio_file_id,
+        on_progress=on_progress,
+    )
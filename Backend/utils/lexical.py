@@ -0,0 +1,70 @@
+# Cheap lexical scoring (tokenization + BM25) used to rank calls and transcript text
+# against a question without an embedding round trip.
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Sequence
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Identifier-like tokens are exact-term lookups: multi-digit numbers (not "last 10 calls"),
+# mixed letter/digit codes like INV-4471 or a1b2, and double-quoted phrases
+_EXACT_LOOKUP_RE = re.compile(
+    r"\b\d{2,}\b(?!\s+(?:calls?|meetings?|conversations?|days?|weeks?|months?|years?|minutes?|hours?)\b)"
+    r"|\b(?=[\w/-]*[a-z])(?=[\w/-]*\d)[a-z0-9]+(?:[-_/][a-z0-9]+)*\b"
+    r"|\"[^\"]+\"|\u201c[^\u201d]+\u201d",
+    re.IGNORECASE,
+)
+
+STOPWORDS = frozenset("""
+a about above after again all am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from
+further had has have having he her here hers him his how i if in into is it its itself
+just me more most my no nor not now of off on once only or other our ours out over own
+please same she should so some such tell than that the their them then there these they
+this those through to too under until up very was we were what when where which while
+who whom why will with would you your yours call calls
+""".split())
+
+
+def tokenize(text: str | None) -> List[str]:
+    if not text:
+        return []
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def is_exact_lookup(text: str | None) -> bool:
+    return bool(text and _EXACT_LOOKUP_RE.search(text))
+
+
+def idf(term_doc_freq: int, num_docs: int) -> float:
+    return math.log(1 + (num_docs - term_doc_freq + 0.5) / (term_doc_freq + 0.5))
+
+
+def bm25_scores(query_tokens: Sequence[str], documents: Sequence[Sequence[str]]) -> List[float]:
+    """Score each tokenized document against the query with Okapi BM25."""
+    if not documents:
+        return []
+    query_terms = set(query_tokens)
+    if not query_terms:
+        return [0.0] * len(documents)
+
+    counts = [Counter(doc) for doc in documents]
+    doc_freq: Dict[str, int] = Counter(
+        term for c in counts for term in query_terms if term in c
+    )
+    avg_len = (sum(len(doc) for doc in documents) / len(documents)) or 1.0
+    weights = {term: idf(doc_freq.get(term, 0), len(documents)) for term in query_terms}
+
+    scores = []
+    for doc, c in zip(documents, counts):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(doc) / avg_len)
+        score = 0.0
+        for term in query_terms:
+            tf = c.get(term, 0)
+            if tf:
+                score += weights[term] * tf * (BM25_K1 + 1) / (tf + norm)
+        scores.append(score)
+    return scores
@@ -0,0 +1,168 @@
+"""
+Persistent per-user inverted index over transcript chunks.
+
+Postings are kept in SQLite, partitioned by the same namespace as the vector
+store, and scored with BM25 at query time. That gives exact-term and
+identifier lookups ("invoice 4471") in milliseconds without an embedding call.
+The index is kept in sync incrementally by the ingestion pipeline.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import logging
+import sqlite3
+
+from config import LEXICAL_INDEX_PATH
+from utils.sqlite_store import LazySQLite
+from utils.lexical import BM25_B, BM25_K1, idf, tokenize
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    namespace TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    audio_file_id TEXT NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (namespace, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_chunks_call ON chunks(namespace, audio_file_id);
+
+CREATE TABLE IF NOT EXISTS postings (
+    namespace TEXT NOT NULL,
+    term TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (namespace, term, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings(namespace, chunk_id);
+"""
+_db = LazySQLite(LEXICAL_INDEX_PATH, _SCHEMA, "Lexical index")
+
+
+def _delete_chunks(conn: sqlite3.Connection, namespace: str, chunk_ids: Sequence[str]) -> None:
+    rows = [(namespace, chunk_id) for chunk_id in chunk_ids]
+    conn.executemany("DELETE FROM postings WHERE namespace = ? AND chunk_id = ?", rows)
+    conn.executemany("DELETE FROM chunks WHERE namespace = ? AND chunk_id = ?", rows)
+
+
+def sync_call_chunks(namespace: str, audio_file_id: str, chunks: Dict[str, Tuple[int, str]]) -> None:
+    """Make the indexed chunks of one call match ``chunks`` (chunk id -> (index, text))."""
+    try:
+        with _db.lock:
+            conn = _db.connection()
+            existing = {
+                row[0] for row in conn.execute(
+                    "SELECT chunk_id FROM chunks WHERE namespace = ? AND audio_file_id = ?",
+                    (namespace, audio_file_id),
+                )
+            }
+            stale = [chunk_id for chunk_id in existing if chunk_id not in chunks]
+            new = [(chunk_id, i, text) for chunk_id, (i, text) in chunks.items() if chunk_id not in existing]
+
+            _delete_chunks(conn, namespace, stale)
+            # Unchanged chunks may have moved within an edited transcript
+            conn.executemany(
+                "UPDATE chunks SET chunk_index = ? WHERE namespace = ? AND chunk_id = ? AND chunk_index != ?",
+                [(i, namespace, chunk_id, i) for chunk_id, (i, _) in chunks.items() if chunk_id in existing],
+            )
+            for chunk_id, i, text in new:
+                terms = Counter(tokenize(text))
+                conn.execute(
+                    "INSERT INTO chunks (namespace, chunk_id, audio_file_id, chunk_index, content, length) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (namespace, chunk_id, audio_file_id, i, text, sum(terms.values())),
+                )
+                conn.executemany(
+                    "INSERT INTO postings (namespace, term, chunk_id, tf) VALUES (?, ?, ?, ?)",
+                    [(namespace, term, chunk_id, tf) for term, tf in terms.items()],
+                )
+            conn.commit()
+        logger.debug(f"Lexical index synced for audio_file_id={audio_file_id}: +{len(new)} -{len(stale)}")
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Lexical index update failed for audio_file_id={audio_file_id}: {e}")
+
+
+def delete_call_chunks(namespace: str, audio_file_id: str) -> None:
+    try:
+        with _db.lock:
+            conn = _db.connection()
+            chunk_ids = [
+                row[0] for row in conn.execute(
+                    "SELECT chunk_id FROM chunks WHERE namespace = ? AND audio_file_id = ?",
+                    (namespace, audio_file_id),
+                )
+            ]
+            _delete_chunks(conn, namespace, chunk_ids)
+            conn.commit()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Lexical index delete failed for audio_file_id={audio_file_id}: {e}")
+
+
+def search_chunks(
+    namespace: str,
+    question: str,
+    k: int,
+    audio_file_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """BM25 top-k chunks in ``namespace`` for ``question``, optionally limited to one call."""
+    terms = sorted(set(tokenize(question)))
+    if not terms:
+        return []
+    placeholders = ",".join("?" * len(terms))
+    call_filter = " AND c.audio_file_id = ?" if audio_file_id else ""
+    call_params = (audio_file_id,) if audio_file_id else ()
+
+    try:
+        with _db.lock:
+            conn = _db.connection()
+            num_docs, total_len = conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks c WHERE c.namespace = ?{call_filter}",
+                (namespace, *call_params),
+            ).fetchone()
+            if not num_docs:
+                return []
+            doc_freq = dict(conn.execute(
+                f"SELECT p.term, COUNT(*) FROM postings p JOIN chunks c "
+                f"ON c.namespace = p.namespace AND c.chunk_id = p.chunk_id "
+                f"WHERE p.namespace = ? AND p.term IN ({placeholders}){call_filter} GROUP BY p.term",
+                (namespace, *terms, *call_params),
+            ).fetchall())
+            postings = conn.execute(
+                f"SELECT p.chunk_id, p.term, p.tf, c.length FROM postings p JOIN chunks c "
+                f"ON c.namespace = p.namespace AND c.chunk_id = p.chunk_id "
+                f"WHERE p.namespace = ? AND p.term IN ({placeholders}){call_filter}",
+                (namespace, *terms, *call_params),
+            ).fetchall()
+
+            avg_len = (total_len / num_docs) or 1.0
+            weights = {term: idf(df, num_docs) for term, df in doc_freq.items()}
+            scores: Dict[str, float] = {}
+            for chunk_id, term, tf, length in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + weights[term] * tf * (BM25_K1 + 1) / (tf + norm)
+
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            if not top:
+                return []
+            rows = conn.execute(
+                f"SELECT chunk_id, audio_file_id, chunk_index, content FROM chunks "
+                f"WHERE namespace = ? AND chunk_id IN ({','.join('?' * len(top))})",
+                (namespace, *(chunk_id for chunk_id, _ in top)),
+            ).fetchall()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Lexical search failed: {e}")
+        return []
+
+    by_id = {row[0]: row for row in rows}
+    return [
+        {
+            "audio_file_id": by_id[chunk_id][1],
+            "chunk_index": by_id[chunk_id][2],
+            "content": by_id[chunk_id][3],
+            "score": score,
+        }
+        for chunk_id, score in top
+        if chunk_id in by_id
+    ]
@@ -0,0 +1,306 @@
+"""
+Embedded vector index used as a drop-in alternative to Pinecone.
+
+Each namespace (one per user) is a directory holding a memory-mapped
+float32/float16 matrix of L2-normalised embeddings plus a SQLite sidecar with
+one row per matrix row (id, text, metadata, liveness). Cosine top-k is a
+single vectorised dot product. Appends grow the matrix geometrically, deletes
+only flip the liveness flag and the matrix is compacted once enough rows are
+dead. Upserts and deletes write just the rows they touch.
+
+Several processes (API workers, a backfill run) may share an index directory.
+Writers take an exclusive flock on its lock file from re-reading the sidecar
+through persisting their rows, so they never pick the same free row. Readers
+don't lock; they re-read the sidecar whenever it has changed since they last
+looked.
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from config import (
+    EMBEDDINGS_DIMENSION,
+    LOCAL_VECTOR_STORE_DIR,
+    LOCAL_VECTOR_DTYPE,
+    LOCAL_VECTOR_COMPACT_RATIO,
+    RETRIEVER_TOP_K,
+)
+from utils.sqlite_store import open_sqlite
+
+logger = logging.getLogger(__name__)
+
+_INITIAL_CAPACITY = 256
+_SAFE_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]")
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    row INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    alive INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS info (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def _matches(metadata: Dict[str, Any], metadata_filter: Optional[Dict[str, Any]]) -> bool:
+    if not metadata_filter:
+        return True
+    for key, condition in metadata_filter.items():
+        expected = condition.get("$eq") if isinstance(condition, dict) else condition
+        if metadata.get(key) != expected:
+            return False
+    return True
+
+
+class LocalVectorIndex:
+    def __init__(self, directory: str, dimension: int = EMBEDDINGS_DIMENSION, dtype: str = LOCAL_VECTOR_DTYPE):
+        self.directory = directory
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.RLock()
+        self._vectors_path = os.path.join(directory, "vectors.bin")
+        self._meta_path = os.path.join(directory, "meta.sqlite3")
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(directory, "write.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        self._db = open_sqlite(self._meta_path, _SCHEMA)
+        self._matrix = None
+        # Another process may be creating vectors.bin right now
+        with self._writing():
+            self._load()
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    def _open_matrix(self, capacity: int) -> np.memmap:
+        mode = "r+" if os.path.exists(self._vectors_path) else "w+"
+        matrix = np.memmap(self._vectors_path, dtype=self.dtype, mode=mode, shape=(capacity, self.dimension))
+        return matrix
+
+    def _grow(self, needed: int) -> None:
+        if needed <= self.capacity:
+            return
+        new_capacity = self.capacity
+        while new_capacity < needed:
+            new_capacity *= 2
+        self._matrix.flush()
+        del self._matrix
+        # Extending the file in place keeps the existing rows where they are
+        with open(self._vectors_path, "r+b") as fh:
+            fh.truncate(new_capacity * self.dimension * self.dtype.itemsize)
+        self.capacity = new_capacity
+        self._matrix = self._open_matrix(new_capacity)
+
+    def _load(self) -> None:
+        rows = self._db.execute("SELECT id, text, metadata, alive FROM rows ORDER BY row").fetchall()
+        capacity = self._db.execute("SELECT value FROM info WHERE key = 'capacity'").fetchone()
+        self.ids: List[str] = [r[0] for r in rows]
+        self.texts: List[str] = [r[1] for r in rows]
+        self.metadatas: List[Dict[str, Any]] = [json.loads(r[2]) for r in rows]
+        self.alive = np.array([bool(r[3]) for r in rows], dtype=bool)
+        self._row_of = {id_: row for row, id_ in enumerate(self.ids) if self.alive[row]}
+        if self._matrix is None or (capacity and capacity[0] != self.capacity):
+            self.capacity = capacity[0] if capacity else _INITIAL_CAPACITY
+            self._matrix = self._open_matrix(self.capacity)
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        """Serialise writers across threads and processes."""
+        with self._lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _refresh(self) -> None:
+        """Pick up rows another process committed since we last read the sidecar."""
+        if self._db.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+            logger.debug(f"Reloading local index {self.directory} after an external write")
+            self._load()
+
+    def _persist_rows(self, rows, replace_all: bool = False) -> None:
+        """Write the given rows (and the capacity) to the sidecar in one transaction."""
+        # Vectors reach the file before any sidecar row points at them
+        self._matrix.flush()
+        with self._db:
+            if replace_all:
+                self._db.execute("DELETE FROM rows")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rows (row, id, text, metadata, alive) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (r, self.ids[r], self.texts[r], json.dumps(self.metadatas[r]), int(self.alive[r]))
+                    for r in rows
+                ],
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO info (key, value) VALUES ('capacity', ?)", (self.capacity,)
+            )
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def upsert(
+        self,
+        ids: List[str],
+        vectors: List[List[float]],
+        texts: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        if not ids:
+            return
+        metadatas = metadatas or [{} for _ in ids]
+        normalized = self._normalize(np.asarray(vectors, dtype=np.float32)).astype(self.dtype)
+
+        with self._writing():
+            self._refresh()
+            new_ids = {id_ for id_ in ids if id_ not in self._row_of}
+            self._grow(self.count + len(new_ids))
+            self.alive = np.concatenate([self.alive, np.ones(len(new_ids), dtype=bool)])
+
+            touched = []
+            for i, id_ in enumerate(ids):
+                row = self._row_of.get(id_)
+                if row is None:
+                    row = len(self.ids)
+                    self.ids.append(id_)
+                    self.texts.append(texts[i])
+                    self.metadatas.append(metadatas[i])
+                    self._row_of[id_] = row
+                else:
+                    self.texts[row] = texts[i]
+                    self.metadatas[row] = metadatas[i]
+                self._matrix[row] = normalized[i]
+                touched.append(row)
+            self._persist_rows(touched)
+
+    def get_metadata(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            self._refresh()
+            return {id_: dict(self.metadatas[self._row_of[id_]]) for id_ in ids if id_ in self._row_of}
+
+    def update_metadata(self, updates: Dict[str, Dict[str, Any]]) -> int:
+        """Merge fields into the metadata of existing rows without touching their vectors."""
+        with self._writing():
+            self._refresh()
+            touched = []
+            for id_, fields in updates.items():
+                row = self._row_of.get(id_)
+                if row is not None:
+                    self.metadatas[row] = {**self.metadatas[row], **fields}
+                    touched.append(row)
+            if touched:
+                self._persist_rows(touched)
+            return len(touched)
+
+    def list_ids(self, prefix: str = "") -> List[str]:
+        with self._lock:
+            self._refresh()
+            return [id_ for id_ in self._row_of if id_.startswith(prefix)]
+
+    def delete(self, ids: List[str]) -> int:
+        with self._writing():
+            self._refresh()
+            dead_rows = []
+            for id_ in ids:
+                row = self._row_of.pop(id_, None)
+                if row is not None:
+                    self.alive[row] = False
+                    dead_rows.append(row)
+            if dead_rows:
+                dead = self.count - len(self._row_of)
+                if self.count and dead / self.count >= LOCAL_VECTOR_COMPACT_RATIO:
+                    self._compact()
+                else:
+                    self._persist_rows(dead_rows)
+            return len(dead_rows)
+
+    def _compact(self) -> None:
+        keep = np.flatnonzero(self.alive)
+        logger.debug(f"Compacting local index {self.directory}: {self.count} -> {len(keep)} rows")
+        live = np.array(self._matrix[keep])
+        self.ids = [self.ids[r] for r in keep]
+        self.texts = [self.texts[r] for r in keep]
+        self.metadatas = [self.metadatas[r] for r in keep]
+        self.alive = np.ones(len(keep), dtype=bool)
+        self._row_of = {id_: row for row, id_ in enumerate(self.ids)}
+        self._matrix[: len(keep)] = live
+        self._persist_rows(range(len(keep)), replace_all=True)
+
+    def search(
+        self,
+        query_vector: List[float],
+        k: int = RETRIEVER_TOP_K,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[Document, float]]:
+        query = self._normalize(np.asarray([query_vector], dtype=np.float32))[0]
+        with self._lock:
+            self._refresh()
+            n = self.count
+            if n == 0 or not self._row_of:
+                return []
+            scores = np.asarray(self._matrix[:n] @ query, dtype=np.float32)
+            mask = self.alive.copy()
+            if metadata_filter:
+                mask &= np.fromiter(
+                    (_matches(m, metadata_filter) for m in self.metadatas), dtype=bool, count=n
+                )
+            scores[~mask] = -np.inf
+            k = min(k, int(mask.sum()))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                (Document(page_content=self.texts[r], metadata=dict(self.metadatas[r])), float(scores[r]))
+                for r in top
+            ]
+
+
+_indexes: Dict[str, LocalVectorIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_local_index(namespace: Optional[str]) -> LocalVectorIndex:
+    name = _SAFE_NAME_RE.sub("_", namespace or "default")
+    with _indexes_lock:
+        if name not in _indexes:
+            _indexes[name] = LocalVectorIndex(os.path.join(LOCAL_VECTOR_STORE_DIR, name))
+        return _indexes[name]
+
+
+class LocalVectorRetriever(BaseRetriever):
+    """LangChain retriever over a LocalVectorIndex namespace."""
+
+    namespace: Optional[str] = None
+    embeddings: Embeddings
+    k: int = RETRIEVER_TOP_K
+    metadata_filter: Optional[Dict[str, Any]] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        index = get_local_index(self.namespace)
+        hits = index.search(self.embeddings.embed_query(query), k=self.k, metadata_filter=self.metadata_filter)
+        return [doc for doc, _ in hits]
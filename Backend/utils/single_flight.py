@@ -0,0 +1,83 @@
+"""
+Single-flight request coalescing.
+
+Concurrent callers with the same key share one in-flight computation: the
+first caller runs it, the rest wait and receive the same result (or
+exception). Nothing is cached once the call completes. ``do`` is for code
+running in threads, ``do_async`` for coroutines on the event loop.
+"""
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+import asyncio
+import logging
+import threading
+
+from utils.cancellation import OperationCancelled
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            logger.debug(f"[{self.name}] Joining in-flight call for key={key[:16]}")
+            call.done.wait()
+            if isinstance(call.error, OperationCancelled):
+                # The leader's client went away; that doesn't cancel this caller, so run it again
+                return self.do(key, fn)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+            if call.waiters:
+                logger.info(f"[{self.name}] Shared one result with {call.waiters} duplicate request(s)")
+
+    async def do_async(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.coalesced += 1
+            logger.info(f"[{self.name}] Joining in-flight request for key={key[:16]}")
+        # Shield so one caller disconnecting doesn't cancel the work for the others
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls) + len(self._tasks), "coalesced": self.coalesced}
@@ -0,0 +1,43 @@
+"""
+Shared setup for the local SQLite files under data/cache.
+
+Every cache/index opens its file the same way: create the directory, connect
+with check_same_thread=False (callers serialise access with their own lock),
+switch to WAL and create the schema. ``LazySQLite`` defers that until first use
+so importing a module never touches the disk.
+"""
+from typing import Optional
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def open_sqlite(path: str, schema: str, isolation_level: Optional[str] = "") -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=isolation_level)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(schema)
+    conn.commit()
+    return conn
+
+
+class LazySQLite:
+    def __init__(self, path: str, schema: str, name: str, isolation_level: Optional[str] = ""):
+        self.path = path
+        self.schema = schema
+        self.name = name
+        self.isolation_level = isolation_level
+        self.lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def connection(self) -> sqlite3.Connection:
+        """Open on first use. Callers hold ``lock`` while using the connection."""
+        if self._conn is None:
+            self._conn = open_sqlite(self.path, self.schema, self.isolation_level)
+            logger.info(f"{self.name} opened at: {self.path}")
+        return self._conn
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from config import (
+    SUMMARY_CACHE_ENABLED,
+    SUMMARY_CACHE_PATH,
+    SUMMARY_CACHE_TTL_SECONDS,
+    SUMMARY_CACHE_MAX_ENTRIES,
+)
+from utils.sqlite_store import LazySQLite
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    cache_key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_summaries_created_at ON summaries(created_at);
+"""
+_db = LazySQLite(SUMMARY_CACHE_PATH, _SCHEMA, "Summary cache")
+
+
+def build_summary_cache_key(
+    transcript: str,
+    prompt_version: str,
+    model_name: str,
+    temperature: float,
+) -> str:
+    transcript_hash = hashlib.sha256(transcript.encode("utf-8")).hexdigest()
+    raw = f"{transcript_hash}|{prompt_version}|{model_name}|{temperature}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_cached_summary(cache_key: str) -> Optional[Dict[str, Any]]:
+    if not SUMMARY_CACHE_ENABLED:
+        return None
+    try:
+        with _db.lock:
+            row = _db.connection().execute(
+                "SELECT payload FROM summaries WHERE cache_key = ? AND created_at > ?",
+                (cache_key, time.time() - SUMMARY_CACHE_TTL_SECONDS),
+            ).fetchone()
+    # OSError covers an unwritable cache directory; either way, just skip the cache
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Summary cache lookup failed: {e}")
+        return None
+    return json.loads(row[0]) if row else None
+
+
+def store_summary(cache_key: str, summary: Dict[str, Any]) -> None:
+    if not SUMMARY_CACHE_ENABLED:
+        return
+    try:
+        with _db.lock:
+            conn = _db.connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (cache_key, payload, created_at) VALUES (?, ?, ?)",
+                (cache_key, json.dumps(summary), time.time()),
+            )
+            # Drop expired entries and keep only the newest SUMMARY_CACHE_MAX_ENTRIES
+            conn.execute(
+                "DELETE FROM summaries WHERE created_at <= ?", (time.time() - SUMMARY_CACHE_TTL_SECONDS,)
+            )
+            conn.execute(
+                "DELETE FROM summaries WHERE cache_key IN (SELECT cache_key FROM summaries "
+                "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (SUMMARY_CACHE_MAX_ENTRIES,),
+            )
+            conn.commit()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Summary cache write failed: {e}")
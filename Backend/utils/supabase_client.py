@@ -1,9 +1,19 @@
 from supabase import create_client, Client
-from config import SUPABASE_URL, SUPABASE_KEY, SUPABASE_SERVICE_KEY
-from typing import Optional, Dict, Any, List
+from config import (
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    SUPABASE_SERVICE_KEY,
+    SIGNED_URL_REFRESH_MARGIN,
+    SIGNED_URL_CACHE_MAX_ENTRIES,
+)
+from typing import Optional, Dict, Any, List, Tuple
 import logging
+import time
 
 logger = logging.getLogger(__name__)
+
+# (bucket_name, file_path, expires_in) -> (signed_url, expires_at)
+_SIGNED_URL_CACHE: Dict[Tuple[str, str, int], Tuple[str, float]] = {}
 class SupabaseClient:
     _anon: Optional[Client] = None
     _service: Optional[Client] = None
@@ -101,16 +111,82 @@ async def delete_file_from_storage(bucket_name: str, file_path: str):
     logger.debug(f"Deleting file from storage: bucket={bucket_name}, path={file_path}")
     client = SupabaseClient.service()
     client.storage.from_(bucket_name).remove([file_path])
+    invalidate_signed_urls(bucket_name, file_path)
     logger.info(f"File deleted from storage: {file_path}")
 
 
+def _get_cached_signed_url(bucket_name: str, file_path: str, expires_in: int) -> Optional[str]:
+    cached = _SIGNED_URL_CACHE.get((bucket_name, file_path, expires_in))
+    if cached is None:
+        return None
+    url, expires_at = cached
+    # Only hand out URLs that still have a useful lifetime left for the client
+    if expires_at - time.monotonic() <= min(SIGNED_URL_REFRESH_MARGIN, expires_in / 2):
+        _SIGNED_URL_CACHE.pop((bucket_name, file_path, expires_in), None)
+        return None
+    return url
+
+
+def _cache_signed_url(bucket_name: str, file_path: str, expires_in: int, url: str):
+    if len(_SIGNED_URL_CACHE) >= SIGNED_URL_CACHE_MAX_ENTRIES:
+        now = time.monotonic()
+        for key in [k for k, (_, exp) in _SIGNED_URL_CACHE.items() if exp <= now]:
+            _SIGNED_URL_CACHE.pop(key, None)
+        while len(_SIGNED_URL_CACHE) >= SIGNED_URL_CACHE_MAX_ENTRIES:
+            _SIGNED_URL_CACHE.pop(next(iter(_SIGNED_URL_CACHE)))
+    _SIGNED_URL_CACHE[(bucket_name, file_path, expires_in)] = (url, time.monotonic() + expires_in)
+
+
+def invalidate_signed_urls(bucket_name: str, file_path: str):
+    for key in [k for k in _SIGNED_URL_CACHE if k[0] == bucket_name and k[1] == file_path]:
+        _SIGNED_URL_CACHE.pop(key, None)
+
+
 async def get_signed_file_url(bucket_name: str, file_path: str, expires_in: int):
+    cached = _get_cached_signed_url(bucket_name, file_path, expires_in)
+    if cached:
+        logger.debug(f"Signed URL cache hit for: {file_path}")
+        return cached
+
     logger.debug(f"Creating signed URL for: {file_path}, expires_in={expires_in}s")
     client = SupabaseClient.service()
     res = client.storage.from_(bucket_name).create_signed_url(file_path, expires_in)
+    _cache_signed_url(bucket_name, file_path, expires_in, res["signedURL"])
     return res["signedURL"]
 
 
+async def get_signed_file_urls(
+    bucket_name: str,
+    file_paths: List[str],
+    expires_in: int,
+) -> Dict[str, str]:
+    """Sign several storage paths at once, reusing cached URLs where possible."""
+    urls: Dict[str, str] = {}
+    missing = []
+    for path in dict.fromkeys(file_paths):
+        cached = _get_cached_signed_url(bucket_name, path, expires_in)
+        if cached:
+            urls[path] = cached
+        else:
+            missing.append(path)
+    cache_hits = len(urls)
+
+    if missing:
+        logger.debug(f"Creating {len(missing)} signed URLs in one batch, expires_in={expires_in}s")
+        client = SupabaseClient.service()
+        res = client.storage.from_(bucket_name).create_signed_urls(missing, expires_in)
+        for item in res:
+            signed_url = item.get("signedURL") or item.get("signedUrl")
+            if item.get("error") or not signed_url:
+                logger.warning(f"Failed to sign URL for: {item.get('path')}")
+                continue
+            _cache_signed_url(bucket_name, item["path"], expires_in, signed_url)
+            urls[item["path"]] = signed_url
+
+    logger.debug(f"Signed {len(urls)} URLs ({cache_hits} from cache)")
+    return urls
+
+
 async def insert_record(table: str, data: Dict[str, Any], access_token: str):
     logger.debug(f"Inserting record into table: {table}")
     client = get_authed_rls_client(access_token)
@@ -127,6 +203,30 @@ async def update_record(table: str, record_id: str, data: Dict[str, Any], access
     return res.data[0]
 
 
+async def insert_service_record(table: str, data: Dict[str, Any]):
+    """Insert with the service client, for server-side writes that must not depend on a user's JWT.
+
+    Callers are responsible for scoping ``data`` to the right user.
+    """
+    logger.debug(f"Inserting record into table (service): {table}")
+    res = SupabaseClient.service().table(table).insert(data).execute()
+    return res.data[0]
+
+
+async def update_user_record(table: str, record_id: str, user_id: str, data: Dict[str, Any]):
+    """Update with the service client, restricted to rows owned by ``user_id``."""
+    logger.debug(f"Updating record in table (service): {table}, id={record_id}")
+    res = SupabaseClient.service().table(table).update(data).eq("id", record_id).eq("user_id", user_id).execute()
+    return res.data[0] if res.data else None
+
+
+async def call_rpc(function: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    logger.debug(f"Calling RPC: {function}")
+    client = SupabaseClient.service()
+    res = client.rpc(function, params).execute()
+    return res.data or []
+
+
 async def get_records(
     table: str,
     filters: Optional[Dict[str, Any]] = None,
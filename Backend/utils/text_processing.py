@@ -1,6 +1,6 @@
 from utils.audio import transcribe_audio_simple
 
-from langchain.text_splitters import RecursiveCharacterTextSplitter
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 from config import CHUNK_SIZE, CHUNK_OVERLAP, TEXT_SEPARATORS
 
 def text_extractor(audio_file_path):
@@ -0,0 +1,9 @@
+# Rough token accounting shared by the rate limiter and prompt budgeting.
+# ~4 characters per token is close enough for English text on both Gemini and Groq.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str | None) -> int:
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
@@ -0,0 +1,54 @@
+"""
+Client for the transcription worker service (transcriber.py).
+
+The API process saves the upload to a temp file and sends its path over the
+Unix socket; the worker on the same host reads the file and replies with the
+transcript. Cancelling the token tells the worker to stop between segments.
+Messages are JSON, never pickles, so a peer can't make the other side run code.
+"""
+from multiprocessing.connection import Client, Connection
+from typing import Any, Dict, Optional
+import json
+import logging
+import os
+
+from config import TRANSCRIBER_SOCKET, TRANSCRIBER_AUTHKEY, CANCEL_POLL_SECONDS
+from utils.cancellation import CancelToken
+
+logger = logging.getLogger(__name__)
+
+
+def send_message(conn: Connection, message: Dict[str, Any]) -> None:
+    conn.send_bytes(json.dumps(message).encode("utf-8"))
+
+
+def recv_message(conn: Connection) -> Dict[str, Any]:
+    """Raises ValueError for anything but a JSON object."""
+    message = json.loads(conn.recv_bytes().decode("utf-8"))
+    if not isinstance(message, dict):
+        raise ValueError("Expected a JSON object")
+    return message
+
+
+def transcribe_remote(audio_file_path: str, model_size: str, cancel_token: Optional[CancelToken] = None) -> str:
+    logger.info(f"Sending transcription job to worker: file={audio_file_path}, model={model_size}")
+    try:
+        conn = Client(TRANSCRIBER_SOCKET, family="AF_UNIX", authkey=TRANSCRIBER_AUTHKEY.encode())
+    except OSError as e:
+        logger.error(f"Transcription worker unavailable at {TRANSCRIBER_SOCKET}: {e}")
+        raise RuntimeError("Transcription service is unavailable")
+
+    with conn:
+        send_message(conn, {"op": "transcribe", "path": os.path.abspath(audio_file_path), "model_size": model_size})
+        while not conn.poll(CANCEL_POLL_SECONDS):
+            if cancel_token and cancel_token.cancelled:
+                send_message(conn, {"op": "cancel"})
+                cancel_token.raise_if_cancelled()
+        reply = recv_message(conn)
+
+    if reply["ok"]:
+        return reply["text"]
+    # Keep ValueError distinct so the endpoints still answer 400 for bad input
+    if reply.get("error_type") == "ValueError":
+        raise ValueError(reply["error"])
+    raise RuntimeError(f"Transcription failed: {reply['error']}")
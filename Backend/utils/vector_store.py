@@ -1,7 +1,15 @@
 from pinecone import Pinecone, ServerlessSpec
 from langchain_pinecone import PineconeVectorStore
 from utils.embeddings import load_embeddings
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from utils.local_vector_store import LocalVectorRetriever, get_local_index
+from functools import lru_cache
+import logging
+import threading
+import uuid
 from config import (
+    VECTOR_STORE_BACKEND,
     PINECONE_API_KEY,
     PINECONE_INDEX_NAME,
     PINECONE_DIMENSION,
@@ -9,46 +17,176 @@ from config import (
     PINECONE_CLOUD,
     PINECONE_REGION,
     RETRIEVER_SEARCH_TYPE,
-    RETRIEVER_TOP_K
+    RETRIEVER_TOP_K,
+    VECTORSTORE_CACHE_SIZE
 )
 
-pc = Pinecone(api_key=PINECONE_API_KEY)
+logger = logging.getLogger(__name__)
+
+pc = Pinecone(api_key=PINECONE_API_KEY) if VECTOR_STORE_BACKEND == "pinecone" else None
+
+def use_local_backend() -> bool:
+    return VECTOR_STORE_BACKEND == "local"
+
+_index_ready = False
+_index_lock = threading.Lock()
 
 def get_or_create_index():
-    existing_indexes = [i["name"] for i in pc.list_indexes()]
-
-    if PINECONE_INDEX_NAME not in existing_indexes:
-        pc.create_index(
-            name=PINECONE_INDEX_NAME,
-            dimension=PINECONE_DIMENSION,
-            metric=PINECONE_METRIC,
-            spec=ServerlessSpec(
-                cloud=PINECONE_CLOUD,
-                region=PINECONE_REGION
-            )
-        )
+    global _index_ready
+    if _index_ready:
+        return PINECONE_INDEX_NAME
+
+    with _index_lock:
+        if not _index_ready:
+            existing_indexes = [i["name"] for i in pc.list_indexes()]
+
+            if PINECONE_INDEX_NAME not in existing_indexes:
+                pc.create_index(
+                    name=PINECONE_INDEX_NAME,
+                    dimension=PINECONE_DIMENSION,
+                    metric=PINECONE_METRIC,
+                    spec=ServerlessSpec(
+                        cloud=PINECONE_CLOUD,
+                        region=PINECONE_REGION
+                    )
+                )
+            _index_ready = True
 
     return PINECONE_INDEX_NAME
 
-def ingest_text_chunks(chunks: list[str]):
-    embeddings = load_embeddings()
-    index_name = get_or_create_index()
+@lru_cache(maxsize=1)
+def get_index():
+    return pc.Index(get_or_create_index())
 
-    vectorstore = PineconeVectorStore.from_texts(
-        texts=chunks,
-        embedding=embeddings,
-        index_name=index_name
+@lru_cache(maxsize=VECTORSTORE_CACHE_SIZE)
+def get_pinecone_vectorstore(namespace: Optional[str] = None) -> PineconeVectorStore:
+    # The store only wraps the shared index handle and embedding service, so it's safe to share
+    return PineconeVectorStore(
+        index=get_index(),
+        embedding=load_embeddings(),
+        namespace=namespace
     )
-    return vectorstore
 
-def get_retriever():
+def user_namespace(user_id: str) -> str:
+    return f"user-{user_id}"
+
+def call_vector_id_prefix(audio_file_id: str) -> str:
+    return f"{audio_file_id}#"
+
+def ingest_text_chunks(
+    chunks: list[str],
+    metadatas: Optional[List[Dict[str, Any]]] = None,
+    ids: Optional[List[str]] = None,
+    namespace: Optional[str] = None
+):
     embeddings = load_embeddings()
 
-    vectorstore = PineconeVectorStore(
-        index_name=PINECONE_INDEX_NAME,
-        embedding=embeddings
+    if use_local_backend():
+        index = get_local_index(namespace)
+        ids = ids or [str(uuid.uuid4()) for _ in chunks]
+        index.upsert(ids, embeddings.embed_documents(chunks), chunks, metadatas)
+        return index
+
+    vectorstore = get_pinecone_vectorstore(namespace)
+    vectorstore.add_texts(texts=chunks, metadatas=metadatas, ids=ids, namespace=namespace)
+    return vectorstore
+
+def list_call_vector_ids(user_id: str, audio_file_id: str) -> List[str]:
+    namespace = user_namespace(user_id)
+    prefix = call_vector_id_prefix(audio_file_id)
+    if use_local_backend():
+        return get_local_index(namespace).list_ids(prefix=prefix)
+    # Serverless indexes can't filter deletes by metadata, so calls are tracked by ID prefix
+    return [id_ for id_batch in get_index().list(prefix=prefix, namespace=namespace) for id_ in id_batch]
+
+def upsert_vectors(
+    namespace: str,
+    ids: List[str],
+    vectors: List[List[float]],
+    texts: List[str],
+    metadatas: List[Dict[str, Any]]
+) -> None:
+    if use_local_backend():
+        get_local_index(namespace).upsert(ids, vectors, texts, metadatas)
+        return
+    # Store the chunk under the same "text" key PineconeVectorStore reads back
+    get_index().upsert(
+        vectors=[
+            {"id": id_, "values": vector, "metadata": {**metadata, "text": text}}
+            for id_, vector, text, metadata in zip(ids, vectors, texts, metadatas)
+        ],
+        namespace=namespace
     )
 
+def fetch_vector_metadata(namespace: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    if not ids:
+        return {}
+    if use_local_backend():
+        return get_local_index(namespace).get_metadata(ids)
+    index = get_index()
+    metadata = {}
+    # IDs go in the query string, so keep requests short
+    for start in range(0, len(ids), 100):
+        res = index.fetch(ids=ids[start:start + 100], namespace=namespace)
+        metadata.update({id_: dict(vector.metadata or {}) for id_, vector in res.vectors.items()})
+    return metadata
+
+def update_vector_metadata(namespace: str, updates: Dict[str, Dict[str, Any]]) -> int:
+    """Merge metadata fields into existing vectors; no re-embedding."""
+    if not updates:
+        return 0
+    if use_local_backend():
+        return get_local_index(namespace).update_metadata(updates)
+    index = get_index()
+    for id_, fields in updates.items():
+        index.update(id=id_, set_metadata=fields, namespace=namespace)
+    return len(updates)
+
+def delete_vectors(namespace: str, ids: List[str]) -> int:
+    if not ids:
+        return 0
+    if use_local_backend():
+        return get_local_index(namespace).delete(ids)
+    index = get_index()
+    for start in range(0, len(ids), 1000):
+        index.delete(ids=ids[start:start + 1000], namespace=namespace)
+    return len(ids)
+
+def delete_call_vectors(user_id: str, audio_file_id: str) -> int:
+    deleted = delete_vectors(user_namespace(user_id), list_call_vector_ids(user_id, audio_file_id))
+    logger.info(f"Deleted {deleted} vectors for audio_file_id={audio_file_id}")
+    return deleted
+
+def search_user_chunks(
+    question: str,
+    user_id: str,
+    k: int = RETRIEVER_TOP_K,
+    audio_file_id: Optional[str] = None
+) -> List[Tuple[Document, float]]:
+    metadata_filter = None
+    if audio_file_id:
+        metadata_filter = {"audio_file_id": {"$eq": audio_file_id}}
+
+    if use_local_backend():
+        query_vector = load_embeddings().embed_query(question)
+        return get_local_index(user_namespace(user_id)).search(query_vector, k=k, metadata_filter=metadata_filter)
+
+    vectorstore = get_pinecone_vectorstore(user_namespace(user_id))
+    return vectorstore.similarity_search_with_score(question, k=k, filter=metadata_filter)
+
+@lru_cache(maxsize=VECTORSTORE_CACHE_SIZE)
+def get_retriever(user_id: Optional[str] = None):
+    namespace = user_namespace(user_id) if user_id else None
+
+    if use_local_backend():
+        return LocalVectorRetriever(
+            namespace=namespace,
+            embeddings=load_embeddings(),
+            k=RETRIEVER_TOP_K
+        )
+
+    vectorstore = get_pinecone_vectorstore(namespace)
+
     return vectorstore.as_retriever(
         search_type=RETRIEVER_SEARCH_TYPE,
         search_kwargs={"k": RETRIEVER_TOP_K}